@@ -2,14 +2,23 @@
 #include <stddef.h>
 #include <stdio.h>
 #include <stdlib.h>
+#include <time.h>
+#if defined(__x86_64__) || defined(__i386__)
+#include <x86intrin.h>
+#define READ_CYCLES() __rdtsc()
+#else
+#define READ_CYCLES() UINT64_C(0)
+#endif
 
 #define WORD_SIZE (BLOCK_SIZE / 2)
 #define KEY_WORDS (KEY_SIZE / WORD_SIZE)
-#define ROTATE_RIGHT(x, pos) ((x >> pos) | (x << (WORD_SIZE - pos)))
-#define ROTATE_LEFT(x, pos) ((x << pos) | (x >> (WORD_SIZE - pos)))
+// Required for word sizes which are smaller than the word type (24 and 48 bits).
+#define WORD_MASK ((WORD_TYPE) ((UINT64_C(1) << (WORD_SIZE - 1) << 1) - 1))
+#define ROTATE_RIGHT(x, pos) (((x >> pos) | (x << (WORD_SIZE - pos))) & WORD_MASK)
+#define ROTATE_LEFT(x, pos) (((x << pos) | (x >> (WORD_SIZE - pos))) & WORD_MASK)
 #define ROUND(k, x, y) ( \
     x = ROTATE_RIGHT(x, ALPHA), \
-    x += y, \
+    x = (x + y) & WORD_MASK, \
     x ^= k, \
     y = ROTATE_LEFT(y, BETA), \
     y ^= x \
@@ -41,6 +50,71 @@ void encrypt(WORD_TYPE k[ROUNDS], WORD_TYPE p[2], WORD_TYPE c[2]) {
     }
 }
 
+void encrypt_blocks(WORD_TYPE k[ROUNDS], WORD_TYPE *in, WORD_TYPE *out, size_t n) {
+    for (size_t i = 0; i < n; i++) {
+        encrypt(k, &in[2 * i], &out[2 * i]);
+    }
+}
+
+// Define SPECK_NO_MAIN to include this file in another program, e.g. the conformance verifier.
+#ifndef SPECK_NO_MAIN
+#define BENCHMARK_BATCH_BLOCKS 64
+#define BENCHMARK_WARMUP_BLOCKS 16384
+#define BENCHMARK_WARMUP_PASSES 2
+
+int compare_cycles(const void *a, const void *b) {
+    uint64_t x = *(const uint64_t *) a;
+    uint64_t y = *(const uint64_t *) b;
+    return (x > y) - (x < y);
+}
+
+// The same benchmark harness as the white-box implementations, so their results can be compared.
+int benchmark(WORD_TYPE k[ROUNDS], size_t iterations) {
+    size_t batches = (iterations + BENCHMARK_BATCH_BLOCKS - 1) / BENCHMARK_BATCH_BLOCKS;
+    size_t blocks = batches * BENCHMARK_BATCH_BLOCKS;
+    WORD_TYPE *in = malloc(2 * blocks * sizeof(WORD_TYPE));
+    WORD_TYPE *out = malloc(2 * blocks * sizeof(WORD_TYPE));
+    uint64_t *latencies = malloc(batches * sizeof(uint64_t));
+    if (batches == 0 || in == NULL || out == NULL || latencies == NULL) {
+        return -1;
+    }
+    for (size_t i = 0; i < 2 * blocks; i++) {
+        in[i] = ((((WORD_TYPE) rand()) << (WORD_SIZE / 2)) | ((WORD_TYPE) rand())) & WORD_MASK;
+    }
+    size_t warmup_blocks = blocks < BENCHMARK_WARMUP_BLOCKS ? blocks : BENCHMARK_WARMUP_BLOCKS;
+    for (size_t i = 0; i < BENCHMARK_WARMUP_PASSES; i++) {
+        encrypt_blocks(k, in, out, warmup_blocks);
+    }
+
+    struct timespec start;
+    struct timespec end;
+    clock_gettime(CLOCK_MONOTONIC, &start);
+    uint64_t start_cycles = READ_CYCLES();
+    for (size_t i = 0; i < batches; i++) {
+        uint64_t batch_start_cycles = READ_CYCLES();
+        encrypt_blocks(k, &in[2 * i * BENCHMARK_BATCH_BLOCKS], &out[2 * i * BENCHMARK_BATCH_BLOCKS], BENCHMARK_BATCH_BLOCKS);
+        latencies[i] = READ_CYCLES() - batch_start_cycles;
+    }
+    uint64_t cycles = READ_CYCLES() - start_cycles;
+    clock_gettime(CLOCK_MONOTONIC, &end);
+
+    uint64_t checksum = 0;
+    for (size_t i = 0; i < 2 * blocks; i++) {
+        checksum = (checksum * UINT64_C(1099511628211)) ^ (uint64_t) out[i];
+    }
+    qsort(latencies, batches, sizeof(uint64_t), compare_cycles);
+    double seconds = (end.tv_sec - start.tv_sec) + (end.tv_nsec - start.tv_nsec) / 1e9;
+    printf("{\"blocks\": %zu, \"block_bytes\": %d, \"seconds\": %.9f, \"blocks_per_second\": %.1f, \"cycles\": %" PRIu64 ", \"cycles_per_byte\": %.3f, "
+           "\"latency_cycles_per_block\": {\"p50\": %.1f, \"p90\": %.1f, \"p99\": %.1f, \"max\": %.1f}, \"checksum\": \"%016" PRIx64 "\"}\n",
+           blocks, BLOCK_SIZE / 8, seconds, blocks / seconds, cycles, (double) cycles / (blocks * (BLOCK_SIZE / 8)),
+           (double) latencies[batches / 2] / BENCHMARK_BATCH_BLOCKS, (double) latencies[batches * 9 / 10] / BENCHMARK_BATCH_BLOCKS,
+           (double) latencies[batches * 99 / 100] / BENCHMARK_BATCH_BLOCKS, (double) latencies[batches - 1] / BENCHMARK_BATCH_BLOCKS, checksum);
+    free(in);
+    free(out);
+    free(latencies);
+    return 0;
+}
+
 int main(int argc, char *argv[]) {
     WORD_TYPE key[KEY_WORDS] = KEY;
     WORD_TYPE k[ROUNDS];
@@ -54,11 +128,7 @@ int main(int argc, char *argv[]) {
     if (argc < 3) {
         size_t iterations;
         sscanf(argv[1], "%zu", &iterations);
-        for (int i = 0; i < iterations; i++) {
-            p[0] = (((WORD_TYPE) rand()) << (WORD_SIZE / 2)) | ((WORD_TYPE) rand());
-            p[1] = (((WORD_TYPE) rand()) << (WORD_SIZE / 2)) | ((WORD_TYPE) rand());
-            encrypt(k, p, c);
-        }
+        return benchmark(k, iterations);
     } else {
         sscanf(argv[1], "%" WORD_IN_TYPE, &p[0]);
         sscanf(argv[2], "%" WORD_IN_TYPE, &p[1]);
@@ -66,3 +136,4 @@ int main(int argc, char *argv[]) {
         printf("%" WORD_OUT_TYPE " %" WORD_OUT_TYPE "\n", c[0], c[1]);
     }
 }
+#endif
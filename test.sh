@@ -46,33 +46,54 @@ CIPHERTEXTS=(
 STRATEGIES=(
 "default_white_box_speck.c"
 "sparse_matrix_white_box_speck.c"
+"csr_matrix_white_box_speck.c"
 "inlined_white_box_speck.c"
 "bit_packed_white_box_speck.c"
+"column_bit_packed_white_box_speck.c"
+"pext_bit_packed_white_box_speck.c"
+"block_packed_white_box_speck.c"
+"csr_bit_packed_white_box_speck.c"
 "inlined_bit_packed_white_box_speck.c"
+"hybrid_white_box_speck.c"
 "simd_white_box_speck.c"
 )
 
 for ((i = 0; i < ${#BLOCK_SIZES[@]}; i++)); do
     for self_equivalences in "${SELF_EQUIVALENCES[@]}"; do
-        echo "Testing Speck${BLOCK_SIZES[i]}/${KEY_SIZES[i]} with $self_equivalences self equivalences and key '${KEYS[i]}'"
-        sage -python -m white_box_speck --block-size ${BLOCK_SIZES[i]} --key-size ${KEY_SIZES[i]} --self-equivalences $self_equivalences $DEBUG ${KEYS[i]}
+        # The decryption implementations map the ciphertexts back to the plaintexts.
+        for mode in "" "--decrypt"; do
+            if [ -z "$mode" ]; then
+                input="${PLAINTEXTS[i]}"
+                expected="${CIPHERTEXTS[i]}"
+            else
+                input="${CIPHERTEXTS[i]}"
+                expected="${PLAINTEXTS[i]}"
+            fi
+            echo "Testing Speck${BLOCK_SIZES[i]}/${KEY_SIZES[i]} with $self_equivalences self equivalences and key '${KEYS[i]}' $mode"
+            sage -python -m white_box_speck --block-size ${BLOCK_SIZES[i]} --key-size ${KEY_SIZES[i]} --self-equivalences $self_equivalences $mode $DEBUG ${KEYS[i]}
 
-        gcc -o inverse_input_external_encoding inverse_input_external_encoding.c
-        gcc -o inverse_output_external_encoding inverse_output_external_encoding.c
+            gcc -o inverse_input_external_encoding inverse_input_external_encoding.c
+            gcc -o inverse_output_external_encoding inverse_output_external_encoding.c
 
-        for strategy in "${STRATEGIES[@]}"; do
-            if [ -f $strategy ]; then
-                gcc -march=native -o speck $strategy
-                ciphertext=$(./inverse_output_external_encoding $(./speck $(./inverse_input_external_encoding ${PLAINTEXTS[i]})))
-                echo "expected '${CIPHERTEXTS[i]}', got '$ciphertext' ($strategy)"
-                rm speck
-                rm $strategy
-            fi
-        done
+            for strategy in "${STRATEGIES[@]}"; do
+                if [ -f $strategy ]; then
+                    gcc -march=native -o speck $strategy
+                    output=$(echo "$input" | ./inverse_input_external_encoding --stream | ./speck --stream | ./inverse_output_external_encoding --stream)
+                    echo "expected '$expected', got '$output' ($strategy)"
+                    rm speck
+                    rm $strategy
+                fi
+            done
 
-        rm inverse_input_external_encoding
-        rm inverse_output_external_encoding
-        rm inverse_input_external_encoding.c
-        rm inverse_output_external_encoding.c
+            # The NumPy module reads the two words of a block from its arguments instead of a stream.
+            output=$(python3 numpy_white_box_speck.py $(echo "$input" | ./inverse_input_external_encoding --stream) | ./inverse_output_external_encoding --stream)
+            echo "expected '$expected', got '$output' (numpy_white_box_speck.py)"
+            rm numpy_white_box_speck.py
+
+            rm inverse_input_external_encoding
+            rm inverse_output_external_encoding
+            rm inverse_input_external_encoding.c
+            rm inverse_output_external_encoding.c
+        done
     done
 done
@@ -166,3 +166,46 @@ class WhiteBoxSpeck:
         vectors[self.rounds] = output_external_encoding[0] * vectors[self.rounds] + output_external_encoding[1]
 
         return matrices, vectors
+
+    def inverse_affine_layers(self, input_external_encoding, output_external_encoding, self_equivalence_provider):
+        """
+        Constructs the encoded matrices and vectors corresponding to the affine layers of the inverse of Speck (decryption).
+        The nonlinear layers are modular subtractions, and the input external encoding is applied before the first affine layer.
+        :param input_external_encoding: the input external encoding, a tuple consisting of a matrix and a vector
+        :param output_external_encoding: the output external encoding, a tuple consisting of a matrix and a vector
+        :param self_equivalence_provider: the self-equivalence provider used to generate self-equivalences
+        :return: a tuple containing the matrices and vectors
+        """
+        rotate_x_left = self._rotate_left_matrix(self.alpha, 0)
+        rotate_y_right = self._rotate_right_matrix(0, self.beta)
+        xor_xy = self._xor_xy_matrix()
+        m_first = rotate_y_right * xor_xy
+        m_mid = rotate_y_right * xor_xy * rotate_x_left
+        m_last = rotate_x_left
+
+        matrices = []
+        vectors = []
+
+        # The round key is added after the linear part, as y is computed using x before the round key is removed.
+        matrices.append(m_first * input_external_encoding[0])
+        vectors.append(m_first * input_external_encoding[1] + self._xor_round_key_vector(self._k[self.rounds - 1]))
+
+        for r in range(1, self.rounds + 1):
+            logging.debug(f"Generating random self-equivalence for round {r}...")
+            # If S = A o S o B is a self-equivalence of the modular addition S, then S^-1 = B^-1 o S^-1 o A^-1 is a self-equivalence of the modular subtraction S^-1.
+            O, o, I, i = self_equivalence_provider.random_self_equivalence(gf2)
+            I_inverse = I.inverse()
+            O_inverse = O.inverse()
+            matrices[r - 1] = I_inverse * matrices[r - 1]
+            vectors[r - 1] = I_inverse * (vectors[r - 1] + i)
+            if r < self.rounds:
+                matrices.append(m_mid * O_inverse)
+                vectors.append(m_mid * O_inverse * o + self._xor_round_key_vector(self._k[self.rounds - 1 - r]))
+            else:
+                matrices.append(m_last * O_inverse)
+                vectors.append(m_last * O_inverse * o)
+
+        matrices[self.rounds] = output_external_encoding[0] * matrices[self.rounds]
+        vectors[self.rounds] = output_external_encoding[0] * vectors[self.rounds] + output_external_encoding[1]
+
+        return matrices, vectors
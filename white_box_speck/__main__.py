@@ -1,14 +1,36 @@
+import json
 import logging
+import shutil
+import tempfile
 from argparse import ArgumentParser
+from copy import copy
 from pathlib import Path
 
 from . import WhiteBoxSpeck
+from .benchmark import REFERENCE_SOURCE
+from .benchmark import autotune
+from .benchmark import cpu_model
+from .benchmark import load_autotune_cache
+from .benchmark import parameter_set_name
+from .benchmark import save_autotune_cache
+from .benchmark import supported_strategies
+from .code_generator import cache_size
 from .code_generator.bit_packed import BitPackedCodeGenerator
+from .code_generator.block_packed import BlockPackedCodeGenerator
+from .code_generator.column_bit_packed import ColumnBitPackedCodeGenerator
+from .code_generator.csr_bit_packed import CSRBitPackedCodeGenerator
+from .code_generator.csr_matrix import CSRMatrixCodeGenerator
 from .code_generator.default import DefaultCodeGenerator
+from .code_generator.hybrid import HybridCodeGenerator
 from .code_generator.inlined import InlinedCodeGenerator
 from .code_generator.inlined_bit_packed import InlinedBitPackedCodeGenerator
+from .code_generator.numpy import NumpyCodeGenerator
+from .code_generator.pext_bit_packed import PextBitPackedCodeGenerator
 from .code_generator.simd import SIMDCodeGenerator
 from .code_generator.sparse_matrix import SparseMatrixCodeGenerator
+from .conformance import ConformanceCodeGenerator
+from .ctr import CTRCodeGenerator
+from .external_encodings import DecryptionInputExternalEncodingCodeGenerator
 from .external_encodings import InputExternalEncodingCodeGenerator
 from .external_encodings import OutputExternalEncodingCodeGenerator
 from .external_encodings import random_affine_external_encoding
@@ -22,6 +44,21 @@ parser.add_argument("--block-size", type=int, default=128, choices=[32, 48, 64,
 parser.add_argument("--key-size", type=int, default=256, choices=[64, 72, 96, 128, 144, 192, 256], help="the key size in bits of the Speck implementation (default: %(default)i)")
 parser.add_argument("--output-dir", default=".", help="the directory to output the C files to (default: %(default)s)")
 parser.add_argument("--self-equivalences", default="affine", choices=["affine", "linear"], help="the type of self-equivalences to use (default: %(default)s)")
+parser.add_argument("--xor-cse", action="store_true", help="eliminate common XOR subexpressions in the inlined and hybrid strategies using Paar's heuristic")
+parser.add_argument("--unrolled", action="store_true", help="emit a fully unrolled encrypt function in the inlined strategies")
+parser.add_argument("--split", action="store_true", help="emit the inlined strategies as a directory containing a translation unit for every layer and a Makefile, so they can be compiled in parallel")
+parser.add_argument("--interleave", type=int, default=1, choices=[1, 2, 4, 8], help="the number of blocks which the bulk encryption function processes in lockstep through every round in the bit-packed, inlined bit-packed, and SIMD strategies (default: %(default)i)")
+parser.add_argument("--parallel", action="store_true", help="emit a multithreaded bulk encryption function using pthreads")
+parser.add_argument("--cache-layout", action="store_true", help="align the tables to cache lines and store the rows in the order the kernel reads them")
+parser.add_argument("--decrypt", action="store_true", help="generate white-box Speck decryption implementations instead of encryption implementations")
+parser.add_argument("--table-files", action="store_true", help="store the tables in binary files which are included at compile time using #embed or .incbin, instead of C literals")
+parser.add_argument("--mapped-table-files", action="store_true", help="store the tables in versioned binary files which are memory-mapped at run time, so the tables can be replaced without recompiling")
+parser.add_argument("--library", action="store_true", help="emit reentrant libraries without a main function, and a Python module to call them")
+parser.add_argument("--conformance", action="store_true", help="emit libraries with namespaced symbols and a verifier which checks all of them against the reference implementation in a single process")
+parser.add_argument("--instances", type=int, default=1, help="the number of instances with independent encodings, which are additionally emitted into a single implementation per table-based strategy, sharing one kernel (default: %(default)i)")
+parser.add_argument("--report", choices=["json"], help="write the estimated cost of every strategy (operation counts, table bytes, code size, and working set) to report.json, without compiling anything")
+parser.add_argument("--autotune", action="store_true", help="benchmark every strategy and variant on this machine, and emit only the fastest one together with the timing results in autotune.json")
+parser.add_argument("--autotune-cache", default="autotune_cache.json", help="the JSON file containing the auto-tuner results of every CPU model and parameter set (default: %(default)s)")
 parser.add_argument("--debug", action="store_true", help="log debug messages")
 
 args = parser.parse_args()
@@ -33,54 +70,308 @@ word_size = args.block_size // 2
 
 white_box_speck = WhiteBoxSpeck(args.block_size, args.key_size, list(map(lambda k: int(k, 16), args.key)))
 
-logging.debug(f"Generating random external encodings...")
+assert not (args.table_files and args.mapped_table_files), "The tables are either included at compile time or mapped at run time"
+assert args.instances > 0, f"Invalid number of instances: {args.instances}"
+assert args.instances == 1 or not args.parallel, "Multithreaded bulk encryption is not supported for several instances"
+
 if args.self_equivalences == "affine":
     self_equivalence_provider = AffineSelfEquivalenceProvider(word_size)
-    input_external_encoding = random_affine_external_encoding(word_size)
-    output_external_encoding = random_affine_external_encoding(word_size)
+    random_external_encoding = random_affine_external_encoding
 else:
     self_equivalence_provider = LinearSelfEquivalenceProvider(word_size)
-    input_external_encoding = random_linear_external_encoding(word_size)
-    output_external_encoding = random_linear_external_encoding(word_size)
+    random_external_encoding = random_linear_external_encoding
+
+
+def random_instance():
+    logging.debug(f"Generating random external encodings...")
+    input_external_encoding = random_external_encoding(word_size)
+    output_external_encoding = random_external_encoding(word_size)
 
-logging.debug(f"Generating matrices and vectors using {args.self_equivalences} self-equivalences...")
-matrices, vectors = white_box_speck.affine_layers(input_external_encoding, output_external_encoding, self_equivalence_provider)
+    logging.debug(f"Generating matrices and vectors using {args.self_equivalences} self-equivalences...")
+    if args.decrypt:
+        matrices, vectors = white_box_speck.inverse_affine_layers(input_external_encoding, output_external_encoding, self_equivalence_provider)
+    else:
+        matrices, vectors = white_box_speck.affine_layers(input_external_encoding, output_external_encoding, self_equivalence_provider)
+    return input_external_encoding, output_external_encoding, matrices, vectors
+
+
+# The first instance is the single-instance implementation, every other instance has its own encodings.
+input_external_encoding, output_external_encoding, matrices, vectors = random_instance()
+instances = [(input_external_encoding, output_external_encoding, matrices, vectors)]
+for i in range(1, args.instances):
+    logging.debug(f"Generating instance {i}...")
+    instances.append(random_instance())
 
 if args.output_dir:
     # Make sure the output directory exists.
     Path(args.output_dir).mkdir(parents=True, exist_ok=True)
 
-logging.debug("Generating default code...")
-with open(args.output_dir + "/default_white_box_speck.c", "w") as f:
-    f.write(DefaultCodeGenerator().generate_code(matrices, vectors))
+autotuned_strategy = None
+if args.autotune:
+    # The fastest variant only depends on the machine and the parameter set, so the results are reused for every key.
+    autotune_cache = load_autotune_cache(args.autotune_cache)
+    cpu = cpu_model()
+    name = parameter_set_name(args.block_size, args.key_size)
+    cached = name in autotune_cache.get(cpu, {})
+    if not cached:
+        logging.debug(f"Auto-tuning Speck{name} on {cpu}...")
+        with tempfile.TemporaryDirectory() as work_dir:
+            results = autotune(matrices, vectors, work_dir, supported_strategies(args.block_size), args.decrypt)
+        autotune_cache.setdefault(cpu, {})[name] = {"strategy": results[0]["strategy"], "options": results[0]["options"], "results": results}
+        save_autotune_cache(args.autotune_cache, autotune_cache)
+
+    autotuned = autotune_cache[cpu][name]
+    with open(args.output_dir + "/autotune.json", "w") as f:
+        json.dump({"cpu_model": cpu, "parameter_set": name, "cached": cached, **autotuned}, f, indent=2)
+
+    # The options of the fastest variant replace the arguments which select a variant.
+    autotuned_strategy = autotuned["strategy"]
+    vars(args).update({"cache_layout": False, "unrolled": False, "xor_cse": False, "interleave": 1, **autotuned["options"]})
+    print(f"Fastest strategy for Speck{name} on {cpu}: {autotuned['results'][0]['variant']} ({autotuned['results'][0]['blocks_per_second']:.0f} blocks/s){' (cached)' if cached else ''}")
+
+
+def selected(strategy):
+    # The auto-tuner only emits the fastest strategy.
+    return autotuned_strategy is None or strategy == autotuned_strategy
+
+
+# The conformance verifier links all implementations into one executable, so they are libraries with namespaced symbols.
+library = args.library or args.conformance
+strategies = []
+
+
+def code_generator_options(strategy):
+    # Every generated strategy is checked by the conformance verifier.
+    strategies.append(strategy)
+    return {
+        "parallel": args.parallel,
+        "library": library,
+        "symbol_prefix": f"wbs_{strategy}_" if args.conformance else "wbs_",
+        "cache_layout": args.cache_layout,
+        "decrypt": args.decrypt,
+        "table_file": f"{strategy}_white_box_speck.tables" if args.table_files else None,
+        "mapped_table_file": f"{strategy}_white_box_speck.wbst" if args.mapped_table_files else None,
+    }
+
+
+def write_table_file(code_generator):
+    # Strategies which do not use dense tables ignore the table file.
+    table_blob = code_generator.table_blob(matrices, vectors) if code_generator.table_file is not None else None
+    if table_blob is not None:
+        with open(args.output_dir + "/" + code_generator.table_file, "wb") as f:
+            f.write(table_blob)
+
+    mapped_table_blob = code_generator.mapped_table_blob(matrices, vectors) if code_generator.mapped_table_file is not None else None
+    if mapped_table_blob is not None:
+        with open(args.output_dir + "/" + code_generator.mapped_table_file, "wb") as f:
+            f.write(mapped_table_blob)
+
+
+def write_inlined_code(name, code_generator):
+    # Split implementations are written to a directory with the name of the implementation, which contains its Makefile.
+    if not args.split:
+        with open(args.output_dir + f"/{name}.c", "w") as f:
+            f.write(code_generator.generate_code(matrices, vectors))
+        return
+
+    Path(args.output_dir, name).mkdir(exist_ok=True)
+    for file_name, code in code_generator.generate_split_code(matrices, vectors, name).items():
+        with open(args.output_dir + f"/{name}/{file_name}", "w") as f:
+            f.write(code)
+
+
+def write_instances_code(name, code_generator):
+    # The instances share the options of the single-instance implementation, except for the table file and the interleave factor.
+    if args.instances == 1:
+        return
 
-logging.debug("Generating sparse matrix code...")
-with open(args.output_dir + "/sparse_matrix_white_box_speck.c", "w") as f:
-    f.write(SparseMatrixCodeGenerator().generate_code(matrices, vectors))
+    code_generator = copy(code_generator)
+    code_generator.table_file = f"{name}.tables" if args.table_files else None
+    code_generator.mapped_table_file = None
+    if isinstance(code_generator, BitPackedCodeGenerator):
+        code_generator.interleave = 1
+    layers = [(matrices, vectors) for _, _, matrices, vectors in instances]
+    with open(args.output_dir + f"/{name}.c", "w") as f:
+        f.write(code_generator.generate_code_instances(layers))
+    if code_generator.table_file is not None:
+        with open(args.output_dir + "/" + code_generator.table_file, "wb") as f:
+            f.write(code_generator.instances_table_blob(layers))
 
-logging.debug("Generating inlined code...")
-with open(args.output_dir + "/inlined_white_box_speck.c", "w") as f:
-    f.write(InlinedCodeGenerator().generate_code(matrices, vectors))
 
-logging.debug("Generating bit-packed code...")
-with open(args.output_dir + "/bit_packed_white_box_speck.c", "w") as f:
-    f.write(BitPackedCodeGenerator().generate_code(matrices, vectors))
+reports = {}
 
-logging.debug("Generating inlined bit-packed code...")
-with open(args.output_dir + "/inlined_bit_packed_white_box_speck.c", "w") as f:
-    f.write(InlinedBitPackedCodeGenerator().generate_code(matrices, vectors))
+
+def report(strategy, code_generator):
+    if not args.report:
+        return
+
+    reports[strategy] = code_generator.analyze(matrices, vectors)
+    # An implementation whose working set does not fit in the L2 cache is unusually slow.
+    size = cache_size(2)
+    if size is not None and reports[strategy]["total"]["working_set_bytes"] > size:
+        logging.warning(f"The working set of the {strategy} strategy ({reports[strategy]['total']['working_set_bytes']} bytes) exceeds the {size // 1024} KiB L2 cache")
+
+
+def log_table_footprint(name, code_generator):
+    # The structured rounds are computed on the words, so they have no tables.
+    structured = code_generator.structured_rounds(matrices, vectors)
+    table_bytes = code_generator.table_bytes(matrices[structured:], vectors[structured:])
+    footprint = f"{name} tables: {table_bytes} bytes"
+    for level in [1, 2]:
+        size = cache_size(level)
+        if size is not None:
+            footprint += f", {table_bytes / size:.1%} of the {size // 1024} KiB L{level} cache"
+    logging.debug(footprint)
+
+
+if selected("default"):
+    logging.debug("Generating default code...")
+    default_code_generator = DefaultCodeGenerator(**code_generator_options("default"))
+    report("default", default_code_generator)
+    with open(args.output_dir + "/default_white_box_speck.c", "w") as f:
+        f.write(default_code_generator.generate_code(matrices, vectors))
+    write_table_file(default_code_generator)
+    write_instances_code("default_white_box_speck_instances", default_code_generator)
+    log_table_footprint("Default", default_code_generator)
+
+if selected("sparse_matrix"):
+    logging.debug("Generating sparse matrix code...")
+    sparse_matrix_code_generator = SparseMatrixCodeGenerator(**code_generator_options("sparse_matrix"))
+    report("sparse_matrix", sparse_matrix_code_generator)
+    with open(args.output_dir + "/sparse_matrix_white_box_speck.c", "w") as f:
+        f.write(sparse_matrix_code_generator.generate_code(matrices, vectors))
+    log_table_footprint("Sparse matrix", sparse_matrix_code_generator)
+
+if selected("csr_matrix"):
+    logging.debug("Generating CSR matrix code...")
+    csr_matrix_code_generator = CSRMatrixCodeGenerator(**code_generator_options("csr_matrix"))
+    report("csr_matrix", csr_matrix_code_generator)
+    with open(args.output_dir + "/csr_matrix_white_box_speck.c", "w") as f:
+        f.write(csr_matrix_code_generator.generate_code(matrices, vectors))
+    log_table_footprint("CSR matrix", csr_matrix_code_generator)
+
+if selected("inlined"):
+    logging.debug("Generating inlined code...")
+    inlined_code_generator = InlinedCodeGenerator(args.xor_cse, args.unrolled, args.split, **code_generator_options("inlined"))
+    report("inlined", inlined_code_generator)
+    write_inlined_code("inlined_white_box_speck", inlined_code_generator)
+    logging.debug(f"Inlined code: {sum(before for before, _ in inlined_code_generator.xor_counts)} XORs before and {sum(after for _, after in inlined_code_generator.xor_counts)} XORs after common subexpression elimination")
+
+if selected("bit_packed"):
+    logging.debug("Generating bit-packed code...")
+    bit_packed_code_generator = BitPackedCodeGenerator(interleave=args.interleave, **code_generator_options("bit_packed"))
+    report("bit_packed", bit_packed_code_generator)
+    with open(args.output_dir + "/bit_packed_white_box_speck.c", "w") as f:
+        f.write(bit_packed_code_generator.generate_code(matrices, vectors))
+    write_table_file(bit_packed_code_generator)
+    write_instances_code("bit_packed_white_box_speck_instances", bit_packed_code_generator)
+    log_table_footprint("Bit-packed", bit_packed_code_generator)
+
+if selected("column_bit_packed"):
+    logging.debug("Generating column-oriented bit-packed code...")
+    column_bit_packed_code_generator = ColumnBitPackedCodeGenerator(**code_generator_options("column_bit_packed"))
+    report("column_bit_packed", column_bit_packed_code_generator)
+    with open(args.output_dir + "/column_bit_packed_white_box_speck.c", "w") as f:
+        f.write(column_bit_packed_code_generator.generate_code(matrices, vectors))
+    write_table_file(column_bit_packed_code_generator)
+    write_instances_code("column_bit_packed_white_box_speck_instances", column_bit_packed_code_generator)
+
+if selected("pext_bit_packed"):
+    logging.debug("Generating pext bit-packed code...")
+    pext_bit_packed_code_generator = PextBitPackedCodeGenerator(**code_generator_options("pext_bit_packed"))
+    report("pext_bit_packed", pext_bit_packed_code_generator)
+    with open(args.output_dir + "/pext_bit_packed_white_box_speck.c", "w") as f:
+        f.write(pext_bit_packed_code_generator.generate_code(matrices, vectors))
+    write_table_file(pext_bit_packed_code_generator)
+    write_instances_code("pext_bit_packed_white_box_speck_instances", pext_bit_packed_code_generator)
+
+if selected("block_packed"):
+    logging.debug("Generating block-packed code...")
+    block_packed_code_generator = BlockPackedCodeGenerator(**code_generator_options("block_packed"))
+    report("block_packed", block_packed_code_generator)
+    with open(args.output_dir + "/block_packed_white_box_speck.c", "w") as f:
+        f.write(block_packed_code_generator.generate_code(matrices, vectors))
+    write_table_file(block_packed_code_generator)
+    write_instances_code("block_packed_white_box_speck_instances", block_packed_code_generator)
+    log_table_footprint("Block-packed", block_packed_code_generator)
+
+if selected("csr_bit_packed"):
+    logging.debug("Generating CSR bit-packed code...")
+    csr_bit_packed_code_generator = CSRBitPackedCodeGenerator(**code_generator_options("csr_bit_packed"))
+    report("csr_bit_packed", csr_bit_packed_code_generator)
+    with open(args.output_dir + "/csr_bit_packed_white_box_speck.c", "w") as f:
+        f.write(csr_bit_packed_code_generator.generate_code(matrices, vectors))
+    log_table_footprint("CSR bit-packed", csr_bit_packed_code_generator)
+
+if selected("inlined_bit_packed"):
+    logging.debug("Generating inlined bit-packed code...")
+    inlined_bit_packed_code_generator = InlinedBitPackedCodeGenerator(args.xor_cse, args.unrolled, args.split, interleave=args.interleave, **code_generator_options("inlined_bit_packed"))
+    report("inlined_bit_packed", inlined_bit_packed_code_generator)
+    write_inlined_code("inlined_bit_packed_white_box_speck", inlined_bit_packed_code_generator)
+    logging.debug(f"Inlined bit-packed code: {sum(before for before, _ in inlined_bit_packed_code_generator.xor_counts)} XORs before and {sum(after for _, after in inlined_bit_packed_code_generator.xor_counts)} XORs after common subexpression elimination")
+
+if selected("hybrid"):
+    logging.debug("Generating hybrid code...")
+    hybrid_code_generator = HybridCodeGenerator(args.xor_cse, **code_generator_options("hybrid"))
+    report("hybrid", hybrid_code_generator)
+    with open(args.output_dir + "/hybrid_white_box_speck.c", "w") as f:
+        f.write(hybrid_code_generator.generate_code(matrices, vectors))
+    kernels = [choice["kernel"] for choice in hybrid_code_generator.layer_choices]
+    logging.debug(f"Hybrid code: {', '.join(f'{kernels.count(kernel)} {kernel} layers' for kernel in HybridCodeGenerator._KERNEL_COSTS)}")
+    log_table_footprint("Hybrid", hybrid_code_generator)
 
 # SIMD code does not accept n = 24 or n = 48
-if word_size != 24 and word_size != 48:
+if selected("simd") and word_size != 24 and word_size != 48:
     logging.debug("Generating SIMD code...")
+    simd_code_generator = SIMDCodeGenerator(interleave=args.interleave, **code_generator_options("simd"))
+    report("simd", simd_code_generator)
     with open(args.output_dir + "/simd_white_box_speck.c", "w") as f:
-        f.write(SIMDCodeGenerator().generate_code(matrices, vectors))
+        f.write(simd_code_generator.generate_code(matrices, vectors))
+    write_table_file(simd_code_generator)
+    write_instances_code("simd_white_box_speck_instances", simd_code_generator)
+    log_table_footprint("SIMD", simd_code_generator)
+
+# The NumPy module is a Python module, so it is neither a C library nor checked by the conformance verifier.
+if selected("numpy"):
+    logging.debug("Generating NumPy code...")
+    numpy_code_generator = NumpyCodeGenerator(decrypt=args.decrypt)
+    report("numpy", numpy_code_generator)
+    with open(args.output_dir + "/numpy_white_box_speck.py", "w") as f:
+        f.write(numpy_code_generator.generate_code(matrices, vectors))
+    log_table_footprint("NumPy", numpy_code_generator)
+
+if library:
+    logging.debug("Copying Python library module...")
+    shutil.copy(Path(__file__).parent / "library.py", args.output_dir + "/white_box_speck_library.py")
 
 logging.debug("Generating external encodings code...")
-with open(args.output_dir + "/inverse_input_external_encoding.c", "w") as f:
-    f.write(InputExternalEncodingCodeGenerator().generate_code_inverse_input_external_encoding(matrices[0], vectors[0], input_external_encoding))
+# The external encodings of instance i > 0 are written to files with the suffix _i.
+for i, (input_external_encoding, output_external_encoding, instance_matrices, instance_vectors) in enumerate(instances):
+    suffix = f"_{i}" if i > 0 else ""
+    with open(args.output_dir + f"/inverse_input_external_encoding{suffix}.c", "w") as f:
+        if args.decrypt:
+            f.write(DecryptionInputExternalEncodingCodeGenerator(library=library).generate_code_inverse_input_external_encoding(input_external_encoding))
+        else:
+            f.write(InputExternalEncodingCodeGenerator(library=library).generate_code_inverse_input_external_encoding(instance_matrices[0], instance_vectors[0], input_external_encoding))
+
+    with open(args.output_dir + f"/inverse_output_external_encoding{suffix}.c", "w") as f:
+        f.write(OutputExternalEncodingCodeGenerator(library=library).generate_code_inverse_output_external_encoding(output_external_encoding))
+
+if args.report:
+    logging.debug("Writing cost report...")
+    with open(args.output_dir + "/report.json", "w") as f:
+        json.dump({"parameter_set": parameter_set_name(args.block_size, args.key_size), "l1_cache_bytes": cache_size(1), "l2_cache_bytes": cache_size(2), "strategies": reports}, f, indent=2)
+
+if args.conformance:
+    logging.debug("Generating conformance verifier code...")
+    shutil.copy(REFERENCE_SOURCE, args.output_dir + "/" + ConformanceCodeGenerator.REFERENCE_SOURCE)
+    with open(args.output_dir + "/conformance.c", "w") as f:
+        f.write(ConformanceCodeGenerator(list(map(lambda k: int(k, 16), args.key)), strategies, decrypt=args.decrypt).generate_code_conformance(args.block_size, white_box_speck.rounds))
 
-with open(args.output_dir + "/inverse_output_external_encoding.c", "w") as f:
-    f.write(OutputExternalEncodingCodeGenerator().generate_code_inverse_output_external_encoding(output_external_encoding))
+# CTR mode only uses the encryption function of an implementation with the default symbol prefix.
+if args.library and not args.decrypt and not args.conformance:
+    logging.debug("Generating CTR mode tool code...")
+    with open(args.output_dir + "/speck_ctr.c", "w") as f:
+        f.write(CTRCodeGenerator(parallel=args.parallel).generate_code_ctr(args.block_size))
 
 logging.debug("Done!")
@@ -0,0 +1,397 @@
+"""
+Helpers to benchmark the white-box Speck strategies and the reference implementation.
+"""
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import time
+from pathlib import Path
+
+from .. import WhiteBoxSpeck
+from ..code_generator.bit_packed import BitPackedCodeGenerator
+from ..code_generator.block_packed import BlockPackedCodeGenerator
+from ..code_generator.column_bit_packed import ColumnBitPackedCodeGenerator
+from ..code_generator.csr_bit_packed import CSRBitPackedCodeGenerator
+from ..code_generator.csr_matrix import CSRMatrixCodeGenerator
+from ..code_generator.default import DefaultCodeGenerator
+from ..code_generator.hybrid import HybridCodeGenerator
+from ..code_generator.inlined import InlinedCodeGenerator
+from ..code_generator.inlined_bit_packed import InlinedBitPackedCodeGenerator
+from ..code_generator.pext_bit_packed import PextBitPackedCodeGenerator
+from ..code_generator.simd import SIMDCodeGenerator
+from ..code_generator.sparse_matrix import SparseMatrixCodeGenerator
+from ..external_encodings import random_affine_external_encoding
+from ..self_equivalences.anf import AffineSelfEquivalenceProvider
+
+# (block size, key size) -> key, from the Speck test vectors.
+PARAMETER_SETS = {
+    (32, 64): [0x1918, 0x1110, 0x0908, 0x0100],
+    (48, 72): [0x121110, 0x0a0908, 0x020100],
+    (48, 96): [0x1a1918, 0x121110, 0x0a0908, 0x020100],
+    (64, 96): [0x13121110, 0x0b0a0908, 0x03020100],
+    (64, 128): [0x1b1a1918, 0x13121110, 0x0b0a0908, 0x03020100],
+    (96, 96): [0x0d0c0b0a0908, 0x050403020100],
+    (96, 144): [0x151413121110, 0x0d0c0b0a0908, 0x050403020100],
+    (128, 128): [0x0f0e0d0c0b0a0908, 0x0706050403020100],
+    (128, 192): [0x1716151413121110, 0x0f0e0d0c0b0a0908, 0x0706050403020100],
+    (128, 256): [0x1f1e1d1c1b1a1918, 0x1716151413121110, 0x0f0e0d0c0b0a0908, 0x0706050403020100],
+}
+
+# Strategy name -> code generator class.
+STRATEGIES = {
+    "default": DefaultCodeGenerator,
+    "sparse_matrix": SparseMatrixCodeGenerator,
+    "csr_matrix": CSRMatrixCodeGenerator,
+    "inlined": InlinedCodeGenerator,
+    "bit_packed": BitPackedCodeGenerator,
+    "column_bit_packed": ColumnBitPackedCodeGenerator,
+    "pext_bit_packed": PextBitPackedCodeGenerator,
+    "block_packed": BlockPackedCodeGenerator,
+    "csr_bit_packed": CSRBitPackedCodeGenerator,
+    "inlined_bit_packed": InlinedBitPackedCodeGenerator,
+    "hybrid": HybridCodeGenerator,
+    "simd": SIMDCodeGenerator,
+}
+
+# The bit-packed variants only differ in the kernel and the packing of the rows, so we report which kernel is fastest.
+BIT_PACKED_STRATEGIES = ["bit_packed", "column_bit_packed", "pext_bit_packed", "block_packed"]
+
+# Strategy name -> the code generator options of every variant which is considered by the auto-tuner.
+AUTOTUNE_VARIANTS = {
+    "default": [{}, {"cache_layout": True}],
+    "sparse_matrix": [{}],
+    "csr_matrix": [{}, {"cache_layout": True}],
+    "inlined": [{}, {"unrolled": True}, {"xor_cse": True, "unrolled": True}],
+    "bit_packed": [{}, {"cache_layout": True}, {"interleave": 4}, {"cache_layout": True, "interleave": 4}],
+    "column_bit_packed": [{}, {"cache_layout": True}],
+    "pext_bit_packed": [{}, {"cache_layout": True}],
+    "block_packed": [{}, {"cache_layout": True}],
+    "csr_bit_packed": [{}, {"cache_layout": True}],
+    "inlined_bit_packed": [{}, {"unrolled": True}, {"xor_cse": True, "unrolled": True}, {"unrolled": True, "interleave": 4}],
+    "hybrid": [{}, {"xor_cse": True}],
+    "simd": [{}, {"cache_layout": True}, {"interleave": 4}, {"cache_layout": True, "interleave": 4}],
+}
+
+AUTOTUNE_FLAGS = ["-O2", "-march=native"]
+AUTOTUNE_ITERATIONS = 100000
+AUTOTUNE_REPETITIONS = 3
+
+REFERENCE = "reference"
+
+# The portable reference implementation, which is benchmarked and included in the conformance verifier.
+REFERENCE_SOURCE = Path(__file__).parent.parent.parent / "reference" / "speck.c"
+
+_REFERENCE_WORD_TYPES = {
+    16: ("uint16_t", "SCNx16", "PRIx16"),
+    24: ("uint32_t", "SCNx32", "PRIx32"),
+    32: ("uint32_t", "SCNx32", "PRIx32"),
+    48: ("uint64_t", "SCNx64", "PRIx64"),
+    64: ("uint64_t", "SCNx64", "PRIx64"),
+}
+
+
+def parameter_set_name(block_size, key_size):
+    """
+    Returns the name of a parameter set, as used in the results.
+    :param block_size: the block size
+    :param key_size: the key size
+    :return: the name of the parameter set
+    """
+    return f"{block_size}/{key_size}"
+
+
+def supported_strategies(block_size):
+    """
+    Returns the strategies which support a block size.
+    :param block_size: the block size
+    :return: a list containing the names of the strategies
+    """
+    word_size = block_size // 2
+    # SIMD code does not accept n = 24 or n = 48
+    return [strategy for strategy in STRATEGIES if strategy != "simd" or (word_size != 24 and word_size != 48)]
+
+
+def generate_instance(block_size, key_size, output_dir, strategies, decrypt=False, table_files=False):
+    """
+    Generates the C files of a white-box Speck instance using affine self-equivalences and affine external encodings.
+    :param block_size: the block size
+    :param key_size: the key size
+    :param output_dir: the directory to output the C files to
+    :param strategies: the names of the strategies to generate
+    :param decrypt: whether to generate decryption implementations instead of encryption implementations
+    :param table_files: whether to store the tables in table files which are included at compile time, if the strategy supports it
+    :return: a dict containing the path of the C file of each strategy
+    """
+    word_size = block_size // 2
+    white_box_speck = WhiteBoxSpeck(block_size, key_size, PARAMETER_SETS[(block_size, key_size)])
+    # The external encodings are not benchmarked, so they are only needed to generate the matrices and vectors.
+    input_external_encoding = random_affine_external_encoding(word_size)
+    output_external_encoding = random_affine_external_encoding(word_size)
+    if decrypt:
+        matrices, vectors = white_box_speck.inverse_affine_layers(input_external_encoding, output_external_encoding, AffineSelfEquivalenceProvider(word_size))
+    else:
+        matrices, vectors = white_box_speck.affine_layers(input_external_encoding, output_external_encoding, AffineSelfEquivalenceProvider(word_size))
+
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    sources = {}
+    for strategy in strategies:
+        logging.debug(f"Generating {strategy} code for Speck{parameter_set_name(block_size, key_size)}...")
+        sources[strategy] = Path(output_dir) / f"{strategy}_white_box_speck.c"
+        code_generator = STRATEGIES[strategy](decrypt=decrypt, table_file=f"{strategy}_white_box_speck.tables" if table_files else None)
+        with open(sources[strategy], "w") as f:
+            f.write(code_generator.generate_code(matrices, vectors))
+        table_blob = code_generator.table_blob(matrices, vectors) if table_files else None
+        if table_blob is not None:
+            with open(Path(output_dir) / code_generator.table_file, "wb") as f:
+                f.write(table_blob)
+
+    return sources
+
+
+def reference_defines(block_size, key_size):
+    """
+    Returns the preprocessor definitions to compile the reference implementation for a parameter set.
+    :param block_size: the block size
+    :param key_size: the key size
+    :return: a list containing the -D compiler arguments
+    """
+    word_size = block_size // 2
+    word_type, word_in_type, word_out_type = _REFERENCE_WORD_TYPES[word_size]
+    key = ", ".join(f"0x{k:x}" for k in PARAMETER_SETS[(block_size, key_size)])
+    return [
+        f"-DBLOCK_SIZE={block_size}",
+        f"-DKEY_SIZE={key_size}",
+        f"-DWORD_TYPE={word_type}",
+        f"-DWORD_IN_TYPE={word_in_type}",
+        f"-DWORD_OUT_TYPE={word_out_type}",
+        f"-DALPHA={7 if word_size == 16 else 8}",
+        f"-DBETA={2 if word_size == 16 else 3}",
+        f"-DROUNDS={WhiteBoxSpeck._ROUNDS[(block_size, key_size)]}",
+        f"-DKEY={{{key}}}",
+    ]
+
+
+def compile_program(compiler, flags, source, output, extra_arguments=None):
+    """
+    Compiles a C program.
+    :param compiler: the compiler to use
+    :param flags: a list containing the compiler flags
+    :param source: the path of the C file
+    :param output: the path of the program
+    :param extra_arguments: a list containing additional compiler arguments (default: None)
+    :return: a tuple containing the compile time in seconds and the peak memory usage of the compiler in bytes
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen([compiler, *flags, *(extra_arguments or []), "-o", str(output), str(source)])
+    # Unlike subprocess.run, os.wait4 returns the resource usage of this compiler (and the processes it waited for) only.
+    _, status, usage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+
+    # ru_maxrss is in kilobytes on Linux.
+    return seconds, usage.ru_maxrss * 1024
+
+
+def run_program(program, iterations):
+    """
+    Runs the benchmark harness of a program.
+    :param program: the path of the program
+    :param iterations: the number of blocks to encrypt
+    :return: a dict containing the results printed by the benchmark harness
+    """
+    result = subprocess.run([str(program), str(iterations)], check=True, capture_output=True, text=True)
+    return json.loads(result.stdout)
+
+
+def table_bytes(program):
+    """
+    Returns the size of the initialized data sections of a program, which contain the matrices and vectors.
+    :param program: the path of the program
+    :return: the size in bytes
+    """
+    result = subprocess.run(["size", "-A", str(program)], check=True, capture_output=True, text=True)
+    sizes = {}
+    for line in result.stdout.splitlines():
+        fields = line.split()
+        if len(fields) >= 2 and fields[1].isdigit():
+            sizes[fields[0]] = int(fields[1])
+
+    return sizes.get(".rodata", 0) + sizes.get(".data", 0)
+
+
+def cpu_model():
+    """
+    Returns the model name of the CPU.
+    :return: the model name, or the processor reported by the platform module if it is unavailable
+    """
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+
+    return platform.processor() or platform.machine()
+
+
+def benchmark_program(compiler, flags, source, program, iterations, repetitions, extra_arguments=None):
+    """
+    Compiles a program and runs its benchmark harness repeatedly.
+    :param compiler: the compiler to use
+    :param flags: a list containing the compiler flags
+    :param source: the path of the C file
+    :param program: the path of the program
+    :param iterations: the number of blocks to encrypt in each repetition
+    :param repetitions: the number of repetitions
+    :param extra_arguments: a list containing additional compiler arguments (default: None)
+    :return: a dict containing the median throughput over all repetitions, the binary size, table bytes, compile time, and compiler memory usage
+    """
+    compile_time, compile_max_rss = compile_program(compiler, flags, source, program, extra_arguments)
+    runs = [run_program(program, iterations) for _ in range(repetitions)]
+    result = {
+        "blocks_per_second": statistics.median(run["blocks_per_second"] for run in runs),
+        "cycles_per_byte": statistics.median(run["cycles_per_byte"] for run in runs),
+        "latency_p99_cycles_per_block": statistics.median(run["latency_cycles_per_block"]["p99"] for run in runs),
+        "binary_bytes": os.path.getsize(program),
+        "table_bytes": table_bytes(program),
+        "compile_seconds": compile_time,
+        "compile_max_rss_bytes": compile_max_rss,
+    }
+    os.remove(program)
+    return result
+
+
+def variant_name(strategy, options):
+    """
+    Returns the name of a variant of a strategy, as used in the auto-tuner results.
+    :param strategy: the name of the strategy
+    :param options: a dict containing the code generator options of the variant
+    :return: the name of the variant
+    """
+    return "+".join([strategy, *sorted(option if value is True else f"{option}={value}" for option, value in options.items() if value)])
+
+
+def autotune(matrices, vectors, work_dir, strategies, decrypt=False, compiler="gcc", flags=None, iterations=AUTOTUNE_ITERATIONS, repetitions=AUTOTUNE_REPETITIONS):
+    """
+    Generates, compiles, and benchmarks every variant of the strategies for a white-box Speck instance.
+    :param matrices: the matrices of the instance
+    :param vectors: the vectors of the instance
+    :param work_dir: the directory to generate and compile the C files in
+    :param strategies: the names of the strategies to consider
+    :param decrypt: whether the matrices and vectors are the layers of a decryption implementation
+    :param compiler: the compiler to use (default: gcc)
+    :param flags: a list containing the compiler flags (default: AUTOTUNE_FLAGS)
+    :param iterations: the number of blocks to encrypt in each repetition (default: AUTOTUNE_ITERATIONS)
+    :param repetitions: the number of repetitions (default: AUTOTUNE_REPETITIONS)
+    :return: a list containing the results of every variant, from fastest to slowest
+    """
+    Path(work_dir).mkdir(parents=True, exist_ok=True)
+    results = []
+    for strategy in strategies:
+        for options in AUTOTUNE_VARIANTS[strategy]:
+            name = variant_name(strategy, options)
+            logging.debug(f"Benchmarking {name}...")
+            source = Path(work_dir) / f"{name}.c"
+            with open(source, "w") as f:
+                f.write(STRATEGIES[strategy](decrypt=decrypt, **options).generate_code(matrices, vectors))
+            try:
+                result = benchmark_program(compiler, flags or AUTOTUNE_FLAGS, source, Path(work_dir) / "speck", iterations, repetitions)
+            except subprocess.CalledProcessError:
+                # E.g. the SIMD and pext strategies do not compile for CPUs without AVX2 or BMI2.
+                logging.warning(f"Skipping {name}, which does not compile on this machine")
+                continue
+
+            results.append({"variant": name, "strategy": strategy, "options": options, **result})
+
+    return sorted(results, key=lambda result: result["blocks_per_second"], reverse=True)
+
+
+def load_autotune_cache(path):
+    """
+    Loads an auto-tuner cache file.
+    :param path: the path of the cache file
+    :return: a dict mapping CPU models to dicts mapping parameter sets to the auto-tuner results, or an empty dict if the file does not exist
+    """
+    if not Path(path).exists():
+        return {}
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_autotune_cache(path, cache):
+    """
+    Saves an auto-tuner cache file.
+    :param path: the path of the cache file
+    :param cache: a dict mapping CPU models to dicts mapping parameter sets to the auto-tuner results
+    """
+    with open(path, "w") as f:
+        json.dump(cache, f, indent=2)
+
+
+def load_history(path):
+    """
+    Loads a benchmark history file.
+    :param path: the path of the history file
+    :return: a list containing the runs, or an empty list if the file does not exist
+    """
+    if not Path(path).exists():
+        return []
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_history(path, history):
+    """
+    Saves a benchmark history file.
+    :param path: the path of the history file
+    :param history: a list containing the runs
+    """
+    with open(path, "w") as f:
+        json.dump(history, f, indent=2)
+
+
+def result_key(result):
+    """
+    Returns the key identifying a result across runs.
+    :param result: the result
+    :return: a tuple containing the compiler, flags, parameter set, strategy, direction, and whether table files were used
+    """
+    # Older runs only contain encryption results without table files.
+    return result["compiler"], result["flags"], result["parameter_set"], result["strategy"], result.get("direction", "encrypt"), result.get("table_files", False)
+
+
+def compare_runs(baseline, run, threshold):
+    """
+    Compares a run against a baseline run.
+    A regression is a decrease in throughput, or an increase in binary size or table bytes, by more than the threshold.
+    :param baseline: the baseline run
+    :param run: the run to compare
+    :param threshold: the relative threshold, e.g. 0.05 for 5%
+    :return: a list containing a (key, metric, baseline value, value, relative change) tuple for each regression
+    """
+    baseline_results = {result_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in run["results"]:
+        key = result_key(result)
+        if key not in baseline_results:
+            continue
+
+        for metric, higher_is_better in [("blocks_per_second", True), ("binary_bytes", False), ("table_bytes", False)]:
+            baseline_value = baseline_results[key][metric]
+            value = result[metric]
+            if baseline_value == 0:
+                continue
+
+            change = (value - baseline_value) / baseline_value
+            if (higher_is_better and change < -threshold) or (not higher_is_better and change > threshold):
+                regressions.append((key, metric, baseline_value, value, change))
+
+    return regressions
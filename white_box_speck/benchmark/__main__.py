@@ -0,0 +1,112 @@
+import logging
+import shlex
+import sys
+from argparse import ArgumentParser
+from datetime import datetime
+from datetime import timezone
+from pathlib import Path
+
+from . import BIT_PACKED_STRATEGIES
+from . import PARAMETER_SETS
+from . import REFERENCE
+from . import REFERENCE_SOURCE
+from . import STRATEGIES
+from . import benchmark_program
+from . import compare_runs
+from . import cpu_model
+from . import generate_instance
+from . import load_history
+from . import parameter_set_name
+from . import reference_defines
+from . import save_history
+from . import supported_strategies
+
+parser = ArgumentParser(prog="sage -python -m white_box_speck.benchmark", description="Benchmark the white-box Speck strategies and the reference implementation")
+parser.add_argument("--history", default="benchmark_history.json", help="the JSON file containing the benchmark history (default: %(default)s)")
+parser.add_argument("--debug", action="store_true", help="log debug messages")
+subparsers = parser.add_subparsers(dest="command", required=True)
+
+run_parser = subparsers.add_parser("run", help="benchmark all strategies and append the results to the history")
+run_parser.add_argument("--compilers", nargs="+", default=["gcc"], help="the compilers to use (default: %(default)s)")
+run_parser.add_argument("--flags", nargs="+", default=["-O2 -march=native"], help="the sets of compiler flags to use, each set as a single argument (default: %(default)s)")
+run_parser.add_argument("--parameter-sets", nargs="+", default=[parameter_set_name(*parameter_set) for parameter_set in PARAMETER_SETS], help="the parameter sets to benchmark, as BLOCK_SIZE/KEY_SIZE (default: all)")
+run_parser.add_argument("--strategies", nargs="+", default=[REFERENCE, *STRATEGIES], choices=[REFERENCE, *STRATEGIES], help="the strategies to benchmark (default: all)")
+run_parser.add_argument("--directions", nargs="+", default=["encrypt"], choices=["encrypt", "decrypt"], help="the directions to benchmark, the reference implementation only encrypts (default: %(default)s)")
+run_parser.add_argument("--table-files", action="store_true", help="store the tables in binary files which are included at compile time, for the strategies which support it")
+run_parser.add_argument("--iterations", type=int, default=1000000, help="the number of blocks to encrypt in each repetition (default: %(default)i)")
+run_parser.add_argument("--repetitions", type=int, default=5, help="the number of repetitions, the median is reported (default: %(default)i)")
+run_parser.add_argument("--work-dir", default="benchmark", help="the directory to generate and compile the C files in (default: %(default)s)")
+
+compare_parser = subparsers.add_parser("compare", help="compare a run against a baseline run and report regressions")
+compare_parser.add_argument("--baseline", type=int, default=-2, help="the index of the baseline run in the history (default: %(default)i)")
+compare_parser.add_argument("--run", type=int, default=-1, help="the index of the run to compare in the history (default: %(default)i)")
+compare_parser.add_argument("--threshold", type=float, default=0.05, help="the relative change which is reported as a regression (default: %(default).2f)")
+
+args = parser.parse_args()
+
+if args.debug:
+    logging.basicConfig(format='%(asctime)s.%(msecs)03d %(levelname)s %(message)s', datefmt='%Y-%m-%d,%H:%M:%S', level=logging.DEBUG)
+
+history = load_history(args.history)
+
+if args.command == "run":
+    results = []
+    for name in args.parameter_sets:
+        block_size, key_size = map(int, name.split("/"))
+        assert (block_size, key_size) in PARAMETER_SETS, f"Invalid or unsupported parameter set: {name}"
+        strategies = [strategy for strategy in args.strategies if strategy == REFERENCE or strategy in supported_strategies(block_size)]
+        for direction in args.directions:
+            output_dir = Path(args.work_dir) / f"{block_size}_{key_size}" / direction
+            # The reference implementation only encrypts.
+            direction_strategies = [strategy for strategy in strategies if strategy != REFERENCE or direction == "encrypt"]
+            sources = generate_instance(block_size, key_size, output_dir, [strategy for strategy in direction_strategies if strategy != REFERENCE], direction == "decrypt", args.table_files)
+            # .incbin searches the table files relative to the working directory or the directories passed using -Wa,-I.
+            extra_arguments = [f"-Wa,-I{output_dir}"] if args.table_files else []
+            for compiler in args.compilers:
+                for flags in args.flags:
+                    fastest = {}
+                    for strategy in direction_strategies:
+                        print(f"Benchmarking Speck{name} {strategy} {direction} with {compiler} {flags}...")
+                        if strategy == REFERENCE:
+                            result = benchmark_program(compiler, shlex.split(flags), REFERENCE_SOURCE, output_dir / "speck", args.iterations, args.repetitions, reference_defines(block_size, key_size))
+                        else:
+                            result = benchmark_program(compiler, shlex.split(flags), sources[strategy], output_dir / "speck", args.iterations, args.repetitions, extra_arguments)
+                        print(f"{result['blocks_per_second']:.0f} blocks/s, {result['cycles_per_byte']:.2f} cycles/byte, {result['binary_bytes']} binary bytes, {result['table_bytes']} table bytes, {result['compile_seconds']:.2f} s compile time, {result['compile_max_rss_bytes'] / 2 ** 20:.0f} MiB compiler memory")
+                        results.append({"compiler": compiler, "flags": flags, "parameter_set": name, "strategy": strategy, "direction": direction, "table_files": args.table_files, **result})
+                        if strategy != REFERENCE:
+                            fastest.setdefault("white-box", (strategy, result["blocks_per_second"]))
+                            if result["blocks_per_second"] > fastest["white-box"][1]:
+                                fastest["white-box"] = (strategy, result["blocks_per_second"])
+                        if strategy in BIT_PACKED_STRATEGIES:
+                            fastest.setdefault("bit-packed", (strategy, result["blocks_per_second"]))
+                            if result["blocks_per_second"] > fastest["bit-packed"][1]:
+                                fastest["bit-packed"] = (strategy, result["blocks_per_second"])
+
+                    for kind, (strategy, blocks_per_second) in fastest.items():
+                        print(f"Fastest {kind} {direction} strategy for Speck{name} with {compiler} {flags}: {strategy} ({blocks_per_second:.0f} blocks/s)")
+
+    history.append({
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "cpu_model": cpu_model(),
+        "iterations": args.iterations,
+        "repetitions": args.repetitions,
+        "results": results,
+    })
+    save_history(args.history, history)
+    print(f"Saved run {len(history) - 1} to {args.history}")
+
+if args.command == "compare":
+    assert len(history) >= 2, f"Expected at least two runs in {args.history} but got {len(history)} runs"
+    baseline = history[args.baseline]
+    run = history[args.run]
+    if baseline["cpu_model"] != run["cpu_model"]:
+        logging.warning(f"Comparing runs on different CPUs: {baseline['cpu_model']} and {run['cpu_model']}")
+
+    regressions = compare_runs(baseline, run, args.threshold)
+    for (compiler, flags, name, strategy, direction, table_files), metric, baseline_value, value, change in regressions:
+        print(f"Regression in Speck{name} {strategy} {direction}{' with table files' if table_files else ''} with {compiler} {flags}: {metric} changed from {baseline_value:g} to {value:g} ({change:+.1%})")
+
+    if regressions:
+        sys.exit(1)
+
+    print("No regressions")
@@ -1,5 +1,44 @@
+import re
+import struct
+import zlib
 from abc import ABC
 from abc import abstractmethod
+from pathlib import Path
+
+
+def cache_size(level):
+    """
+    Returns the size of the data cache of a level on the first CPU, as reported by Linux.
+    :param level: the cache level, e.g. 1 or 2
+    :return: the size in bytes, or None if it is unavailable
+    """
+    for index in sorted(Path("/sys/devices/system/cpu/cpu0/cache").glob("index*")):
+        try:
+            if int((index / "level").read_text()) == level and (index / "type").read_text().strip() in ["Data", "Unified"]:
+                size = (index / "size").read_text().strip()
+                return int(size[:-1]) * {"K": 1024, "M": 1024 * 1024}[size[-1]] if size[-1] in "KM" else int(size)
+        except (OSError, ValueError):
+            continue
+
+    return None
+
+
+def serialize_tables(tables, alignment=64):
+    """
+    Serializes tables into a single binary blob, with the values of every table in little-endian byte order.
+    :param tables: the tables, as returned by CodeGenerator.tables
+    :param alignment: the alignment of every table within the blob (default: 64, the cache line size)
+    :return: a tuple containing the blob and a list containing the offset of every table
+    """
+    blob = bytearray()
+    offsets = []
+    for name, element_type, dimensions, element_bytes, values in tables:
+        blob += bytes(-len(blob) % alignment)
+        offsets.append(len(blob))
+        for value in values:
+            blob += int(value).to_bytes(element_bytes, "little")
+
+    return bytes(blob), offsets
 
 
 class CodeGenerator(ABC):
@@ -31,14 +70,137 @@ class CodeGenerator(ABC):
         64: "PRIx64",
     }
 
+    _WORD_BYTES = {
+        16: 2,
+        24: 4,
+        32: 4,
+        48: 8,
+        64: 8,
+    }
+
     _INCLUDE_INTTYPES = "#include <inttypes.h>\n"
     _INCLUDE_STDDEF = "#include <stddef.h>\n"
     _INCLUDE_STDIO = "#include <stdio.h>\n"
     _INCLUDE_STRING = "#include <string.h>\n"
     _INCLUDE_STDLIB = "#include <stdlib.h>\n"
+    _INCLUDE_PTHREAD = "#include <pthread.h>\n"
+    _INCLUDE_SCHED = "#include <sched.h>\n"
+    _INCLUDE_TIME = "#include <time.h>\n"
+
+    _INCLUDE_X86INTRIN = (
+        "#if defined(__x86_64__) || defined(__i386__)\n"
+        "#include <x86intrin.h>\n"
+        "#define READ_CYCLES() __rdtsc()\n"
+        "#else\n"
+        "#define READ_CYCLES() UINT64_C(0)\n"
+        "#endif\n"
+    )
+
+    # Required for pthread_setaffinity_np, it must be defined before any header is included.
+    _DEFINE_GNU_SOURCE = "#define _GNU_SOURCE\n"
+
+    _CACHE_LINE_SIZE = 64
+
+    # With -DWBS_PREFETCH, the tables of round r + 1 are prefetched while round r runs.
+    _PREFETCH_ROUND = (
+        "#ifdef WBS_PREFETCH\n"
+        "static inline void prefetch_table(const void *table, size_t size) {\n"
+        "    for (size_t i = 0; i < size; i += 64) {\n"
+        "        __builtin_prefetch((const char *) table + i, 0, 3);\n"
+        "    }\n"
+        "}\n"
+        "\n"
+        "#define PREFETCH_ROUND(r) (prefetch_table(MATRICES[r], sizeof(MATRICES[r])), prefetch_table(VECTORS[r], sizeof(VECTORS[r])))\n"
+        "#else\n"
+        "#define PREFETCH_ROUND(r)\n"
+        "#endif\n"
+    )
+
+    # With -DWBS_PROFILE, every phase of every round is timed using the cycle counter, and the histograms are written to stderr at exit.
+    # Bucket b of a histogram counts the phases which took less than 2^b cycles (and at least 2^(b - 1) cycles), the last bucket counts all longer phases.
+    _PROFILE = (
+        "#ifdef WBS_PROFILE\n"
+        "#ifndef READ_CYCLES\n"
+        "#if defined(__x86_64__) || defined(__i386__)\n"
+        "#include <x86intrin.h>\n"
+        "#define READ_CYCLES() __rdtsc()\n"
+        "#else\n"
+        "#define READ_CYCLES() UINT64_C(0)\n"
+        "#endif\n"
+        "#endif\n"
+        "\n"
+        # The rounds are numbered like the layers, including the structured rounds which are not profiled.
+        "#ifndef STRUCTURED_ROUNDS\n"
+        "#define STRUCTURED_ROUNDS 0\n"
+        "#endif\n"
+        "\n"
+        "#define PROFILE_BUCKETS 24\n"
+        "#define PROFILE_PHASES 3\n"
+        "#define PROFILE_MATRIX_VECTOR_PRODUCT 0\n"
+        "#define PROFILE_VECTOR_ADDITION 1\n"
+        "#define PROFILE_MODULAR_ADDITION 2\n"
+        "\n"
+        "static const char *const PROFILE_PHASE_NAMES[PROFILE_PHASES] = {\"matrix_vector_product\", \"vector_addition\", \"modular_addition\"};\n"
+        "static uint64_t profile_cycles[ROUNDS + 1][PROFILE_PHASES];\n"
+        "static uint64_t profile_histograms[ROUNDS + 1][PROFILE_PHASES][PROFILE_BUCKETS];\n"
+        "\n"
+        # The compiler barriers keep the phase between the two readings of the cycle counter.
+        "static inline uint64_t profile_read_cycles(void) {\n"
+        "    __asm__ __volatile__(\"\" ::: \"memory\");\n"
+        "    uint64_t cycles = READ_CYCLES();\n"
+        "    __asm__ __volatile__(\"\" ::: \"memory\");\n"
+        "    return cycles;\n"
+        "}\n"
+        "\n"
+        # The counters are shared by all threads, so they are updated atomically.
+        "static void profile_record(size_t r, size_t phase, uint64_t cycles) {\n"
+        "    size_t bucket = cycles == 0 ? 0 : 64 - __builtin_clzll(cycles);\n"
+        "    if (bucket >= PROFILE_BUCKETS) {\n"
+        "        bucket = PROFILE_BUCKETS - 1;\n"
+        "    }\n"
+        "    __atomic_fetch_add(&profile_cycles[r][phase], cycles, __ATOMIC_RELAXED);\n"
+        "    __atomic_fetch_add(&profile_histograms[r][phase][bucket], 1, __ATOMIC_RELAXED);\n"
+        "}\n"
+        "\n"
+        # The overhead of reading the cycle counter is included in every measurement, so it is reported as well.
+        "__attribute__((destructor)) static void profile_dump(void) {\n"
+        "    uint64_t overhead = UINT64_MAX;\n"
+        "    for (size_t i = 0; i < 1000; i++) {\n"
+        "        uint64_t start = profile_read_cycles();\n"
+        "        uint64_t cycles = profile_read_cycles() - start;\n"
+        "        overhead = cycles < overhead ? cycles : overhead;\n"
+        "    }\n"
+        "    fprintf(stderr, \"{\\\"overhead_cycles\\\": %\" PRIu64 \", \\\"phases\\\": [\", overhead);\n"
+        "    const char *separator = \"\";\n"
+        "    for (size_t r = 0; r <= ROUNDS; r++) {\n"
+        "        for (size_t phase = 0; phase < PROFILE_PHASES; phase++) {\n"
+        "            uint64_t count = 0;\n"
+        "            for (size_t bucket = 0; bucket < PROFILE_BUCKETS; bucket++) {\n"
+        "                count += profile_histograms[r][phase][bucket];\n"
+        "            }\n"
+        "            if (count == 0) {\n"
+        "                continue;\n"
+        "            }\n"
+        "            fprintf(stderr, \"%s{\\\"round\\\": %zu, \\\"phase\\\": \\\"%s\\\", \\\"count\\\": %\" PRIu64 \", \\\"cycles\\\": %\" PRIu64 \", \\\"mean_cycles\\\": %.1f, \\\"histogram\\\": [\",\n"
+        "                    separator, r + STRUCTURED_ROUNDS, PROFILE_PHASE_NAMES[phase], count, profile_cycles[r][phase], (double) profile_cycles[r][phase] / count);\n"
+        "            for (size_t bucket = 0; bucket < PROFILE_BUCKETS; bucket++) {\n"
+        "                fprintf(stderr, \"%s%\" PRIu64, bucket == 0 ? \"\" : \", \", profile_histograms[r][phase][bucket]);\n"
+        "            }\n"
+        "            fprintf(stderr, \"]}\");\n"
+        "            separator = \", \";\n"
+        "        }\n"
+        "    }\n"
+        "    fprintf(stderr, \"]}\\n\");\n"
+        "}\n"
+        "\n"
+        "#define PROFILE(r, phase, ...) do { uint64_t profile_start = profile_read_cycles(); __VA_ARGS__; profile_record((r), (phase), profile_read_cycles() - profile_start); } while (0)\n"
+        "#else\n"
+        "#define PROFILE(r, phase, ...) __VA_ARGS__\n"
+        "#endif\n"
+    )
 
     _FROM_BITS = (
-        "void from_bits(uint8_t bits[BLOCK_SIZE], WORD_TYPE *x, WORD_TYPE *y) {\n"
+        "static void from_bits(const uint8_t bits[BLOCK_SIZE], WORD_TYPE *x, WORD_TYPE *y) {\n"
         "    *x = 0;\n"
         "    *y = 0;\n"
         "    for (size_t i = 0; i < WORD_SIZE; i++) {\n"
@@ -49,7 +211,7 @@ class CodeGenerator(ABC):
     )
 
     _TO_BITS = (
-        "void to_bits(WORD_TYPE x, WORD_TYPE y, uint8_t bits[BLOCK_SIZE]) {\n"
+        "static void to_bits(WORD_TYPE x, WORD_TYPE y, uint8_t bits[BLOCK_SIZE]) {\n"
         "    for (size_t i = 0; i < WORD_SIZE; i++) {\n"
         "        bits[i] = (x >> i) & 1;\n"
         "        bits[WORD_SIZE + i] = (y >> i) & 1;\n"
@@ -58,7 +220,7 @@ class CodeGenerator(ABC):
     )
 
     _MATRIX_VECTOR_PRODUCT = (
-        "void matrix_vector_product(uint8_t matrix[BLOCK_SIZE][BLOCK_SIZE], uint8_t xy[BLOCK_SIZE], uint8_t res[BLOCK_SIZE]) {\n"
+        "static void matrix_vector_product(const uint8_t matrix[BLOCK_SIZE][BLOCK_SIZE], const uint8_t xy[BLOCK_SIZE], uint8_t res[BLOCK_SIZE]) {\n"
         "    for (size_t i = 0; i < BLOCK_SIZE; i++) {\n"
         "        for (size_t j = 0; j < BLOCK_SIZE; j++) {\n"
         "            res[i] ^= matrix[i][j] * xy[j];\n"
@@ -68,7 +230,7 @@ class CodeGenerator(ABC):
     )
 
     _VECTOR_ADDITION = (
-        "void vector_addition(uint8_t vector[BLOCK_SIZE], uint8_t xy[BLOCK_SIZE]) {\n"
+        "static void vector_addition(const uint8_t vector[BLOCK_SIZE], uint8_t xy[BLOCK_SIZE]) {\n"
         "    for (size_t i = 0; i < BLOCK_SIZE; i++) {\n"
         "        xy[i] ^= vector[i];\n"
         "    }\n"
@@ -76,7 +238,7 @@ class CodeGenerator(ABC):
     )
 
     _MODULAR_ADDITION = (
-        "void modular_addition(uint8_t xy[BLOCK_SIZE]) {\n"
+        "static void modular_addition(uint8_t xy[BLOCK_SIZE]) {\n"
         "    uint8_t carry = 0;\n"
         "    for (size_t i = 0; i < WORD_SIZE; i++) {\n"
         "        xy[i] = xy[i] + xy[WORD_SIZE + i] + carry;\n"
@@ -86,26 +248,384 @@ class CodeGenerator(ABC):
         "}\n"
     )
 
+    _MODULAR_SUBTRACTION = (
+        "static void modular_subtraction(uint8_t xy[BLOCK_SIZE]) {\n"
+        "    uint8_t borrow = 0;\n"
+        "    for (size_t i = 0; i < WORD_SIZE; i++) {\n"
+        "        int difference = xy[i] - xy[WORD_SIZE + i] - borrow;\n"
+        "        borrow = difference < 0;\n"
+        "        xy[i] = difference & 1;\n"
+        "    }\n"
+        "}\n"
+    )
+
     _ENCRYPT = (
-        "void encrypt(WORD_TYPE p[2], WORD_TYPE c[2]) {\n"
+        "static void encrypt(const WORD_TYPE p[2], WORD_TYPE c[2]) {\n"
         "    uint8_t xy[BLOCK_SIZE];\n"
         "    uint8_t res[BLOCK_SIZE];\n"
         "    to_bits(p[0], p[1], xy);\n"
         "    for (size_t i = 0; i < ROUNDS; i++) {\n"
+        "        PREFETCH_ROUND(i + 1);\n"
         "        memset(&res, 0, BLOCK_SIZE * sizeof(uint8_t));\n"
-        "        matrix_vector_product(MATRICES[i], xy, res);\n"
-        "        vector_addition(VECTORS[i], res);\n"
-        "        modular_addition(res);\n"
+        "        PROFILE(i, PROFILE_MATRIX_VECTOR_PRODUCT, matrix_vector_product(MATRICES[i], xy, res));\n"
+        "        PROFILE(i, PROFILE_VECTOR_ADDITION, vector_addition(VECTORS[i], res));\n"
+        "        PROFILE(i, PROFILE_MODULAR_ADDITION, modular_addition(res));\n"
         "        memcpy(&xy, &res, BLOCK_SIZE * sizeof(uint8_t));\n"
         "    }\n"
         "\n"
         "    memset(&res, 0, BLOCK_SIZE * sizeof(uint8_t));\n"
-        "    matrix_vector_product(MATRICES[ROUNDS], xy, res);\n"
-        "    vector_addition(VECTORS[ROUNDS], res);\n"
+        "    PROFILE(ROUNDS, PROFILE_MATRIX_VECTOR_PRODUCT, matrix_vector_product(MATRICES[ROUNDS], xy, res));\n"
+        "    PROFILE(ROUNDS, PROFILE_VECTOR_ADDITION, vector_addition(VECTORS[ROUNDS], res));\n"
         "    from_bits(res, &c[0], &c[1]);\n"
         "}\n"
     )
 
+    _ENCRYPT_BLOCKS = (
+        "static void encrypt_blocks(const WORD_TYPE *in, WORD_TYPE *out, size_t n) {\n"
+        "    for (size_t i = 0; i < n; i++) {\n"
+        "        encrypt(&in[2 * i], &out[2 * i]);\n"
+        "    }\n"
+        "}\n"
+    )
+
+    _ENCRYPT_INSTANCE_BLOCKS = (
+        "static void encrypt_instance_blocks(size_t id, const WORD_TYPE *in, WORD_TYPE *out, size_t n) {\n"
+        "    for (size_t i = 0; i < n; i++) {\n"
+        "        encrypt_instance(id, &in[2 * i], &out[2 * i]);\n"
+        "    }\n"
+        "}\n"
+    )
+
+    _MAPPED_TABLE_INCLUDES = (
+        "#include <fcntl.h>\n"
+        "#include <string.h>\n"
+        "#include <sys/mman.h>\n"
+        "#include <sys/stat.h>\n"
+        "#include <unistd.h>\n"
+    )
+
+    # A library uses dladdr to find the mapped table file in its own directory.
+    _MAPPED_TABLE_LIBRARY_INCLUDES = "#include <dlfcn.h>\n"
+
+    # A mapped table file starts with a header of MAPPED_TABLE_HEADER_BYTES bytes: the magic, the version, the block size, the number of rounds, the layout, and the size of the tables, followed by a CRC-32 of these fields and the tables.
+    # With -DWBS_MAP_POPULATE, the whole file is read when it is mapped, and with -DWBS_MAP_HUGEPAGES, the kernel is advised to back it with huge pages.
+    _LOAD_TABLES = (
+        "static const uint8_t *tables_mapping;\n"
+        "\n"
+        "static uint32_t mapped_table_crc32(uint32_t crc, const uint8_t *bytes, size_t n) {\n"
+        "    crc = ~crc;\n"
+        "    for (size_t i = 0; i < n; i++) {\n"
+        "        crc ^= bytes[i];\n"
+        "        for (size_t j = 0; j < 8; j++) {\n"
+        "            crc = (crc >> 1) ^ (UINT32_C(0xedb88320) & -(crc & 1));\n"
+        "        }\n"
+        "    }\n"
+        "    return ~crc;\n"
+        "}\n"
+        "\n"
+        "static uint64_t mapped_table_field(const uint8_t *bytes, size_t n) {\n"
+        "    uint64_t value = 0;\n"
+        "    for (size_t i = n; i-- > 0;) {\n"
+        "        value = (value << 8) | bytes[i];\n"
+        "    }\n"
+        "    return value;\n"
+        "}\n"
+        "\n"
+        "static int load_tables(const char *path) {\n"
+        "    size_t size = MAPPED_TABLE_HEADER_BYTES + MAPPED_TABLE_BYTES;\n"
+        "    int fd = open(path, O_RDONLY | O_CLOEXEC);\n"
+        "    if (fd < 0) {\n"
+        "        return -1;\n"
+        "    }\n"
+        "    struct stat st;\n"
+        "    if (fstat(fd, &st) != 0 || (size_t) st.st_size != size) {\n"
+        "        close(fd);\n"
+        "        return -1;\n"
+        "    }\n"
+        "    int flags = MAP_SHARED;\n"
+        "#if defined(WBS_MAP_POPULATE) && defined(MAP_POPULATE)\n"
+        "    flags |= MAP_POPULATE;\n"
+        "#endif\n"
+        "    uint8_t *mapping = mmap(NULL, size, PROT_READ, flags, fd, 0);\n"
+        "    close(fd);\n"
+        "    if (mapping == MAP_FAILED) {\n"
+        "        return -1;\n"
+        "    }\n"
+        "#if defined(WBS_MAP_HUGEPAGES) && defined(MADV_HUGEPAGE)\n"
+        "    madvise(mapping, size, MADV_HUGEPAGE);\n"
+        "#endif\n"
+        "    uint32_t checksum = mapped_table_crc32(mapped_table_crc32(0, mapping, 32), &mapping[MAPPED_TABLE_HEADER_BYTES], MAPPED_TABLE_BYTES);\n"
+        "    if (memcmp(mapping, MAPPED_TABLE_MAGIC, 8) != 0 ||\n"
+        "        mapped_table_field(&mapping[8], 4) != MAPPED_TABLE_VERSION ||\n"
+        "        mapped_table_field(&mapping[12], 4) != BLOCK_SIZE ||\n"
+        "        mapped_table_field(&mapping[16], 4) != ROUNDS ||\n"
+        "        mapped_table_field(&mapping[20], 4) != MAPPED_TABLE_LAYOUT ||\n"
+        "        mapped_table_field(&mapping[24], 8) != MAPPED_TABLE_BYTES ||\n"
+        "        mapped_table_field(&mapping[32], 4) != checksum) {\n"
+        "        munmap(mapping, size);\n"
+        "        return -1;\n"
+        "    }\n"
+        # The previous tables are unmapped, so they must not be used by another thread while the tables are replaced.
+        "    if (tables_mapping != NULL) {\n"
+        "        munmap((void *) tables_mapping, size);\n"
+        "    }\n"
+        "    tables_mapping = mapping;\n"
+        "    return 0;\n"
+        "}\n"
+        "\n"
+        "#define TABLES (&tables_mapping[MAPPED_TABLE_HEADER_BYTES])\n"
+    )
+
+    _ENCRYPT_BLOCKS_PARALLEL = (
+        "typedef struct encrypt_blocks_task {\n"
+        "    const WORD_TYPE *in;\n"
+        "    WORD_TYPE *out;\n"
+        "    size_t n;\n"
+        "    size_t cpu;\n"
+        "} encrypt_blocks_task;\n"
+        "\n"
+        "static void *encrypt_blocks_worker(void *arg) {\n"
+        "    encrypt_blocks_task *task = arg;\n"
+        "#ifdef WBS_PIN_THREADS\n"
+        "    cpu_set_t cpus;\n"
+        "    CPU_ZERO(&cpus);\n"
+        "    CPU_SET(task->cpu % CPU_SETSIZE, &cpus);\n"
+        "    pthread_setaffinity_np(pthread_self(), sizeof(cpus), &cpus);\n"
+        "#endif\n"
+        "    encrypt_blocks(task->in, task->out, task->n);\n"
+        "    return NULL;\n"
+        "}\n"
+        "\n"
+        "static void encrypt_blocks_parallel(const WORD_TYPE *in, WORD_TYPE *out, size_t n, size_t threads) {\n"
+        "    size_t chunks = (n + PARALLEL_CHUNK_BLOCKS - 1) / PARALLEL_CHUNK_BLOCKS;\n"
+        "    if (threads > chunks) {\n"
+        "        threads = chunks;\n"
+        "    }\n"
+        "    if (threads < 2) {\n"
+        "        encrypt_blocks(in, out, n);\n"
+        "        return;\n"
+        "    }\n"
+        "\n"
+        # Every thread encrypts one contiguous range of whole chunks, so threads never write to the same cache line.
+        "    pthread_t handles[threads];\n"
+        "    int started[threads];\n"
+        "    encrypt_blocks_task tasks[threads];\n"
+        "    size_t start = 0;\n"
+        "    for (size_t i = 0; i < threads; i++) {\n"
+        "        size_t end = (chunks * (i + 1) / threads) * PARALLEL_CHUNK_BLOCKS;\n"
+        "        if (end > n) {\n"
+        "            end = n;\n"
+        "        }\n"
+        "        tasks[i].in = &in[2 * start];\n"
+        "        tasks[i].out = &out[2 * start];\n"
+        "        tasks[i].n = end - start;\n"
+        "        tasks[i].cpu = i;\n"
+        "        start = end;\n"
+        "    }\n"
+        "\n"
+        # The calling thread encrypts the first range itself, and any range for which no thread could be created.
+        "    for (size_t i = 1; i < threads; i++) {\n"
+        "        started[i] = pthread_create(&handles[i], NULL, encrypt_blocks_worker, &tasks[i]) == 0;\n"
+        "    }\n"
+        "    encrypt_blocks_worker(&tasks[0]);\n"
+        "    for (size_t i = 1; i < threads; i++) {\n"
+        "        if (started[i]) {\n"
+        "            pthread_join(handles[i], NULL);\n"
+        "        } else {\n"
+        "            encrypt_blocks_worker(&tasks[i]);\n"
+        "        }\n"
+        "    }\n"
+        "}\n"
+    )
+
+    _BENCHMARK = (
+        "static int compare_cycles(const void *a, const void *b) {\n"
+        "    uint64_t x = *(const uint64_t *) a;\n"
+        "    uint64_t y = *(const uint64_t *) b;\n"
+        "    return (x > y) - (x < y);\n"
+        "}\n"
+        "\n"
+        "static int benchmark(size_t iterations) {\n"
+        "    size_t batches = (iterations + BENCHMARK_BATCH_BLOCKS - 1) / BENCHMARK_BATCH_BLOCKS;\n"
+        "    size_t blocks = batches * BENCHMARK_BATCH_BLOCKS;\n"
+        "    WORD_TYPE *in = malloc(2 * blocks * sizeof(WORD_TYPE));\n"
+        "    WORD_TYPE *out = malloc(2 * blocks * sizeof(WORD_TYPE));\n"
+        "    uint64_t *latencies = malloc(batches * sizeof(uint64_t));\n"
+        "    if (batches == 0 || in == NULL || out == NULL || latencies == NULL) {\n"
+        "        return -1;\n"
+        "    }\n"
+        # The plaintexts are generated before timing, so rand() is not measured.
+        "    for (size_t i = 0; i < 2 * blocks; i++) {\n"
+        "        in[i] = (((WORD_TYPE) rand()) << (WORD_SIZE / 2)) | ((WORD_TYPE) rand());\n"
+        "    }\n"
+        "    size_t warmup_blocks = blocks < BENCHMARK_WARMUP_BLOCKS ? blocks : BENCHMARK_WARMUP_BLOCKS;\n"
+        "    for (size_t i = 0; i < BENCHMARK_WARMUP_PASSES; i++) {\n"
+        "        encrypt_blocks(in, out, warmup_blocks);\n"
+        "    }\n"
+        "\n"
+        "    struct timespec start;\n"
+        "    struct timespec end;\n"
+        "    clock_gettime(CLOCK_MONOTONIC, &start);\n"
+        "    uint64_t start_cycles = READ_CYCLES();\n"
+        "    for (size_t i = 0; i < batches; i++) {\n"
+        "        uint64_t batch_start_cycles = READ_CYCLES();\n"
+        "        encrypt_blocks(&in[2 * i * BENCHMARK_BATCH_BLOCKS], &out[2 * i * BENCHMARK_BATCH_BLOCKS], BENCHMARK_BATCH_BLOCKS);\n"
+        "        latencies[i] = READ_CYCLES() - batch_start_cycles;\n"
+        "    }\n"
+        "    uint64_t cycles = READ_CYCLES() - start_cycles;\n"
+        "    clock_gettime(CLOCK_MONOTONIC, &end);\n"
+        "\n"
+        # The checksum is printed, so the compiler cannot eliminate the encryptions.
+        "    uint64_t checksum = 0;\n"
+        "    for (size_t i = 0; i < 2 * blocks; i++) {\n"
+        "        checksum = (checksum * UINT64_C(1099511628211)) ^ (uint64_t) out[i];\n"
+        "    }\n"
+        "    qsort(latencies, batches, sizeof(uint64_t), compare_cycles);\n"
+        "    double seconds = (end.tv_sec - start.tv_sec) + (end.tv_nsec - start.tv_nsec) / 1e9;\n"
+        "    printf(\"{\\\"blocks\\\": %zu, \\\"block_bytes\\\": %d, \\\"seconds\\\": %.9f, \\\"blocks_per_second\\\": %.1f, \\\"cycles\\\": %\" PRIu64 \", \\\"cycles_per_byte\\\": %.3f, \"\n"
+        "           \"\\\"latency_cycles_per_block\\\": {\\\"p50\\\": %.1f, \\\"p90\\\": %.1f, \\\"p99\\\": %.1f, \\\"max\\\": %.1f}, \\\"checksum\\\": \\\"%016\" PRIx64 \"\\\"}\\n\",\n"
+        "           blocks, BLOCK_SIZE / 8, seconds, blocks / seconds, cycles, (double) cycles / (blocks * (BLOCK_SIZE / 8)),\n"
+        "           (double) latencies[batches / 2] / BENCHMARK_BATCH_BLOCKS, (double) latencies[batches * 9 / 10] / BENCHMARK_BATCH_BLOCKS,\n"
+        "           (double) latencies[batches * 99 / 100] / BENCHMARK_BATCH_BLOCKS, (double) latencies[batches - 1] / BENCHMARK_BATCH_BLOCKS, checksum);\n"
+        "    free(in);\n"
+        "    free(out);\n"
+        "    free(latencies);\n"
+        "    return 0;\n"
+        "}\n"
+    )
+
+    # Reads hex lines containing the x and y words from stdin, and writes the results as hex lines to stdout.
+    _STREAM_HEX = (
+        "static int stream_hex(void (*blocks)(const WORD_TYPE *, WORD_TYPE *, size_t)) {\n"
+        "    WORD_TYPE *in = malloc(2 * STREAM_CHUNK_BLOCKS * sizeof(WORD_TYPE));\n"
+        "    WORD_TYPE *out = malloc(2 * STREAM_CHUNK_BLOCKS * sizeof(WORD_TYPE));\n"
+        "    if (in == NULL || out == NULL) {\n"
+        "        return -1;\n"
+        "    }\n"
+        "    int count = 2;\n"
+        "    while (count == 2) {\n"
+        "        size_t n = 0;\n"
+        "        while (n < STREAM_CHUNK_BLOCKS && (count = scanf(\"%\" WORD_IN_TYPE \" %\" WORD_IN_TYPE, &in[2 * n], &in[2 * n + 1])) == 2) {\n"
+        "            n++;\n"
+        "        }\n"
+        "        blocks(in, out, n);\n"
+        "        for (size_t i = 0; i < n; i++) {\n"
+        "            printf(\"%\" WORD_OUT_TYPE \" %\" WORD_OUT_TYPE \"\\n\", out[2 * i], out[2 * i + 1]);\n"
+        "        }\n"
+        "    }\n"
+        "    free(in);\n"
+        "    free(out);\n"
+        "    if (count != EOF) {\n"
+        "        fprintf(stderr, \"Expected lines containing two hexadecimal words\\n\");\n"
+        "        return -1;\n"
+        "    }\n"
+        "    return 0;\n"
+        "}\n"
+    )
+
+    # Reads blocks from stdin and writes the results to stdout, every block is the x word followed by the y word, both in little-endian byte order.
+    _STREAM_BINARY = (
+        "static int stream_binary(void (*blocks)(const WORD_TYPE *, WORD_TYPE *, size_t)) {\n"
+        "    uint8_t *bytes = malloc(STREAM_CHUNK_BLOCKS * STREAM_BLOCK_BYTES);\n"
+        "    WORD_TYPE *in = malloc(2 * STREAM_CHUNK_BLOCKS * sizeof(WORD_TYPE));\n"
+        "    WORD_TYPE *out = malloc(2 * STREAM_CHUNK_BLOCKS * sizeof(WORD_TYPE));\n"
+        "    if (bytes == NULL || in == NULL || out == NULL) {\n"
+        "        return -1;\n"
+        "    }\n"
+        "    int status = 0;\n"
+        "    size_t size;\n"
+        "    while ((size = fread(bytes, 1, STREAM_CHUNK_BLOCKS * STREAM_BLOCK_BYTES, stdin)) > 0) {\n"
+        "        if (size % STREAM_BLOCK_BYTES != 0) {\n"
+        "            fprintf(stderr, \"Expected a multiple of %d bytes\\n\", STREAM_BLOCK_BYTES);\n"
+        "            status = -1;\n"
+        "            break;\n"
+        "        }\n"
+        "        size_t n = size / STREAM_BLOCK_BYTES;\n"
+        "        for (size_t i = 0; i < 2 * n; i++) {\n"
+        "            in[i] = 0;\n"
+        "            for (size_t j = 0; j < STREAM_WORD_BYTES; j++) {\n"
+        "                in[i] |= ((WORD_TYPE) bytes[i * STREAM_WORD_BYTES + j]) << (8 * j);\n"
+        "            }\n"
+        "        }\n"
+        "        blocks(in, out, n);\n"
+        "        for (size_t i = 0; i < 2 * n; i++) {\n"
+        "            for (size_t j = 0; j < STREAM_WORD_BYTES; j++) {\n"
+        "                bytes[i * STREAM_WORD_BYTES + j] = (uint8_t) (out[i] >> (8 * j));\n"
+        "            }\n"
+        "        }\n"
+        "        fwrite(bytes, 1, size, stdout);\n"
+        "    }\n"
+        "    free(bytes);\n"
+        "    free(in);\n"
+        "    free(out);\n"
+        "    return status;\n"
+        "}\n"
+    )
+
+    # The number of blocks which are read, transformed, and written at once in the streaming modes.
+    _STREAM_CHUNK_BLOCKS = 4096
+    _STREAM_BUFFER_BYTES = 1 << 20
+
+    # Latencies are measured per batch of blocks, as reading the cycle counter for every block would dominate the measurement.
+    _BENCHMARK_BATCH_BLOCKS = 64
+    _BENCHMARK_WARMUP_BLOCKS = 16384
+    _BENCHMARK_WARMUP_PASSES = 2
+
+    # The number of blocks in a chunk, a multiple of the cache line size for every word type.
+    _PARALLEL_CHUNK_BLOCKS = 64
+
+    # Rough estimates of the size of the machine code: the loops and functions shared by all layers, and every operation of straight-line code.
+    _SHARED_CODE_BYTES = 1024
+    _CODE_BYTES_PER_OPERATION = 4
+
+    # The header of a mapped table file, the tables start at the next cache line.
+    _MAPPED_TABLE_MAGIC = b"WBSTABLE"
+    _MAPPED_TABLE_VERSION = 1
+    _MAPPED_TABLE_HEADER_BYTES = 64
+
+    # The functions which are renamed in decryption implementations.
+    _DECRYPTION_NAMES = {
+        "encrypt": "decrypt",
+        "modular_addition": "modular_subtraction",
+    }
+
+    # The leading rounds whose matrix only rotates the words (e.g. the first round of encryption, which is not encoded) are computed on the words instead of using the kernel.
+    # Subclasses which read specific layers of the tables (e.g. the external encodings) disable this.
+    _STRUCTURED_ROUNDS = True
+
+    def __init__(self, parallel=False, library=False, symbol_prefix="wbs_", cache_layout=False, decrypt=False, table_file=None, mapped_table_file=None):
+        """
+        Initializes an instance of CodeGenerator with the provided parameters.
+        :param parallel: whether to emit a multithreaded bulk encryption function (encrypt_blocks_parallel)
+        :param library: whether to emit a reentrant library instead of a program, exporting only the prefixed functions
+        :param symbol_prefix: the prefix of the functions exported by a library
+        :param cache_layout: whether to align the tables to cache lines and store the rows in the order the kernel reads them
+        :param decrypt: whether to emit a decryption implementation (decrypt and decrypt_blocks) for the layers of WhiteBoxSpeck.inverse_affine_layers
+        :param table_file: the name of a binary file containing the tables (see table_blob), which is included at compile time instead of emitting the tables as C literals (default: None)
+        :param mapped_table_file: the name of a versioned binary file containing the tables (see mapped_table_blob), which is memory-mapped at run time instead of compiling the tables in (default: None)
+        """
+        assert table_file is None or mapped_table_file is None, "The tables are either included at compile time or mapped at run time"
+
+        self.parallel = parallel
+        self.library = library
+        self.symbol_prefix = symbol_prefix
+        self.cache_layout = cache_layout
+        self.decrypt = decrypt
+        self.table_file = table_file
+        self.mapped_table_file = mapped_table_file
+
+    def _benchmark_includes(self):
+        # The main function compares its arguments, and not every strategy includes string.h itself.
+        return self._INCLUDE_STRING + \
+               self._INCLUDE_TIME + \
+               self._INCLUDE_X86INTRIN
+
+    def _parallel_includes(self):
+        return self._INCLUDE_PTHREAD + \
+               self._INCLUDE_SCHED + \
+               self._INCLUDE_STRING + \
+               self._INCLUDE_TIME
+
     def _includes(self):
         return self._INCLUDE_INTTYPES + \
                self._INCLUDE_STDDEF + \
@@ -137,6 +657,20 @@ class CodeGenerator(ABC):
     def _define_rounds(self, rounds):
         return f"#define ROUNDS {rounds}\n"
 
+    def _define_benchmark(self):
+        return f"#define BENCHMARK_BATCH_BLOCKS {self._BENCHMARK_BATCH_BLOCKS}\n" + \
+               f"#define BENCHMARK_WARMUP_BLOCKS {self._BENCHMARK_WARMUP_BLOCKS}\n" + \
+               f"#define BENCHMARK_WARMUP_PASSES {self._BENCHMARK_WARMUP_PASSES}\n"
+
+    def _define_stream(self):
+        return f"#define STREAM_CHUNK_BLOCKS {self._STREAM_CHUNK_BLOCKS}\n" + \
+               f"#define STREAM_BUFFER_BYTES {self._STREAM_BUFFER_BYTES}\n" + \
+               "#define STREAM_WORD_BYTES (WORD_SIZE / 8)\n" + \
+               "#define STREAM_BLOCK_BYTES (BLOCK_SIZE / 8)\n"
+
+    def _define_parallel_chunk_blocks(self):
+        return f"#define PARALLEL_CHUNK_BLOCKS {self._PARALLEL_CHUNK_BLOCKS}\n"
+
     def _defines(self, block_size, word_size, rounds):
         return self._define_block_size(block_size) + \
                self._define_word_size(word_size) + \
@@ -145,6 +679,252 @@ class CodeGenerator(ABC):
                self._define_word_out_type(word_size) + \
                self._define_rounds(rounds)
 
+    def _modular_operation(self):
+        # Decryption uses the inverse of the modular addition.
+        return self._MODULAR_SUBTRACTION if self.decrypt else self._MODULAR_ADDITION
+
+    def _rename_for_decryption(self, code):
+        # Decryption implementations share all code with encryption implementations, only the names of the functions differ.
+        return re.sub(r"(?<![A-Za-z])(encrypt|modular_addition)", lambda match: self._DECRYPTION_NAMES[match.group(1)], code)
+
+    def _word_rotations(self, matrix):
+        """
+        Returns the rotations of the words if the matrix only rotates the x and y words.
+        :param matrix: the matrix
+        :return: a tuple containing the number of positions the x and y words are rotated right, or None if the matrix is not a rotation of the words
+        """
+        word_size = matrix.nrows() // 2
+        rotations = []
+        for offset in [0, word_size]:
+            positions = matrix.nonzero_positions_in_row(offset)
+            if len(positions) != 1 or not offset <= positions[0] < offset + word_size:
+                return None
+
+            # Output bit i of a word rotated right by r positions is input bit (i + r) % WORD_SIZE of the same word.
+            rotation = positions[0] - offset
+            if any(list(matrix.nonzero_positions_in_row(offset + i)) != [offset + (i + rotation) % word_size] for i in range(word_size)):
+                return None
+
+            rotations.append(rotation)
+
+        return tuple(rotations)
+
+    def structured_rounds(self, matrices, vectors):
+        """
+        Returns the number of leading rounds whose matrix only rotates the words, which are computed on the words instead of using the kernel.
+        The last layer is never structured, so the kernel always computes at least one layer.
+        :param matrices: the matrices
+        :param vectors: the vectors
+        :return: the number of structured rounds
+        """
+        if not self._STRUCTURED_ROUNDS:
+            return 0
+
+        rounds = 0
+        while rounds < len(matrices) - 1 and self._word_rotations(matrices[rounds]) is not None:
+            rounds += 1
+        return rounds
+
+    def _instance_structured_rounds(self, instances):
+        # The structured rounds are code shared by all instances, so they are only used if they are the same in all instances.
+        rounds = self.structured_rounds(*instances[0])
+        if any(matrices[:rounds] != instances[0][0][:rounds] or vectors[:rounds] != instances[0][1][:rounds] for matrices, vectors in instances):
+            return 0
+        return rounds
+
+    def _structured_rounds_function(self, matrices, vectors):
+        # A zero vector is not added at all, and a rotation by 0 positions is not emitted at all.
+        word_size = matrices[0].nrows() // 2
+        mask = f"0x{(1 << word_size) - 1:02x}"
+        s = f"#define STRUCTURED_ROUNDS {len(matrices)}\n"
+        s += "\n"
+        s += "static inline void structured_rounds(const WORD_TYPE in[2], WORD_TYPE p[2]) {\n"
+        s += "    WORD_TYPE x = in[0];\n"
+        s += "    WORD_TYPE y = in[1];\n"
+        for matrix, vector in zip(matrices, vectors):
+            for word, rotation, part in zip(["x", "y"], self._word_rotations(matrix), [vector[:word_size], vector[word_size:]]):
+                value = sum(int(b) << i for i, b in enumerate(part))
+                if rotation != 0:
+                    s += f"    {word} = (({word} >> {rotation}) | ({word} << {word_size - rotation})) & {mask};\n"
+                if value != 0:
+                    s += f"    {word} ^= 0x{value:x};\n"
+            s += f"    x = (x {'-' if self.decrypt else '+'} y) & {mask};\n"
+        s += "    p[0] = x;\n"
+        s += "    p[1] = y;\n"
+        s += "}\n"
+        return s
+
+    def _structured_encrypt(self, functions, signature="static void encrypt(const WORD_TYPE p[2], WORD_TYPE c[2]) {\n"):
+        # The structured rounds are computed on the input words, so the kernel only computes the remaining rounds of the plaintext p.
+        assert signature in functions
+        functions = functions.replace(signature, signature.replace(" p[2]", " in[2]") + "    WORD_TYPE p[2];\n    structured_rounds(in, p);\n")
+        signature = "static void encrypt_interleaved(const WORD_TYPE p[INTERLEAVE][2], WORD_TYPE c[INTERLEAVE][2]) {\n"
+        return functions.replace(signature, signature.replace(" p[", " in[") + "    WORD_TYPE p[INTERLEAVE][2];\n    for (size_t b = 0; b < INTERLEAVE; b++) {\n        structured_rounds(in[b], p[b]);\n    }\n")
+
+    def _table_alignment(self):
+        if not self.cache_layout:
+            return ""
+
+        return f" __attribute__((aligned({self._CACHE_LINE_SIZE})))"
+
+    def table_bytes(self, matrices, vectors):
+        """
+        Returns the size of the tables containing the matrices and vectors.
+        :param matrices: the matrices
+        :param vectors: the vectors
+        :return: the size in bytes, or None if the strategy does not use tables
+        """
+        return None
+
+    def tables(self, matrices, vectors):
+        """
+        Returns the tables containing the matrices and vectors, in the memory layout of the kernel.
+        :param matrices: the matrices
+        :param vectors: the vectors
+        :return: a list containing a (name, element type, dimensions, element size, values) tuple for every table, or None if the strategy does not use dense tables
+        """
+        return None
+
+    def table_blob(self, matrices, vectors):
+        """
+        Returns the contents of the table file of the matrices and vectors.
+        :param matrices: the matrices
+        :param vectors: the vectors
+        :return: the table file contents, or None if the strategy does not use dense tables
+        """
+        structured = self.structured_rounds(matrices, vectors)
+        tables = self.tables(matrices[structured:], vectors[structured:])
+        return None if tables is None else serialize_tables(tables, self._CACHE_LINE_SIZE)[0]
+
+    def _mapped_table_layout(self, tables):
+        # A table file can only be mapped by a kernel of the same strategy and direction, which reads the tables in the same layout.
+        layout = f"{type(self).__name__} {'decrypt' if self.decrypt else 'encrypt'}"
+        for name, element_type, dimensions, element_bytes, values in tables:
+            layout += f"; {element_type} {name}{dimensions} {element_bytes}"
+        return zlib.crc32(layout.encode())
+
+    def mapped_table_blob(self, matrices, vectors):
+        """
+        Returns the contents of the mapped table file of the matrices and vectors, which can be loaded at run time by every implementation of the same strategy and parameters generated with mapped_table_file.
+        :param matrices: the matrices
+        :param vectors: the vectors
+        :return: the mapped table file contents, or None if the strategy does not use dense tables
+        """
+        structured = self.structured_rounds(matrices, vectors)
+        matrices, vectors = matrices[structured:], vectors[structured:]
+        tables = self.tables(matrices, vectors)
+        if tables is None:
+            return None
+
+        blob = serialize_tables(tables, self._CACHE_LINE_SIZE)[0]
+        header = self._MAPPED_TABLE_MAGIC + struct.pack("<IIIIQ", self._MAPPED_TABLE_VERSION, matrices[0].nrows(), len(matrices) - 1, self._mapped_table_layout(tables), len(blob))
+        header += struct.pack("<I", zlib.crc32(blob, zlib.crc32(header)))
+        return header + bytes(self._MAPPED_TABLE_HEADER_BYTES - len(header)) + blob
+
+    def _layer_operations(self, k, matrix, vector):
+        # Every entry is multiplied with an input bit and XORed into the result, and every vector bit is XORed into the result.
+        return {"xors": matrix.nrows() * matrix.ncols() + len(vector), "ands": matrix.nrows() * matrix.ncols(), "parities": 0}
+
+    def _layer_table_bytes(self, k, matrix, vector):
+        return self.table_bytes([matrix], [vector]) or 0
+
+    def _layer_code_bytes(self, k, operations):
+        # The kernels of most strategies are loops, which are shared by all layers.
+        return 0
+
+    def analyze(self, matrices, vectors):
+        """
+        Estimates the cost of the implementation of the matrices and vectors, without generating or compiling any code.
+        :param matrices: the matrices
+        :param vectors: the vectors
+        :return: a dict containing the figures of every layer (nonzero entries, XOR, AND, and parity operations, table bytes, estimated code bytes, and whether it is a structured round), and the totals of all layers, including the expected working set in bytes
+        """
+        assert len(matrices) > 0
+        assert len(vectors) > 0
+        assert len(matrices) == len(vectors)
+
+        structured = self.structured_rounds(matrices, vectors)
+        layers = []
+        for k, (matrix, vector) in enumerate(zip(matrices, vectors)):
+            if k < structured:
+                # A structured round only rotates the words and adds the nonzero words of the vector, it does not use the kernel or any tables.
+                word_size = matrix.nrows() // 2
+                layers.append({
+                    "nonzeros": len(matrix.nonzero_positions()),
+                    "xors": int(not vector[:word_size].is_zero()) + int(not vector[word_size:].is_zero()),
+                    "ands": 0,
+                    "parities": 0,
+                    "table_bytes": 0,
+                    "code_bytes": 0,
+                    "structured": 1,
+                })
+                continue
+
+            operations = self._layer_operations(k, matrix, vector)
+            layers.append({
+                "nonzeros": len(matrix.nonzero_positions()),
+                **operations,
+                "table_bytes": self._layer_table_bytes(k, matrix, vector),
+                "code_bytes": self._layer_code_bytes(k, operations),
+                "structured": 0,
+            })
+
+        total = {figure: sum(layer[figure] for layer in layers) for figure in layers[0]}
+        total["code_bytes"] += self._SHARED_CODE_BYTES
+        # Every block passes through all layers, so all tables and all code are part of the working set.
+        total["working_set_bytes"] = total["table_bytes"] + total["code_bytes"]
+        return {"layers": layers, "total": total}
+
+    def _table_types(self):
+        return ""
+
+    def _table_macros(self, tables, base):
+        # Every table is a macro which casts its offset in the blob to the type of the table.
+        offsets = serialize_tables(tables, self._CACHE_LINE_SIZE)[1]
+        s = ""
+        for (name, element_type, dimensions, element_bytes, values), offset in zip(tables, offsets):
+            s += f"#define {name} (*(const {element_type} (*){dimensions}) &TABLES[{base}{offset}])\n"
+        return s
+
+    def _table_file_layers(self, tables, base=""):
+        # #embed (C23) lets the compiler copy the file without parsing any literals, .incbin lets the assembler do the same for older compilers.
+        # .incbin searches the current directory and the directories passed using -Wa,-I.
+        s = self._table_types()
+        s += (
+            f"#ifdef __has_embed\n"
+            f"static const uint8_t TABLES[] __attribute__((aligned({self._CACHE_LINE_SIZE}))) = {{\n"
+            f"#embed \"{self.table_file}\"\n"
+            f"}};\n"
+            f"#else\n"
+            f"__asm__(\n"
+            f"    \".section .rodata\\n\"\n"
+            f"    \".balign {self._CACHE_LINE_SIZE}\\n\"\n"
+            f"    \"tables_blob:\\n\"\n"
+            f"    \".incbin \\\"{self.table_file}\\\"\\n\"\n"
+            f"    \".previous\\n\"\n"
+            f");\n"
+            f"extern const uint8_t tables_blob[] __attribute__((visibility(\"hidden\")));\n"
+            f"#define TABLES tables_blob\n"
+            f"#endif\n"
+            f"\n"
+        )
+        return s + self._table_macros(tables, base)
+
+    def _mapped_table_layers(self, tables):
+        s = (self._MAPPED_TABLE_LIBRARY_INCLUDES if self.library else "") + self._MAPPED_TABLE_INCLUDES
+        s += "\n"
+        s += f"#define MAPPED_TABLE_MAGIC \"{self._MAPPED_TABLE_MAGIC.decode()}\"\n"
+        s += f"#define MAPPED_TABLE_VERSION {self._MAPPED_TABLE_VERSION}\n"
+        s += f"#define MAPPED_TABLE_HEADER_BYTES {self._MAPPED_TABLE_HEADER_BYTES}\n"
+        s += f"#define MAPPED_TABLE_LAYOUT UINT32_C(0x{self._mapped_table_layout(tables):08x})\n"
+        s += f"#define MAPPED_TABLE_BYTES {len(serialize_tables(tables, self._CACHE_LINE_SIZE)[0])}\n"
+        s += f"#define MAPPED_TABLE_FILE \"{self.mapped_table_file}\"\n"
+        s += "\n"
+        s += self._table_types()
+        s += self._LOAD_TABLES
+        s += "\n"
+        return s + self._table_macros(tables, "")
+
     @abstractmethod
     def _matrices(self, matrices):
         pass
@@ -153,8 +933,17 @@ class CodeGenerator(ABC):
     def _vectors(self, vectors):
         pass
 
+    def _layers(self, matrices, vectors):
+        return self._matrices(matrices) + \
+               "\n" + \
+               self._vectors(vectors)
+
     def _functions(self, block_size, word_size, rounds):
-        return self._FROM_BITS + \
+        return self._PROFILE + \
+               "\n" + \
+               self._PREFETCH_ROUND + \
+               "\n" + \
+               self._FROM_BITS + \
                "\n" + \
                self._TO_BITS + \
                "\n" + \
@@ -162,36 +951,276 @@ class CodeGenerator(ABC):
                "\n" + \
                self._VECTOR_ADDITION + \
                "\n" + \
-               self._MODULAR_ADDITION + \
+               self._modular_operation() + \
                "\n" + \
                self._ENCRYPT
 
+    def _bulk_functions(self):
+        if not self.parallel:
+            return self._ENCRYPT_BLOCKS
+
+        return self._ENCRYPT_BLOCKS + \
+               "\n" + \
+               self._ENCRYPT_BLOCKS_PARALLEL
+
+    def _library_functions(self):
+        # Everything else is static, so only these functions are exported.
+        prefix = self.symbol_prefix
+        s = (
+            f"size_t {prefix}block_size(void) {{\n"
+            f"    return BLOCK_SIZE;\n"
+            f"}}\n"
+            f"\n"
+            f"size_t {prefix}word_bytes(void) {{\n"
+            f"    return sizeof(WORD_TYPE);\n"
+            f"}}\n"
+            f"\n"
+            f"void {prefix}encrypt(const WORD_TYPE p[2], WORD_TYPE c[2]) {{\n"
+            f"    encrypt(p, c);\n"
+            f"}}\n"
+            f"\n"
+            f"void {prefix}encrypt_blocks(const WORD_TYPE *in, WORD_TYPE *out, size_t n) {{\n"
+            f"    encrypt_blocks(in, out, n);\n"
+            f"}}\n"
+        )
+        if self.parallel:
+            s += (
+                f"\n"
+                f"void {prefix}encrypt_blocks_parallel(const WORD_TYPE *in, WORD_TYPE *out, size_t n, size_t threads) {{\n"
+                f"    encrypt_blocks_parallel(in, out, n, threads);\n"
+                f"}}\n"
+            )
+        return s
+
+    def _mapped_table_library_functions(self):
+        # The tables of the mapped table file in the directory of the library are loaded when the library is loaded, if it exists.
+        # Otherwise, no tables are loaded until load_tables succeeds, which callers check using tables_loaded.
+        return (
+            f"int {self.symbol_prefix}load_tables(const char *path) {{\n"
+            f"    return load_tables(path);\n"
+            f"}}\n"
+            f"\n"
+            f"int {self.symbol_prefix}tables_loaded(void) {{\n"
+            f"    return tables_mapping != NULL;\n"
+            f"}}\n"
+            f"\n"
+            f"__attribute__((constructor)) static void load_default_tables(void) {{\n"
+            f"    Dl_info info;\n"
+            f"    if (dladdr((void *) load_default_tables, &info) == 0 || info.dli_fname == NULL) {{\n"
+            f"        return;\n"
+            f"    }}\n"
+            f"    const char *slash = strrchr(info.dli_fname, '/');\n"
+            f"    size_t directory_length = slash != NULL ? (size_t) (slash - info.dli_fname) + 1 : 0;\n"
+            f"    char *path = malloc(directory_length + sizeof(MAPPED_TABLE_FILE));\n"
+            f"    if (path == NULL) {{\n"
+            f"        return;\n"
+            f"    }}\n"
+            f"    memcpy(path, info.dli_fname, directory_length);\n"
+            f"    memcpy(&path[directory_length], MAPPED_TABLE_FILE, sizeof(MAPPED_TABLE_FILE));\n"
+            f"    load_tables(path);\n"
+            f"    free(path);\n"
+            f"}}\n"
+        )
+
+    def _mapped_table_main(self):
+        # The WBS_TABLES environment variable overrides the mapped table file, e.g. to use the tables of another key.
+        return (
+            f"{self._run_function()}"
+            f"\n"
+            f"int main(int argc, char *argv[]) {{\n"
+            f"    const char *path = getenv(\"WBS_TABLES\") != NULL ? getenv(\"WBS_TABLES\") : MAPPED_TABLE_FILE;\n"
+            f"    if (load_tables(path) != 0) {{\n"
+            f"        fprintf(stderr, \"Unable to load the tables from %s\\n\", path);\n"
+            f"        return -1;\n"
+            f"    }}\n"
+            f"    return run(argc, argv);\n"
+            f"}}\n"
+        )
+
+    def _run_function(self):
+        # The main function of a single-instance program, which is called by another main function.
+        return self._main().replace("int main(int argc, char *argv[]) {", "static int run(int argc, char *argv[]) {")
+
+    def _instance_library_functions(self):
+        prefix = self.symbol_prefix
+        return (
+            f"size_t {prefix}block_size(void) {{\n"
+            f"    return BLOCK_SIZE;\n"
+            f"}}\n"
+            f"\n"
+            f"size_t {prefix}word_bytes(void) {{\n"
+            f"    return sizeof(WORD_TYPE);\n"
+            f"}}\n"
+            f"\n"
+            f"size_t {prefix}instances(void) {{\n"
+            f"    return INSTANCES;\n"
+            f"}}\n"
+            f"\n"
+            f"void {prefix}encrypt_instance(size_t id, const WORD_TYPE p[2], WORD_TYPE c[2]) {{\n"
+            f"    encrypt_instance(id, p, c);\n"
+            f"}}\n"
+            f"\n"
+            f"void {prefix}encrypt_instance_blocks(size_t id, const WORD_TYPE *in, WORD_TYPE *out, size_t n) {{\n"
+            f"    encrypt_instance_blocks(id, in, out, n);\n"
+            f"}}\n"
+        )
+
+    def _instance_main(self):
+        # Usage: ./speck INSTANCE followed by the arguments of a single-instance program, which uses the selected instance.
+        return (
+            f"static size_t instance;\n"
+            f"\n"
+            f"static void encrypt(const WORD_TYPE p[2], WORD_TYPE c[2]) {{\n"
+            f"    encrypt_instance(instance, p, c);\n"
+            f"}}\n"
+            f"\n"
+            f"static void encrypt_blocks(const WORD_TYPE *in, WORD_TYPE *out, size_t n) {{\n"
+            f"    encrypt_instance_blocks(instance, in, out, n);\n"
+            f"}}\n"
+            f"\n"
+            f"{self._run_function()}"
+            f"\n"
+            f"int main(int argc, char *argv[]) {{\n"
+            f"    if (argc < 2 || sscanf(argv[1], \"%zu\", &instance) != 1 || instance >= INSTANCES) {{\n"
+            f"        fprintf(stderr, \"Usage: %s INSTANCE ARGUMENTS...\\n\", argv[0]);\n"
+            f"        return -1;\n"
+            f"    }}\n"
+            f"    return run(argc - 1, &argv[1]);\n"
+            f"}}\n"
+        )
+
+    def _main_parallel_benchmark(self):
+        if not self.parallel:
+            return ""
+
+        # Usage: ./speck --parallel BLOCKS MAX_THREADS
+        return (
+            f"    if (argc == 4 && strcmp(argv[1], \"--parallel\") == 0) {{\n"
+            f"        size_t blocks;\n"
+            f"        size_t max_threads;\n"
+            f"        sscanf(argv[2], \"%zu\", &blocks);\n"
+            f"        sscanf(argv[3], \"%zu\", &max_threads);\n"
+            f"        WORD_TYPE *in = malloc(2 * blocks * sizeof(WORD_TYPE));\n"
+            f"        WORD_TYPE *out = malloc(2 * blocks * sizeof(WORD_TYPE));\n"
+            f"        if (in == NULL || out == NULL) {{\n"
+            f"            return -1;\n"
+            f"        }}\n"
+            f"        for (size_t i = 0; i < 2 * blocks; i++) {{\n"
+            f"            in[i] = (((WORD_TYPE) rand()) << (WORD_SIZE / 2)) | ((WORD_TYPE) rand());\n"
+            f"        }}\n"
+            f"        double single_thread_seconds = 0;\n"
+            f"        for (size_t threads = 1; threads <= max_threads; threads++) {{\n"
+            f"            struct timespec start;\n"
+            f"            struct timespec end;\n"
+            f"            clock_gettime(CLOCK_MONOTONIC, &start);\n"
+            f"            encrypt_blocks_parallel(in, out, blocks, threads);\n"
+            f"            clock_gettime(CLOCK_MONOTONIC, &end);\n"
+            f"            double seconds = (end.tv_sec - start.tv_sec) + (end.tv_nsec - start.tv_nsec) / 1e9;\n"
+            f"            if (threads == 1) {{\n"
+            f"                single_thread_seconds = seconds;\n"
+            f"            }}\n"
+            f"            printf(\"%zu threads: %.6f s, %.0f blocks/s, speedup %.2f\\n\", threads, seconds, blocks / seconds, single_thread_seconds / seconds);\n"
+            f"        }}\n"
+            f"        free(in);\n"
+            f"        free(out);\n"
+            f"        return 0;\n"
+            f"    }}\n"
+        )
+
+    def _stream_functions(self):
+        return self._STREAM_HEX + \
+               "\n" + \
+               self._STREAM_BINARY
+
+    def _main_stream(self, blocks):
+        # Usage: ./speck --stream < blocks.txt or ./speck --stream-binary < blocks.bin
+        return (
+            f"    if (argc == 2 && (strcmp(argv[1], \"--stream\") == 0 || strcmp(argv[1], \"--stream-binary\") == 0)) {{\n"
+            f"        setvbuf(stdin, NULL, _IOFBF, STREAM_BUFFER_BYTES);\n"
+            f"        setvbuf(stdout, NULL, _IOFBF, STREAM_BUFFER_BYTES);\n"
+            f"        return strcmp(argv[1], \"--stream\") == 0 ? stream_hex({blocks}) : stream_binary({blocks});\n"
+            f"    }}\n"
+        )
+
     def _main(self):
+        return self._BENCHMARK + \
+               "\n" + \
+               self._stream_functions() + \
+               "\n" + \
+               self._main_function()
+
+    def _main_function(self):
         return (
             f"int main(int argc, char *argv[]) {{\n"
             f"    if (argc < 2) {{\n"
             f"        return -1;\n"
             f"    }}\n"
+            f"{self._main_stream('encrypt_blocks')}"
+            f"{self._main_parallel_benchmark()}"
             f"    WORD_TYPE p[2];\n"
             f"    WORD_TYPE c[2];\n"
             f"    if (argc < 3) {{\n"
             f"        size_t iterations;\n"
             f"        sscanf(argv[1], \"%zu\", &iterations);\n"
-            f"        for (int i = 0; i < iterations; i++) {{\n"
-            f"            p[0] = (((WORD_TYPE) rand()) << (WORD_SIZE / 2)) | ((WORD_TYPE) rand());\n"
-            f"            p[1] = (((WORD_TYPE) rand()) << (WORD_SIZE / 2)) | ((WORD_TYPE) rand());\n"
-            f"            encrypt(p, c);\n"
-            f"        }}\n"
-            f"        return -1;\n"
+            f"        return benchmark(iterations);\n"
             f"    }} else {{\n"
             f"        sscanf(argv[1], \"%\" WORD_IN_TYPE, &p[0]);\n"
             f"        sscanf(argv[2], \"%\" WORD_IN_TYPE, &p[1]);\n"
             f"        encrypt(p, c);\n"
             f"        printf(\"%\" WORD_OUT_TYPE \" %\" WORD_OUT_TYPE \"\\n\", c[0], c[1]);\n"
             f"    }}\n"
+            f"    return 0;\n"
             f"}}\n"
         )
 
+    def _preamble(self, block_size, word_size, rounds):
+        includes = self._includes()
+        defines = self._defines(block_size, word_size, rounds)
+        if not self.library:
+            includes += self._benchmark_includes()
+            defines += self._define_benchmark()
+            defines += self._define_stream()
+        # The thread affinity functions and dladdr, which a library uses to find its mapped table file, are GNU extensions.
+        if self.parallel or (self.library and self.mapped_table_file is not None):
+            includes = self._DEFINE_GNU_SOURCE + includes
+        if self.parallel:
+            includes += self._parallel_includes()
+            defines += self._define_parallel_chunk_blocks()
+        return [includes, defines]
+
+    def _layer_functions(self, matrices, vectors):
+        # Strategies which support split translation units return a list containing the (signature, body) tuples of the functions of every layer.
+        return None
+
+    def _layer_function_definitions(self, layer_functions, qualifiers):
+        s = ""
+        for functions in layer_functions:
+            for signature, body in functions:
+                s += f"{qualifiers}{signature} {{\n{body}}}\n\n"
+        return s
+
+    def _makefile(self, name, sources):
+        # The translation units are compiled in parallel using make -j, and the layer functions are optimized across translation units when linking.
+        target = f"lib{name}.so" if self.library else name
+        objects = " ".join(source[:-len(".c")] + ".o" for source in sources)
+        return (
+            f"CC = gcc\n"
+            f"CFLAGS = -O2 -march=native -flto=auto{' -fPIC' if self.library else ''}\n"
+            f"LDFLAGS ={' -shared' if self.library else ''}\n"
+            f"LDLIBS ={' -pthread' if self.parallel else ''}\n"
+            f"OBJECTS = {objects}\n"
+            f"\n"
+            f"{target}: $(OBJECTS)\n"
+            f"\t$(CC) $(CFLAGS) $(LDFLAGS) -o $@ $(OBJECTS) $(LDLIBS)\n"
+            f"\n"
+            f"%.o: %.c {name}.h\n"
+            f"\t$(CC) $(CFLAGS){' -pthread' if self.parallel else ''} -c -o $@ $<\n"
+            f"\n"
+            f".PHONY: clean\n"
+            f"clean:\n"
+            f"\trm -f {target} $(OBJECTS)\n"
+        )
+
     def generate_code(self, matrices, vectors):
         assert len(matrices) > 0
         assert len(vectors) > 0
@@ -199,16 +1228,148 @@ class CodeGenerator(ABC):
 
         block_size = matrices[0].nrows()
         word_size = block_size // 2
+        structured = self.structured_rounds(matrices, vectors)
+        structured_rounds = self._structured_rounds_function(matrices[:structured], vectors[:structured]) if structured else ""
+        matrices, vectors = matrices[structured:], vectors[structured:]
         rounds = len(matrices) - 1
 
-        return self._includes() + \
-               "\n" + \
-               self._defines(block_size, word_size, rounds) + \
-               "\n" + \
-               self._matrices(matrices) + \
-               "\n" + \
-               self._vectors(vectors) + \
-               "\n" + \
-               self._functions(block_size, word_size, rounds) + \
-               "\n" + \
-               self._main()
+        tables = self.tables(matrices, vectors) if self.table_file is not None or self.mapped_table_file is not None else None
+        mapped = tables is not None and self.mapped_table_file is not None
+        if tables is None:
+            layers = self._layers(matrices, vectors)
+        elif mapped:
+            layers = self._mapped_table_layers(tables)
+        else:
+            layers = self._table_file_layers(tables)
+        if self.library:
+            entry_points = self._library_functions() + ("\n" + self._mapped_table_library_functions() if mapped else "")
+        else:
+            entry_points = self._mapped_table_main() if mapped else self._main()
+        functions = self._functions(block_size, word_size, rounds)
+        parts = self._preamble(block_size, word_size, rounds) + [
+            layers,
+            structured_rounds,
+            self._structured_encrypt(functions) if structured else functions,
+            self._bulk_functions(),
+            entry_points,
+        ]
+        code = "\n".join(part for part in parts if part)
+        return self._rename_for_decryption(code) if self.decrypt else code
+
+    def generate_split_code(self, matrices, vectors, name):
+        """
+        Generates C code which is split into a header, a translation unit for every layer, and a translation unit containing the other functions, together with a Makefile which compiles the translation units in parallel and links them using link-time optimization.
+        :param matrices: the matrices
+        :param vectors: the vectors
+        :param name: the name of the program (or library), the prefix of the names of the files
+        :return: a dict mapping the names of the files to their contents, or None if the strategy does not support split translation units
+        """
+        assert len(matrices) > 0
+        assert len(vectors) > 0
+        assert len(matrices) == len(vectors)
+
+        block_size = matrices[0].nrows()
+        word_size = block_size // 2
+        structured = self.structured_rounds(matrices, vectors)
+        structured_rounds = self._structured_rounds_function(matrices[:structured], vectors[:structured]) if structured else ""
+        matrices, vectors = matrices[structured:], vectors[structured:]
+        rounds = len(matrices) - 1
+
+        layer_functions = self._layer_functions(matrices, vectors)
+        if layer_functions is None:
+            return None
+
+        # The layer functions are not static, but they are hidden so libraries still export only the prefixed functions.
+        guard = f"{name.upper()}_H"
+        prototypes = "".join(f"__attribute__((visibility(\"hidden\"))) {signature};\n" for functions in layer_functions for signature, _ in functions)
+        parts = [f"#ifndef {guard}\n#define {guard}\n", *self._preamble(block_size, word_size, rounds), prototypes, "#endif\n"]
+        files = {f"{name}.h": "\n".join(parts)}
+
+        include = f"#include \"{name}.h\"\n"
+        sources = [f"{name}.c"]
+        for k, functions in enumerate(layer_functions):
+            sources.append(f"{name}_layer_{k}.c")
+            files[sources[-1]] = include + "\n" + self._layer_function_definitions([functions], "").rstrip("\n") + "\n"
+
+        functions = self._functions(block_size, word_size, rounds)
+        parts = [
+            include,
+            self._layers(matrices, vectors),
+            structured_rounds,
+            self._structured_encrypt(functions) if structured else functions,
+            self._bulk_functions(),
+            self._library_functions() if self.library else self._main(),
+        ]
+        files[f"{name}.c"] = "\n".join(part for part in parts if part)
+
+        if self.decrypt:
+            files = {file_name: self._rename_for_decryption(code) for file_name, code in files.items()}
+        files["Makefile"] = self._makefile(name, sources)
+        return files
+
+    def _instance_table_store(self, tables):
+        # Every instance is padded to a multiple of the cache line size, so the tables of every instance are aligned and contiguous.
+        blobs = [serialize_tables(instance_tables, self._CACHE_LINE_SIZE)[0] for instance_tables in tables]
+        instance_bytes = max(len(blob) for blob in blobs)
+        instance_bytes += -instance_bytes % self._CACHE_LINE_SIZE
+        blobs = [blob + bytes(instance_bytes - len(blob)) for blob in blobs]
+        s = f"#define INSTANCES {len(blobs)}\n"
+        s += f"#define INSTANCE_BYTES {instance_bytes}\n"
+        s += "\n"
+        if self.table_file is not None:
+            return b"".join(blobs), s + self._table_file_layers(tables[0], "id * INSTANCE_BYTES + ")
+
+        s += self._table_types()
+        s += f"static const uint8_t TABLES[INSTANCES * INSTANCE_BYTES] __attribute__((aligned({self._CACHE_LINE_SIZE}))) = {{\n"
+        s += "".join(f"    {', '.join(map(str, blob))},\n" for blob in blobs)
+        s += "};\n"
+        s += "\n"
+        return b"".join(blobs), s + self._table_macros(tables[0], "id * INSTANCE_BYTES + ")
+
+    def instances_table_blob(self, instances):
+        """
+        Returns the contents of the table file of several instances, which contains the table store of generate_code_instances.
+        :param instances: a list containing the (matrices, vectors) tuple of every instance
+        :return: the table file contents, or None if the strategy does not use dense tables
+        """
+        structured = self._instance_structured_rounds(instances)
+        tables = [self.tables(matrices[structured:], vectors[structured:]) for matrices, vectors in instances]
+        return None if tables[0] is None else self._instance_table_store(tables)[0]
+
+    def generate_code_instances(self, instances):
+        """
+        Generates C code for several instances (e.g. with different keys or external encodings), which share one kernel.
+        The tables of all instances are stored in one contiguous table store, in which the tables of every instance are contiguous, and the instance is selected using encrypt_instance(id, p, c).
+        :param instances: a list containing the (matrices, vectors) tuple of every instance, as returned by WhiteBoxSpeck.affine_layers, with the same block size and number of rounds
+        :return: the C code, or None if the strategy does not use dense tables
+        """
+        assert len(instances) > 0
+        assert all(len(matrices) == len(vectors) == len(instances[0][0]) for matrices, vectors in instances)
+        assert all(matrices[0].nrows() == instances[0][0][0].nrows() for matrices, vectors in instances)
+        assert not self.parallel, "Multithreaded bulk encryption is not supported for several instances"
+        assert self.mapped_table_file is None, "Mapped table files are not supported for several instances"
+
+        structured = self._instance_structured_rounds(instances)
+        tables = [self.tables(matrices[structured:], vectors[structured:]) for matrices, vectors in instances]
+        if tables[0] is None:
+            return None
+
+        block_size = instances[0][0][0].nrows()
+        word_size = block_size // 2
+        rounds = len(instances[0][0]) - 1 - structured
+
+        # The kernel reads the tables through macros which depend on the id argument of encrypt_instance.
+        signature = "static void encrypt(const WORD_TYPE p[2], WORD_TYPE c[2]) {"
+        functions = self._functions(block_size, word_size, rounds)
+        assert signature in functions
+        functions = functions.replace(signature, "static void encrypt_instance(size_t id, const WORD_TYPE p[2], WORD_TYPE c[2]) {")
+        if structured:
+            functions = self._structured_rounds_function(instances[0][0][:structured], instances[0][1][:structured]) + "\n" + self._structured_encrypt(functions, "static void encrypt_instance(size_t id, const WORD_TYPE p[2], WORD_TYPE c[2]) {\n")
+        parts = self._preamble(block_size, word_size, rounds) + [
+            self._instance_table_store(tables)[1],
+            functions,
+            self._ENCRYPT_INSTANCE_BLOCKS,
+            self._instance_library_functions() if self.library else self._instance_main(),
+        ]
+        code = "\n".join(part for part in parts if part)
+        return self._rename_for_decryption(code) if self.decrypt else code
@@ -23,7 +23,7 @@ class BitPackedCodeGenerator(CodeGenerator):
     }
 
     _MATRIX_VECTOR_PRODUCT = (
-        "void matrix_vector_product(WORD_TYPE matrix[BLOCK_SIZE][2], WORD_TYPE xy[2], WORD_TYPE res[2]) {\n"
+        "static void matrix_vector_product(const WORD_TYPE matrix[BLOCK_SIZE][2], const WORD_TYPE xy[2], WORD_TYPE res[2]) {\n"
         # We do a reverse loop here for performance reasons.
         "    for (size_t i = WORD_SIZE; i-- > 0;) {\n"
         "        res[0] = (res[0] << 1) | ((WORD_TYPE) WORD_PARITY_FUNCTION((matrix[i][0] & xy[0]) ^ (matrix[i][1] & xy[1])));\n"
@@ -32,43 +32,95 @@ class BitPackedCodeGenerator(CodeGenerator):
         "}\n"
     )
 
+    # In the cache layout, row i and row WORD_SIZE + i are stored next to each other, in the order they are read.
+    _CACHE_LAYOUT_MATRIX_VECTOR_PRODUCT = (
+        "static void matrix_vector_product(const WORD_TYPE matrix[WORD_SIZE][2][2], const WORD_TYPE xy[2], WORD_TYPE res[2]) {\n"
+        "    for (size_t i = 0; i < WORD_SIZE; i++) {\n"
+        "        res[0] = (res[0] << 1) | ((WORD_TYPE) WORD_PARITY_FUNCTION((matrix[i][0][0] & xy[0]) ^ (matrix[i][0][1] & xy[1])));\n"
+        "        res[1] = (res[1] << 1) | ((WORD_TYPE) WORD_PARITY_FUNCTION((matrix[i][1][0] & xy[0]) ^ (matrix[i][1][1] & xy[1])));\n"
+        "    }\n"
+        "}\n"
+    )
+
     _VECTOR_ADDITION = (
-        "void vector_addition(WORD_TYPE vector[2], WORD_TYPE xy[2]) {\n"
+        "static void vector_addition(const WORD_TYPE vector[2], WORD_TYPE xy[2]) {\n"
         "    xy[0] ^= vector[0];\n"
         "    xy[1] ^= vector[1];\n"
         "}\n"
     )
 
     _MODULAR_ADDITION = (
-        "void modular_addition(WORD_TYPE xy[2]) {\n"
+        "static void modular_addition(WORD_TYPE xy[2]) {\n"
         "    xy[0] = (xy[0] + xy[1]) & WORD_MASK;\n"
         "}\n"
     )
 
+    _MODULAR_SUBTRACTION = (
+        "static void modular_subtraction(WORD_TYPE xy[2]) {\n"
+        "    xy[0] = (xy[0] - xy[1]) & WORD_MASK;\n"
+        "}\n"
+    )
+
     _ENCRYPT = (
-        "void encrypt(WORD_TYPE p[2], WORD_TYPE c[2]) {\n"
+        "static void encrypt(const WORD_TYPE p[2], WORD_TYPE c[2]) {\n"
         "    WORD_TYPE res[2];\n"
         "    c[0] = p[0];\n"
         "    c[1] = p[1];\n"
         "    for (size_t i = 0; i < ROUNDS; i++) {\n"
+        "        PREFETCH_ROUND(i + 1);\n"
         "        res[0] = 0;\n"
         "        res[1] = 0;\n"
-        "        matrix_vector_product(MATRICES[i], c, res);\n"
-        "        vector_addition(VECTORS[i], res);\n"
-        "        modular_addition(res);\n"
+        "        PROFILE(i, PROFILE_MATRIX_VECTOR_PRODUCT, matrix_vector_product(MATRICES[i], c, res));\n"
+        "        PROFILE(i, PROFILE_VECTOR_ADDITION, vector_addition(VECTORS[i], res));\n"
+        "        PROFILE(i, PROFILE_MODULAR_ADDITION, modular_addition(res));\n"
         "        c[0] = res[0];\n"
         "        c[1] = res[1];\n"
         "    }\n"
         "\n"
         "    res[0] = 0;\n"
         "    res[1] = 0;\n"
-        "    matrix_vector_product(MATRICES[ROUNDS], c, res);\n"
-        "    vector_addition(VECTORS[ROUNDS], res);\n"
+        "    PROFILE(ROUNDS, PROFILE_MATRIX_VECTOR_PRODUCT, matrix_vector_product(MATRICES[ROUNDS], c, res));\n"
+        "    PROFILE(ROUNDS, PROFILE_VECTOR_ADDITION, vector_addition(VECTORS[ROUNDS], res));\n"
         "    c[0] = res[0];\n"
         "    c[1] = res[1];\n"
         "}\n"
     )
 
+    # The remaining blocks which do not fill a group of INTERLEAVE blocks are encrypted one at a time.
+    _ENCRYPT_BLOCKS_INTERLEAVED = (
+        "static void encrypt_blocks(const WORD_TYPE *in, WORD_TYPE *out, size_t n) {\n"
+        "    size_t i = 0;\n"
+        "    for (; i + INTERLEAVE <= n; i += INTERLEAVE) {\n"
+        "        encrypt_interleaved((const WORD_TYPE (*)[2]) &in[2 * i], (WORD_TYPE (*)[2]) &out[2 * i]);\n"
+        "    }\n"
+        "    for (; i < n; i++) {\n"
+        "        encrypt(&in[2 * i], &out[2 * i]);\n"
+        "    }\n"
+        "}\n"
+    )
+
+    # Subclasses with another kernel only support the interleave factors of the kernels they emit.
+    _INTERLEAVE_FACTORS = [1, 2, 4, 8]
+
+    def __init__(self, interleave=1, **kwargs):
+        """
+        Initializes an instance of BitPackedCodeGenerator with the provided parameters.
+        :param interleave: the number of blocks which encrypt_blocks processes in lockstep through every round, sharing the table reads and hiding the latency of the dependency chains (default: 1)
+        :param kwargs: the parameters of CodeGenerator
+        """
+        assert interleave in self._INTERLEAVE_FACTORS, f"Invalid or unsupported interleave factor {interleave}"
+
+        super().__init__(**kwargs)
+        self.interleave = interleave
+
+    def _read_order(self, word_size):
+        """
+        Returns the order in which the matrix-vector product reads the rows of a matrix.
+        :param word_size: the word size
+        :return: a list containing i for every pair of rows i and word_size + i
+        """
+        return list(reversed(range(word_size)))
+
     def _to_int_big_endian(self, bits):
         ans = 0
         for b in reversed(bits):
@@ -96,6 +148,12 @@ class BitPackedCodeGenerator(CodeGenerator):
     def _define_word_mask(self, word_size):
         return f"#define WORD_MASK 0x{(1 << word_size) - 1:02x}\n"
 
+    def _define_interleave(self):
+        if self.interleave == 1:
+            return ""
+
+        return f"#define INTERLEAVE {self.interleave}\n"
+
     def _defines(self, block_size, word_size, rounds):
         return self._define_block_size(block_size) + \
                self._define_word_size(word_size) + \
@@ -105,16 +163,60 @@ class BitPackedCodeGenerator(CodeGenerator):
                self._define_word_constant_type(word_size) + \
                self._define_word_parity_function(word_size) + \
                self._define_word_mask(word_size) + \
-               self._define_rounds(rounds)
+               self._define_rounds(rounds) + \
+               self._define_interleave()
+
+    def table_bytes(self, matrices, vectors):
+        word_bytes = self._WORD_BYTES[matrices[0].nrows() // 2]
+        return len(matrices) * matrices[0].nrows() * 2 * word_bytes + len(vectors) * 2 * word_bytes
+
+    def _layer_operations(self, k, matrix, vector):
+        # Every row is ANDed with both words of the state, and the parity of the XOR of both is the output bit.
+        return {"xors": matrix.nrows() + 2, "ands": 2 * matrix.nrows(), "parities": matrix.nrows()}
+
+    def _row_words(self, matrix, i):
+        return self._to_int_big_endian(matrix[i][:matrix.nrows() // 2]), self._to_int_big_endian(matrix[i][matrix.nrows() // 2:])
+
+    def _row(self, matrix, i):
+        xpart, ypart = self._row_words(matrix, i)
+        return f"{{WORD_CONSTANT_TYPE({xpart}), WORD_CONSTANT_TYPE({ypart})}}"
+
+    def _matrix_words(self, matrix):
+        word_size = matrix.nrows() // 2
+        if self.cache_layout:
+            return [word for i in self._read_order(word_size) for row in [i, word_size + i] for word in self._row_words(matrix, row)]
+
+        return [word for i in range(matrix.nrows()) for word in self._row_words(matrix, i)]
+
+    def tables(self, matrices, vectors):
+        word_bytes = self._WORD_BYTES[matrices[0].nrows() // 2]
+        vector_words = [self._to_int_big_endian(part) for vector in vectors for part in [vector[:len(vector) // 2], vector[len(vector) // 2:]]]
+        return [
+            ("MATRICES", "WORD_TYPE", "[ROUNDS + 1][WORD_SIZE][2][2]" if self.cache_layout else "[ROUNDS + 1][BLOCK_SIZE][2]", word_bytes, [word for matrix in matrices for word in self._matrix_words(matrix)]),
+            ("VECTORS", "WORD_TYPE", "[ROUNDS + 1][2]", word_bytes, vector_words),
+        ]
+
+    def _cache_layout_matrices(self, matrices):
+        s = f"static const WORD_TYPE MATRICES[ROUNDS + 1][WORD_SIZE][2][2]{self._table_alignment()} = {{\n"
+        for k, matrix in enumerate(matrices):
+            word_size = matrix.nrows() // 2
+            rows = [f"{{{self._row(matrix, i)}, {self._row(matrix, word_size + i)}}}" for i in self._read_order(word_size)]
+            s += "    {" + ", ".join(rows) + "}"
+            if k + 1 < len(matrices):
+                s += ","
+            s += "\n"
+        s += "};\n"
+        return s
 
     def _matrices(self, matrices):
-        s = "WORD_TYPE MATRICES[ROUNDS + 1][BLOCK_SIZE][2] = {\n"
+        if self.cache_layout:
+            return self._cache_layout_matrices(matrices)
+
+        s = "static const WORD_TYPE MATRICES[ROUNDS + 1][BLOCK_SIZE][2] = {\n"
         for k, matrix in enumerate(matrices):
             s += "    {"
             for i in range(matrix.nrows()):
-                xpart = self._to_int_big_endian(matrix[i][:matrix.nrows() // 2])
-                ypart = self._to_int_big_endian(matrix[i][matrix.nrows() // 2:])
-                s += f"{{WORD_CONSTANT_TYPE({xpart}), WORD_CONSTANT_TYPE({ypart})}}"
+                s += self._row(matrix, i)
                 if i + 1 < matrix.nrows():
                     s += ", "
             s += "}"
@@ -125,7 +227,7 @@ class BitPackedCodeGenerator(CodeGenerator):
         return s
 
     def _vectors(self, vectors):
-        s = "WORD_TYPE VECTORS[ROUNDS + 1][2] = {"
+        s = f"static const WORD_TYPE VECTORS[ROUNDS + 1][2]{self._table_alignment()} = {{"
         for k, vector in enumerate(vectors):
             xpart = self._to_int_big_endian(vector[:len(vector) // 2])
             ypart = self._to_int_big_endian(vector[len(vector) // 2:])
@@ -135,11 +237,106 @@ class BitPackedCodeGenerator(CodeGenerator):
         s += "};\n"
         return s
 
+    def _interleaved_state(self):
+        # Every block has its own local variables, so the dependency chains of the blocks are independent and kept in registers.
+        s = "".join(f"    WORD_TYPE xy{b}[2] = {{xy[{b}][0], xy[{b}][1]}};\n" for b in range(self.interleave))
+        s += "".join(f"    WORD_TYPE res{b}[2] = {{0, 0}};\n" for b in range(self.interleave))
+        return s
+
+    def _interleaved_result(self):
+        return "".join(f"    res[{b}][0] = res{b}[0];\n    res[{b}][1] = res{b}[1];\n" for b in range(self.interleave))
+
+    def _interleaved_matrix_vector_product(self, word_size):
+        # Every row is read once for all blocks.
+        if self.cache_layout:
+            s = "static void matrix_vector_product_interleaved(const WORD_TYPE matrix[WORD_SIZE][2][2], const WORD_TYPE xy[INTERLEAVE][2], WORD_TYPE res[INTERLEAVE][2]) {\n"
+            loop = "for (size_t i = 0; i < WORD_SIZE; i++)"
+            rows = ["matrix[i][0]", "matrix[i][1]"]
+        else:
+            s = "static void matrix_vector_product_interleaved(const WORD_TYPE matrix[BLOCK_SIZE][2], const WORD_TYPE xy[INTERLEAVE][2], WORD_TYPE res[INTERLEAVE][2]) {\n"
+            # We do a reverse loop here for performance reasons.
+            loop = "for (size_t i = WORD_SIZE; i-- > 0;)"
+            rows = ["matrix[i]", "matrix[WORD_SIZE + i]"]
+        s += self._interleaved_state()
+        s += f"    {loop} {{\n"
+        for h, row in enumerate(rows):
+            for b in range(self.interleave):
+                s += f"        res{b}[{h}] = (res{b}[{h}] << 1) | ((WORD_TYPE) WORD_PARITY_FUNCTION(({row}[0] & xy{b}[0]) ^ ({row}[1] & xy{b}[1])));\n"
+        s += "    }\n"
+        s += self._interleaved_result()
+        s += "}\n"
+        return s
+
+    def _interleaved_round(self, r, matrix_vector_product, vector_addition, last=False):
+        s = f"    PROFILE({r}, PROFILE_MATRIX_VECTOR_PRODUCT, {matrix_vector_product});\n"
+        s += "    for (size_t b = 0; b < INTERLEAVE; b++) {\n"
+        if vector_addition is not None:
+            s += f"        PROFILE({r}, PROFILE_VECTOR_ADDITION, {vector_addition});\n"
+        if last:
+            s += "        c[b][0] = res[b][0];\n"
+            s += "        c[b][1] = res[b][1];\n"
+        else:
+            s += f"        PROFILE({r}, PROFILE_MODULAR_ADDITION, modular_addition(res[b]));\n"
+            s += "        xy[b][0] = res[b][0];\n"
+            s += "        xy[b][1] = res[b][1];\n"
+        s += "    }\n"
+        return s
+
+    def _interleaved_encrypt(self, rounds, matrix_vector_product="matrix_vector_product_interleaved(MATRICES[{r}], xy, res)", vector_addition="vector_addition(VECTORS[{r}], res[b])", prefetch=True):
+        s = (
+            "static void encrypt_interleaved(const WORD_TYPE p[INTERLEAVE][2], WORD_TYPE c[INTERLEAVE][2]) {\n"
+            "    WORD_TYPE xy[INTERLEAVE][2];\n"
+            "    WORD_TYPE res[INTERLEAVE][2];\n"
+        )
+        s += "    for (size_t b = 0; b < INTERLEAVE; b++) {\n"
+        s += "        xy[b][0] = p[b][0];\n"
+        s += "        xy[b][1] = p[b][1];\n"
+        s += "    }\n"
+        s += "    for (size_t i = 0; i < ROUNDS; i++) {\n"
+        if prefetch:
+            s += "        PREFETCH_ROUND(i + 1);\n"
+        s += "".join("    " + line + "\n" for line in self._interleaved_round("i", matrix_vector_product.format(r="i"), vector_addition.format(r="i")).splitlines())
+        s += "    }\n"
+        s += "\n"
+        s += self._interleaved_round("ROUNDS", matrix_vector_product.format(r="ROUNDS"), vector_addition.format(r="ROUNDS"), True)
+        s += "}\n"
+        return s
+
+    def _interleaved_functions(self, word_size, rounds):
+        if self.interleave == 1:
+            return ""
+
+        return "\n" + \
+               self._interleaved_matrix_vector_product(word_size) + \
+               "\n" + \
+               self._interleaved_encrypt(rounds)
+
+    def _bulk_functions(self):
+        if self.interleave == 1:
+            return super()._bulk_functions()
+
+        if not self.parallel:
+            return self._ENCRYPT_BLOCKS_INTERLEAVED
+
+        return self._ENCRYPT_BLOCKS_INTERLEAVED + \
+               "\n" + \
+               self._ENCRYPT_BLOCKS_PARALLEL
+
+    def generate_code_instances(self, instances):
+        assert self.interleave == 1, "Interleaving is not supported for several instances"
+
+        return super().generate_code_instances(instances)
+
     def _functions(self, block_size, word_size, rounds):
-        return self._MATRIX_VECTOR_PRODUCT + \
+        return self._PROFILE + \
+               "\n" + \
+               self._PREFETCH_ROUND + \
+               "\n" + \
+               (self._CACHE_LAYOUT_MATRIX_VECTOR_PRODUCT if self.cache_layout else self._MATRIX_VECTOR_PRODUCT) + \
                "\n" + \
                self._VECTOR_ADDITION + \
                "\n" + \
-               self._MODULAR_ADDITION + \
+               self._modular_operation() + \
                "\n" + \
-               self._ENCRYPT
+               self._ENCRYPT + \
+               self._interleaved_functions(word_size, rounds)
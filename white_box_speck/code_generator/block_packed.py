@@ -0,0 +1,190 @@
+from . import CodeGenerator
+from .bit_packed import BitPackedCodeGenerator
+
+
+class BlockPackedCodeGenerator(BitPackedCodeGenerator):
+    """
+    Generates output C code for white-box Speck implementations using the block-packed code generation strategy.
+    Every row is packed into a single mask of BLOCK_SIZE bits, and the state is packed into a single value of the same type.
+    """
+
+    _INTERLEAVE_FACTORS = [1]
+
+    _BLOCK_TYPES = {
+        32: "uint32_t",
+        48: "uint64_t",
+        64: "uint64_t",
+        96: "__uint128_t",
+        128: "__uint128_t",
+    }
+
+    _BLOCK_BYTES = {
+        32: 4,
+        48: 8,
+        64: 8,
+        96: 16,
+        128: 16,
+    }
+
+    # There are no 128-bit integer literals, so the constants of the larger blocks are built from two 64-bit halves.
+    _BLOCK_CONSTANTS = {
+        32: "#define BLOCK_CONSTANT(hi, lo) UINT32_C(lo)\n",
+        48: "#define BLOCK_CONSTANT(hi, lo) UINT64_C(lo)\n",
+        64: "#define BLOCK_CONSTANT(hi, lo) UINT64_C(lo)\n",
+        96: "#define BLOCK_CONSTANT(hi, lo) (((BLOCK_TYPE) UINT64_C(hi) << 64) | UINT64_C(lo))\n",
+        128: "#define BLOCK_CONSTANT(hi, lo) (((BLOCK_TYPE) UINT64_C(hi) << 64) | UINT64_C(lo))\n",
+    }
+
+    # The parity of a 128-bit value is the parity of the XOR of its halves.
+    _BLOCK_PARITY_FUNCTIONS = {
+        32: "#define BLOCK_PARITY_FUNCTION __builtin_parityl\n",
+        48: "#define BLOCK_PARITY_FUNCTION __builtin_parityll\n",
+        64: "#define BLOCK_PARITY_FUNCTION __builtin_parityll\n",
+        96: "#define BLOCK_PARITY_FUNCTION(b) __builtin_parityll((uint64_t) (b) ^ (uint64_t) ((b) >> 64))\n",
+        128: "#define BLOCK_PARITY_FUNCTION(b) __builtin_parityll((uint64_t) (b) ^ (uint64_t) ((b) >> 64))\n",
+    }
+
+    # The vectors are single values instead of arrays, so their address is prefetched.
+    _PREFETCH_ROUND = CodeGenerator._PREFETCH_ROUND.replace("prefetch_table(VECTORS[r]", "prefetch_table(&VECTORS[r]")
+
+    _PACK_BLOCK = (
+        "static inline BLOCK_TYPE pack_block(const WORD_TYPE xy[2]) {\n"
+        "    return (BLOCK_TYPE) xy[0] | ((BLOCK_TYPE) xy[1] << WORD_SIZE);\n"
+        "}\n"
+    )
+
+    _UNPACK_BLOCK = (
+        "static inline void unpack_block(BLOCK_TYPE xy, WORD_TYPE res[2]) {\n"
+        "    res[0] = (WORD_TYPE) xy & WORD_MASK;\n"
+        "    res[1] = (WORD_TYPE) (xy >> WORD_SIZE) & WORD_MASK;\n"
+        "}\n"
+    )
+
+    # Row WORD_SIZE - 1 - i and row BLOCK_SIZE - 1 - i are stored next to each other, so the output bits of both words are shifted in while the rows are read in order.
+    # The words are independent, which halves the dependency chain of the shifts.
+    _MATRIX_VECTOR_PRODUCT = (
+        "static void matrix_vector_product(const BLOCK_TYPE matrix[WORD_SIZE][2], BLOCK_TYPE xy, BLOCK_TYPE *res) {\n"
+        "    WORD_TYPE words[2] = {0, 0};\n"
+        "    for (size_t i = 0; i < WORD_SIZE; i++) {\n"
+        "        words[0] = (words[0] << 1) | ((WORD_TYPE) BLOCK_PARITY_FUNCTION(matrix[i][0] & xy));\n"
+        "        words[1] = (words[1] << 1) | ((WORD_TYPE) BLOCK_PARITY_FUNCTION(matrix[i][1] & xy));\n"
+        "    }\n"
+        "    *res = pack_block(words);\n"
+        "}\n"
+    )
+
+    _VECTOR_ADDITION = (
+        "static void vector_addition(BLOCK_TYPE vector, BLOCK_TYPE *xy) {\n"
+        "    *xy ^= vector;\n"
+        "}\n"
+    )
+
+    # The carry out of the x word is masked, and the y word is not modified.
+    _MODULAR_ADDITION = (
+        "static void modular_addition(BLOCK_TYPE *xy) {\n"
+        "    *xy = (*xy & ~(BLOCK_TYPE) WORD_MASK) | ((*xy + (*xy >> WORD_SIZE)) & WORD_MASK);\n"
+        "}\n"
+    )
+
+    _MODULAR_SUBTRACTION = (
+        "static void modular_subtraction(BLOCK_TYPE *xy) {\n"
+        "    *xy = (*xy & ~(BLOCK_TYPE) WORD_MASK) | ((*xy - (*xy >> WORD_SIZE)) & WORD_MASK);\n"
+        "}\n"
+    )
+
+    _ENCRYPT = (
+        "static void encrypt(const WORD_TYPE p[2], WORD_TYPE c[2]) {\n"
+        "    BLOCK_TYPE xy = pack_block(p);\n"
+        "    BLOCK_TYPE res;\n"
+        "    for (size_t i = 0; i < ROUNDS; i++) {\n"
+        "        PREFETCH_ROUND(i + 1);\n"
+        "        PROFILE(i, PROFILE_MATRIX_VECTOR_PRODUCT, matrix_vector_product(MATRICES[i], xy, &res));\n"
+        "        PROFILE(i, PROFILE_VECTOR_ADDITION, vector_addition(VECTORS[i], &res));\n"
+        "        PROFILE(i, PROFILE_MODULAR_ADDITION, modular_addition(&res));\n"
+        "        xy = res;\n"
+        "    }\n"
+        "\n"
+        "    PROFILE(ROUNDS, PROFILE_MATRIX_VECTOR_PRODUCT, matrix_vector_product(MATRICES[ROUNDS], xy, &res));\n"
+        "    PROFILE(ROUNDS, PROFILE_VECTOR_ADDITION, vector_addition(VECTORS[ROUNDS], &res));\n"
+        "    unpack_block(res, c);\n"
+        "}\n"
+    )
+
+    def _define_block_type(self, block_size):
+        assert block_size in self._BLOCK_TYPES, f"Invalid or unsupported block size {block_size}"
+
+        return f"#define BLOCK_TYPE {self._BLOCK_TYPES[block_size]}\n"
+
+    def _define_block_constant(self, block_size):
+        assert block_size in self._BLOCK_CONSTANTS, f"Invalid or unsupported block size {block_size}"
+
+        return self._BLOCK_CONSTANTS[block_size]
+
+    def _define_block_parity_function(self, block_size):
+        assert block_size in self._BLOCK_PARITY_FUNCTIONS, f"Invalid or unsupported block size {block_size}"
+
+        return self._BLOCK_PARITY_FUNCTIONS[block_size]
+
+    def _defines(self, block_size, word_size, rounds):
+        return super()._defines(block_size, word_size, rounds) + \
+               self._define_block_type(block_size) + \
+               self._define_block_constant(block_size) + \
+               self._define_block_parity_function(block_size)
+
+    def table_bytes(self, matrices, vectors):
+        block_bytes = self._BLOCK_BYTES[matrices[0].nrows()]
+        return len(matrices) * matrices[0].nrows() * block_bytes + len(vectors) * block_bytes
+
+    def _layer_operations(self, k, matrix, vector):
+        # Every row is ANDed with the state once, a 128-bit AND takes two instructions and a 128-bit parity takes an additional XOR.
+        halves = self._BLOCK_BYTES[matrix.nrows()] // 8 if self._BLOCK_BYTES[matrix.nrows()] > 8 else 1
+        return {"xors": (halves - 1) * matrix.nrows() + halves, "ands": halves * matrix.nrows(), "parities": matrix.nrows()}
+
+    def _row_masks(self, matrix):
+        word_size = matrix.nrows() // 2
+        return [self._to_int_big_endian(matrix[row]) for i in reversed(range(word_size)) for row in [i, word_size + i]]
+
+    def _block_constant(self, value):
+        return f"BLOCK_CONSTANT({value >> 64}, {value & ((1 << 64) - 1)})"
+
+    def tables(self, matrices, vectors):
+        block_bytes = self._BLOCK_BYTES[matrices[0].nrows()]
+        return [
+            ("MATRICES", "BLOCK_TYPE", "[ROUNDS + 1][WORD_SIZE][2]", block_bytes, [mask for matrix in matrices for mask in self._row_masks(matrix)]),
+            ("VECTORS", "BLOCK_TYPE", "[ROUNDS + 1]", block_bytes, [self._to_int_big_endian(vector) for vector in vectors]),
+        ]
+
+    def _matrices(self, matrices):
+        # The kernel reads the rows in order, so the cache layout only aligns the tables.
+        s = f"static const BLOCK_TYPE MATRICES[ROUNDS + 1][WORD_SIZE][2]{self._table_alignment()} = {{\n"
+        for k, matrix in enumerate(matrices):
+            masks = list(map(self._block_constant, self._row_masks(matrix)))
+            s += "    {" + ", ".join(f"{{{xmask}, {ymask}}}" for xmask, ymask in zip(masks[::2], masks[1::2])) + "}"
+            if k + 1 < len(matrices):
+                s += ","
+            s += "\n"
+        s += "};\n"
+        return s
+
+    def _vectors(self, vectors):
+        s = f"static const BLOCK_TYPE VECTORS[ROUNDS + 1]{self._table_alignment()} = {{"
+        s += ", ".join(self._block_constant(self._to_int_big_endian(vector)) for vector in vectors)
+        s += "};\n"
+        return s
+
+    def _functions(self, block_size, word_size, rounds):
+        return self._PROFILE + \
+               "\n" + \
+               self._PREFETCH_ROUND + \
+               "\n" + \
+               self._PACK_BLOCK + \
+               "\n" + \
+               self._UNPACK_BLOCK + \
+               "\n" + \
+               self._MATRIX_VECTOR_PRODUCT + \
+               "\n" + \
+               self._VECTOR_ADDITION + \
+               "\n" + \
+               self._modular_operation() + \
+               "\n" + \
+               self._ENCRYPT
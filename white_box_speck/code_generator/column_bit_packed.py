@@ -0,0 +1,46 @@
+from .bit_packed import BitPackedCodeGenerator
+
+
+class ColumnBitPackedCodeGenerator(BitPackedCodeGenerator):
+    """
+    Generates output C code for white-box Speck implementations using the column-oriented bit-packed code generation strategy.
+    """
+
+    _INTERLEAVE_FACTORS = [1]
+
+    _MATRIX_VECTOR_PRODUCT = (
+        "static void matrix_vector_product(const WORD_TYPE matrix[BLOCK_SIZE][2], const WORD_TYPE xy[2], WORD_TYPE res[2]) {\n"
+        # Every input bit selects a column using a branchless mask, so there is no serial dependency between output bits.
+        "    for (size_t j = 0; j < WORD_SIZE; j++) {\n"
+        "        WORD_TYPE x_mask = (WORD_TYPE) -((xy[0] >> j) & 1);\n"
+        "        WORD_TYPE y_mask = (WORD_TYPE) -((xy[1] >> j) & 1);\n"
+        "        res[0] ^= (matrix[j][0] & x_mask) ^ (matrix[WORD_SIZE + j][0] & y_mask);\n"
+        "        res[1] ^= (matrix[j][1] & x_mask) ^ (matrix[WORD_SIZE + j][1] & y_mask);\n"
+        "    }\n"
+        "}\n"
+    )
+
+    _CACHE_LAYOUT_MATRIX_VECTOR_PRODUCT = (
+        "static void matrix_vector_product(const WORD_TYPE matrix[WORD_SIZE][2][2], const WORD_TYPE xy[2], WORD_TYPE res[2]) {\n"
+        "    for (size_t j = 0; j < WORD_SIZE; j++) {\n"
+        "        WORD_TYPE x_mask = (WORD_TYPE) -((xy[0] >> j) & 1);\n"
+        "        WORD_TYPE y_mask = (WORD_TYPE) -((xy[1] >> j) & 1);\n"
+        "        res[0] ^= (matrix[j][0][0] & x_mask) ^ (matrix[j][1][0] & y_mask);\n"
+        "        res[1] ^= (matrix[j][0][1] & x_mask) ^ (matrix[j][1][1] & y_mask);\n"
+        "    }\n"
+        "}\n"
+    )
+
+    def _read_order(self, word_size):
+        return list(range(word_size))
+
+    def _layer_operations(self, k, matrix, vector):
+        # Every column is ANDed with the mask of its input bit, and XORed into the result.
+        return {"xors": 2 * matrix.ncols() + 2, "ands": 2 * matrix.ncols(), "parities": 0}
+
+    def tables(self, matrices, vectors):
+        return super().tables([matrix.transpose() for matrix in matrices], vectors)
+
+    def _matrices(self, matrices):
+        # The columns of a matrix are the rows of its transpose.
+        return super()._matrices([matrix.transpose() for matrix in matrices])
@@ -0,0 +1,79 @@
+from .bit_packed import BitPackedCodeGenerator
+from .csr_matrix import CSRMatrixCodeGenerator
+from .csr_matrix import csr_tables
+
+
+class CSRBitPackedCodeGenerator(BitPackedCodeGenerator):
+    """
+    Generates output C code for white-box Speck implementations using the compressed sparse row (CSR) matrix code generation strategy on the bit-packed state.
+    """
+
+    _INTERLEAVE_FACTORS = [1]
+
+    # A column index j is stored as (j / WORD_SIZE) << 6 | (j % WORD_SIZE), the word and the bit of the input bit.
+    _MATRIX_VECTOR_PRODUCT = (
+        "static void matrix_vector_product(const uint16_t row_offsets[BLOCK_SIZE + 1], const uint8_t columns[], const WORD_TYPE vector[2], const WORD_TYPE xy[2], WORD_TYPE res[2]) {\n"
+        "    for (size_t h = 0; h < 2; h++) {\n"
+        "        WORD_TYPE word = 0;\n"
+        "        for (size_t i = 0; i < WORD_SIZE; i++) {\n"
+        "            WORD_TYPE bit = 0;\n"
+        "            for (uint16_t j = row_offsets[h * WORD_SIZE + i]; j < row_offsets[h * WORD_SIZE + i + 1]; j++) {\n"
+        "                bit ^= xy[columns[j] >> 6] >> (columns[j] & 63);\n"
+        "            }\n"
+        "            word |= (bit & 1) << i;\n"
+        "        }\n"
+        "        res[h] = word ^ vector[h];\n"
+        "    }\n"
+        "}\n"
+    )
+
+    _PREFETCH_ROUND = CSRMatrixCodeGenerator._PREFETCH_ROUND
+
+    _ENCRYPT = (
+        "static void encrypt(const WORD_TYPE p[2], WORD_TYPE c[2]) {\n"
+        "    WORD_TYPE res[2];\n"
+        "    c[0] = p[0];\n"
+        "    c[1] = p[1];\n"
+        "    for (size_t i = 0; i < ROUNDS; i++) {\n"
+        "        PREFETCH_ROUND(i + 1);\n"
+        "        PROFILE(i, PROFILE_MATRIX_VECTOR_PRODUCT, matrix_vector_product(CSR_ROW_OFFSETS[i], CSR_COLUMNS[i], VECTORS[i], c, res));\n"
+        "        PROFILE(i, PROFILE_MODULAR_ADDITION, modular_addition(res));\n"
+        "        c[0] = res[0];\n"
+        "        c[1] = res[1];\n"
+        "    }\n"
+        "\n"
+        "    PROFILE(ROUNDS, PROFILE_MATRIX_VECTOR_PRODUCT, matrix_vector_product(CSR_ROW_OFFSETS[ROUNDS], CSR_COLUMNS[ROUNDS], VECTORS[ROUNDS], c, res));\n"
+        "    c[0] = res[0];\n"
+        "    c[1] = res[1];\n"
+        "}\n"
+    )
+
+    def table_bytes(self, matrices, vectors):
+        # The column indices, the row offsets, and the pointers to the column indices of every round.
+        block_size = matrices[0].nrows()
+        return sum(len(matrix.nonzero_positions()) for matrix in matrices) + \
+               len(matrices) * ((block_size + 1) * 2 + 8) + \
+               len(vectors) * 2 * self._WORD_BYTES[block_size // 2]
+
+    def _layer_operations(self, k, matrix, vector):
+        # Every column index is masked to select the bit, and every output bit is masked once.
+        return {"xors": len(matrix.nonzero_positions()) + 2, "ands": len(matrix.nonzero_positions()) + matrix.nrows(), "parities": 0}
+
+    def tables(self, matrices, vectors):
+        # The CSR tables have a different size for every round.
+        return None
+
+    def _matrices(self, matrices):
+        word_size = matrices[0].nrows() // 2
+        return csr_tables(matrices, lambda j: (j // word_size) << 6 | (j % word_size), self._table_alignment())
+
+    def _functions(self, block_size, word_size, rounds):
+        return self._PROFILE + \
+               "\n" + \
+               self._PREFETCH_ROUND + \
+               "\n" + \
+               self._MATRIX_VECTOR_PRODUCT + \
+               "\n" + \
+               self._modular_operation() + \
+               "\n" + \
+               self._ENCRYPT
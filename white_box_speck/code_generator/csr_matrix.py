@@ -0,0 +1,131 @@
+from . import CodeGenerator
+
+
+def csr_matrix(matrix):
+    """
+    Converts a matrix to the compressed sparse row (CSR) form.
+    :param matrix: the matrix
+    :return: a tuple containing the row offsets (one more than the number of rows) and the column indices of the nonzero entries
+    """
+    row_offsets = [0]
+    columns = []
+    for i in range(matrix.nrows()):
+        columns += matrix.nonzero_positions_in_row(i)
+        row_offsets.append(len(columns))
+
+    return row_offsets, columns
+
+
+def csr_tables(matrices, column, alignment=""):
+    """
+    Generates the CSR_COLUMNS and CSR_ROW_OFFSETS tables of the matrices.
+    :param matrices: the matrices
+    :param column: a function to encode a column index as an uint8_t
+    :param alignment: the attribute to align the row offsets with (default: none)
+    :return: the C code of the tables
+    """
+    s = ""
+    s1 = f"static const uint16_t CSR_ROW_OFFSETS[ROUNDS + 1][BLOCK_SIZE + 1]{alignment} = {{\n"
+    s2 = "static const uint8_t *const CSR_COLUMNS[ROUNDS + 1] = {"
+    for k, matrix in enumerate(matrices):
+        row_offsets, columns = csr_matrix(matrix)
+        s += f"static const uint8_t CSR_COLUMNS_{k}[{len(columns)}] = {{{', '.join(str(column(j)) for j in columns)}}};\n"
+        s1 += f"    {{{', '.join(map(str, row_offsets))}}}"
+        s2 += f"CSR_COLUMNS_{k}"
+        if k + 1 < len(matrices):
+            s1 += ","
+            s2 += ", "
+        s1 += "\n"
+
+    s1 += "};\n"
+    s2 += "};\n"
+    return s + "\n" + s1 + "\n" + s2
+
+
+class CSRMatrixCodeGenerator(CodeGenerator):
+    """
+    Generates output C code for white-box Speck implementations using the compressed sparse row (CSR) matrix code generation strategy.
+    """
+
+    # Every output bit is accumulated in a register, starting from the vector bit, and written once.
+    _MATRIX_VECTOR_PRODUCT = (
+        "static void matrix_vector_product(const uint16_t row_offsets[BLOCK_SIZE + 1], const uint8_t columns[], const uint8_t vector[BLOCK_SIZE], const uint8_t xy[BLOCK_SIZE], uint8_t res[BLOCK_SIZE]) {\n"
+        "    for (size_t i = 0; i < BLOCK_SIZE; i++) {\n"
+        "        uint8_t bit = vector[i];\n"
+        "        for (uint16_t j = row_offsets[i]; j < row_offsets[i + 1]; j++) {\n"
+        "            bit ^= xy[columns[j]];\n"
+        "        }\n"
+        "        res[i] = bit;\n"
+        "    }\n"
+        "}\n"
+    )
+
+    _PREFETCH_ROUND = (
+        "#ifdef WBS_PREFETCH\n"
+        "static inline void prefetch_table(const void *table, size_t size) {\n"
+        "    for (size_t i = 0; i < size; i += 64) {\n"
+        "        __builtin_prefetch((const char *) table + i, 0, 3);\n"
+        "    }\n"
+        "}\n"
+        "\n"
+        "#define PREFETCH_ROUND(r) (prefetch_table(CSR_ROW_OFFSETS[r], sizeof(CSR_ROW_OFFSETS[r])), prefetch_table(CSR_COLUMNS[r], CSR_ROW_OFFSETS[r][BLOCK_SIZE]), prefetch_table(VECTORS[r], sizeof(VECTORS[r])))\n"
+        "#else\n"
+        "#define PREFETCH_ROUND(r)\n"
+        "#endif\n"
+    )
+
+    _ENCRYPT = (
+        "static void encrypt(const WORD_TYPE p[2], WORD_TYPE c[2]) {\n"
+        "    uint8_t xy[BLOCK_SIZE];\n"
+        "    uint8_t res[BLOCK_SIZE];\n"
+        "    to_bits(p[0], p[1], xy);\n"
+        "    for (size_t i = 0; i < ROUNDS; i++) {\n"
+        "        PREFETCH_ROUND(i + 1);\n"
+        "        PROFILE(i, PROFILE_MATRIX_VECTOR_PRODUCT, matrix_vector_product(CSR_ROW_OFFSETS[i], CSR_COLUMNS[i], VECTORS[i], xy, res));\n"
+        "        PROFILE(i, PROFILE_MODULAR_ADDITION, modular_addition(res));\n"
+        "        memcpy(&xy, &res, sizeof(res));\n"
+        "    }\n"
+        "\n"
+        "    PROFILE(ROUNDS, PROFILE_MATRIX_VECTOR_PRODUCT, matrix_vector_product(CSR_ROW_OFFSETS[ROUNDS], CSR_COLUMNS[ROUNDS], VECTORS[ROUNDS], xy, res));\n"
+        "    from_bits(res, &c[0], &c[1]);\n"
+        "}\n"
+    )
+
+    def table_bytes(self, matrices, vectors):
+        # The column indices, the row offsets, and the pointers to the column indices of every round.
+        block_size = matrices[0].nrows()
+        return sum(len(matrix.nonzero_positions()) for matrix in matrices) + \
+               len(matrices) * ((block_size + 1) * 2 + 8) + \
+               len(vectors) * block_size
+
+    def _layer_operations(self, k, matrix, vector):
+        # The vector bit is the initial value of the output bit.
+        return {"xors": len(matrix.nonzero_positions()), "ands": 0, "parities": 0}
+
+    def _matrices(self, matrices):
+        return csr_tables(matrices, lambda j: j, self._table_alignment())
+
+    def _vectors(self, vectors):
+        s = f"static const uint8_t VECTORS[ROUNDS + 1][BLOCK_SIZE]{self._table_alignment()} = {{\n"
+        for k, vector in enumerate(vectors):
+            s += "    {" + ", ".join(map(str, vector)) + "}"
+            if k + 1 < len(vectors):
+                s += ","
+            s += "\n"
+        s += "};\n"
+        return s
+
+    def _functions(self, block_size, word_size, rounds):
+        return self._PROFILE + \
+               "\n" + \
+               self._PREFETCH_ROUND + \
+               "\n" + \
+               self._FROM_BITS + \
+               "\n" + \
+               self._TO_BITS + \
+               "\n" + \
+               self._MATRIX_VECTOR_PRODUCT + \
+               "\n" + \
+               self._modular_operation() + \
+               "\n" + \
+               self._ENCRYPT
@@ -6,8 +6,19 @@ class DefaultCodeGenerator(CodeGenerator):
     Generates output C code for white-box Speck implementations using the default code generation strategy.
     """
 
+    def table_bytes(self, matrices, vectors):
+        block_size = matrices[0].nrows()
+        return len(matrices) * block_size * block_size + len(vectors) * block_size
+
+    def tables(self, matrices, vectors):
+        return [
+            ("MATRICES", "uint8_t", "[ROUNDS + 1][BLOCK_SIZE][BLOCK_SIZE]", 1, [b for matrix in matrices for row in matrix for b in row]),
+            ("VECTORS", "uint8_t", "[ROUNDS + 1][BLOCK_SIZE]", 1, [b for vector in vectors for b in vector]),
+        ]
+
     def _matrices(self, matrices):
-        s = "uint8_t MATRICES[ROUNDS + 1][BLOCK_SIZE][BLOCK_SIZE] = {\n"
+        # The kernel reads the rows in order, so the cache layout only aligns the tables.
+        s = f"static const uint8_t MATRICES[ROUNDS + 1][BLOCK_SIZE][BLOCK_SIZE]{self._table_alignment()} = {{\n"
         for k, matrix in enumerate(matrices):
             s += "    {\n"
             for i in range(matrix.nrows()):
@@ -28,7 +39,7 @@ class DefaultCodeGenerator(CodeGenerator):
         return s
 
     def _vectors(self, vectors):
-        s = "uint8_t VECTORS[ROUNDS + 1][BLOCK_SIZE] = {\n"
+        s = f"static const uint8_t VECTORS[ROUNDS + 1][BLOCK_SIZE]{self._table_alignment()} = {{\n"
         for k, vector in enumerate(vectors):
             s += "    {"
             for i in range(len(vector)):
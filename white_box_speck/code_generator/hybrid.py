@@ -0,0 +1,182 @@
+import logging
+
+from .bit_packed import BitPackedCodeGenerator
+from .column_bit_packed import ColumnBitPackedCodeGenerator
+from .csr_bit_packed import CSRBitPackedCodeGenerator
+from .csr_matrix import csr_matrix
+from .inlined_bit_packed import InlinedBitPackedCodeGenerator
+from .xor_network import xor_network
+
+
+class HybridCodeGenerator(BitPackedCodeGenerator):
+    """
+    Generates output C code for white-box Speck implementations using the hybrid code generation strategy.
+    Every layer is emitted using the kernel with the lowest estimated cost, and all layers operate on the bit-packed state.
+    """
+
+    _INTERLEAVE_FACTORS = [1]
+
+    # The kernels share the bit-packed state, so they only differ in how the matrix-vector product is computed.
+    _KERNEL_MATRIX_VECTOR_PRODUCTS = {
+        "sparse": CSRBitPackedCodeGenerator._MATRIX_VECTOR_PRODUCT.replace("matrix_vector_product(", "sparse_matrix_vector_product("),
+        "bit_packed": BitPackedCodeGenerator._MATRIX_VECTOR_PRODUCT.replace("matrix_vector_product(", "bit_packed_matrix_vector_product("),
+        "column": ColumnBitPackedCodeGenerator._MATRIX_VECTOR_PRODUCT.replace("matrix_vector_product(", "column_matrix_vector_product("),
+    }
+
+    _KERNEL_CODE_GENERATORS = {
+        "sparse": CSRBitPackedCodeGenerator,
+        "bit_packed": BitPackedCodeGenerator,
+        "column": ColumnBitPackedCodeGenerator,
+    }
+
+    # The estimated number of instructions of the kernels, for every output bit, nonzero entry, input bit, and XOR of the XOR network.
+    _KERNEL_COSTS = {
+        "inlined": {"rows": 2, "nonzeros": 0, "columns": 2, "xors": 1},
+        "sparse": {"rows": 4, "nonzeros": 4, "columns": 0, "xors": 0},
+        "bit_packed": {"rows": 7, "nonzeros": 0, "columns": 0, "xors": 0},
+        "column": {"rows": 0, "nonzeros": 0, "columns": 8, "xors": 0},
+    }
+
+    def __init__(self, xor_cse=False, **kwargs):
+        """
+        Initializes an instance of HybridCodeGenerator with the provided parameters.
+        :param xor_cse: whether to eliminate common XOR subexpressions in the inlined layers
+        :param kwargs: the parameters of CodeGenerator
+        """
+        super().__init__(**kwargs)
+        self.xor_cse = xor_cse
+        self.layer_choices = []
+        self._inlined = InlinedBitPackedCodeGenerator(xor_cse=xor_cse)
+        # The operations of a layer are counted by a code generator of its kernel.
+        self._kernel_code_generators = {kernel: code_generator() for kernel, code_generator in self._KERNEL_CODE_GENERATORS.items()}
+        self._kernel_code_generators["inlined"] = self._inlined
+
+    def _is_permutation(self, matrix):
+        return all(len(matrix.nonzero_positions_in_row(i)) == 1 for i in range(matrix.nrows())) and \
+               all(len(matrix.nonzero_positions_in_column(j)) == 1 for j in range(matrix.ncols()))
+
+    def choose_kernels(self, matrices):
+        """
+        Scores every matrix and chooses the kernel with the lowest estimated cost for every layer.
+        :param matrices: the matrices
+        :return: a list containing a dict with the kernel, the scores, and the estimated cost of every kernel for every layer
+        """
+        choices = []
+        for k, matrix in enumerate(matrices):
+            _, _, before, after = xor_network(matrix, self.xor_cse)
+            scores = {
+                "rows": matrix.nrows(),
+                "columns": matrix.ncols(),
+                "nonzeros": len(matrix.nonzero_positions()),
+                "rank": matrix.rank(),
+                "permutation": self._is_permutation(matrix),
+                "xors": after,
+            }
+            costs = {kernel: sum(weight * scores[score] for score, weight in weights.items()) for kernel, weights in self._KERNEL_COSTS.items()}
+            # A permutation (e.g. a rotation) only moves bits, which the inlined kernel does without any XORs.
+            kernel = "inlined" if scores["permutation"] else min(costs, key=costs.get)
+            logging.debug(f"Layer {k}: {kernel} kernel ({scores['nonzeros']} nonzeros, rank {scores['rank']}, {before} XORs before and {after} XORs after common subexpression elimination)")
+            choices.append({"kernel": kernel, "scores": scores, "costs": costs})
+
+        return choices
+
+    def _layer_operations(self, k, matrix, vector):
+        return self._kernel_code_generators[self.layer_choices[k]["kernel"]]._layer_operations(k, matrix, vector)
+
+    def _kernel_table_bytes(self, kernel, matrix):
+        word_bytes = self._WORD_BYTES[matrix.nrows() // 2]
+        if kernel == "sparse":
+            return len(matrix.nonzero_positions()) + (matrix.nrows() + 1) * 2 + 2 * word_bytes
+        if kernel in ["bit_packed", "column"]:
+            return matrix.nrows() * 2 * word_bytes
+        return 0
+
+    def _layer_table_bytes(self, k, matrix, vector):
+        return self._kernel_table_bytes(self.layer_choices[k]["kernel"], matrix)
+
+    def _layer_code_bytes(self, k, operations):
+        if self.layer_choices[k]["kernel"] == "inlined":
+            return self._inlined._layer_code_bytes(k, operations)
+
+        return 0
+
+    def table_bytes(self, matrices, vectors):
+        # The kernels are chosen for these matrices, which are not necessarily the matrices of the last call to analyze or generate_code.
+        choices = self.choose_kernels(matrices)
+        return sum(self._kernel_table_bytes(choice["kernel"], matrix) for choice, matrix in zip(choices, matrices))
+
+    def analyze(self, matrices, vectors):
+        self.layer_choices = self.choose_kernels(matrices)
+        analysis = super().analyze(matrices, vectors)
+        for layer, choice in zip(analysis["layers"], self.layer_choices):
+            layer["kernel"] = choice["kernel"]
+        return analysis
+
+    def tables(self, matrices, vectors):
+        # Every layer has its own tables, or no tables at all.
+        return None
+
+    def _vector_words(self, vector):
+        return f"WORD_CONSTANT_TYPE({self._to_int_big_endian(vector[:len(vector) // 2])})", f"WORD_CONSTANT_TYPE({self._to_int_big_endian(vector[len(vector) // 2:])})"
+
+    def _table_layer(self, k, kernel, matrix, vector):
+        # The rows of the transpose are the columns of the matrix.
+        rows = matrix.transpose() if kernel == "column" else matrix
+        table = f"{kernel.upper()}_MATRIX_{k}"
+        s = f"static const WORD_TYPE {table}[BLOCK_SIZE][2] = {{{', '.join(self._row(rows, i) for i in range(rows.nrows()))}}};\n\n"
+        s += f"static inline __attribute__((always_inline)) void layer_{k}(const WORD_TYPE xy[restrict 2], WORD_TYPE res[restrict 2]) {{\n"
+        s += f"    res[0] = 0;\n"
+        s += f"    res[1] = 0;\n"
+        s += f"    {kernel}_matrix_vector_product({table}, xy, res);\n"
+        xpart, ypart = self._vector_words(vector)
+        s += f"    res[0] ^= {xpart};\n"
+        s += f"    res[1] ^= {ypart};\n"
+        s += "}\n"
+        return s
+
+    def _sparse_layer(self, k, matrix, vector):
+        # A column index j is stored as (j / WORD_SIZE) << 6 | (j % WORD_SIZE), like in the CSR bit-packed strategy.
+        word_size = matrix.nrows() // 2
+        row_offsets, columns = csr_matrix(matrix)
+        xpart, ypart = self._vector_words(vector)
+        s = f"static const uint16_t SPARSE_ROW_OFFSETS_{k}[BLOCK_SIZE + 1] = {{{', '.join(map(str, row_offsets))}}};\n"
+        s += f"static const uint8_t SPARSE_COLUMNS_{k}[{len(columns)}] = {{{', '.join(str((j // word_size) << 6 | (j % word_size)) for j in columns)}}};\n"
+        s += f"static const WORD_TYPE SPARSE_VECTOR_{k}[2] = {{{xpart}, {ypart}}};\n\n"
+        s += f"static inline __attribute__((always_inline)) void layer_{k}(const WORD_TYPE xy[restrict 2], WORD_TYPE res[restrict 2]) {{\n"
+        s += f"    sparse_matrix_vector_product(SPARSE_ROW_OFFSETS_{k}, SPARSE_COLUMNS_{k}, SPARSE_VECTOR_{k}, xy, res);\n"
+        s += "}\n"
+        return s
+
+    def _inlined_layer(self, k, matrix, vector):
+        s = f"static inline __attribute__((always_inline)) void layer_{k}(const WORD_TYPE xy[restrict 2], WORD_TYPE res[restrict 2]) {{\n"
+        s += self._inlined._matrix_vector_product(k, matrix, vector)
+        s += "}\n"
+        return s
+
+    def _layers(self, matrices, vectors):
+        self.layer_choices = self.choose_kernels(matrices)
+        kernels = {choice["kernel"] for choice in self.layer_choices}
+        s = "".join(self._KERNEL_MATRIX_VECTOR_PRODUCTS[kernel] + "\n" for kernel in self._KERNEL_MATRIX_VECTOR_PRODUCTS if kernel in kernels)
+        for k, (choice, matrix, vector) in enumerate(zip(self.layer_choices, matrices, vectors)):
+            s += f"// Layer {k}: {choice['kernel']} kernel\n"
+            if choice["kernel"] == "inlined":
+                s += self._inlined_layer(k, matrix, vector)
+            elif choice["kernel"] == "sparse":
+                s += self._sparse_layer(k, matrix, vector)
+            else:
+                s += self._table_layer(k, choice["kernel"], matrix, vector)
+            s += "\n"
+        return s
+
+    def _matrices(self, matrices):
+        return ""
+
+    def _vectors(self, vectors):
+        return ""
+
+    def _functions(self, block_size, word_size, rounds):
+        return self._PROFILE + \
+               "\n" + \
+               self._modular_operation() + \
+               "\n" + \
+               self._inlined._unrolled_encrypt(rounds)
@@ -1,4 +1,7 @@
+import logging
+
 from . import CodeGenerator
+from .xor_network import xor_network
 
 
 class InlinedCodeGenerator(CodeGenerator):
@@ -7,67 +10,139 @@ class InlinedCodeGenerator(CodeGenerator):
     """
 
     _ENCRYPT = (
-        "void encrypt(WORD_TYPE p[2], WORD_TYPE c[2]) {\n"
+        "static void encrypt(const WORD_TYPE p[2], WORD_TYPE c[2]) {\n"
         "    uint8_t xy[BLOCK_SIZE];\n"
         "    uint8_t res[BLOCK_SIZE];\n"
         "    to_bits(p[0], p[1], xy);\n"
         "    for (size_t i = 0; i < ROUNDS; i++) {\n"
         "        memset(&res, 0, BLOCK_SIZE * sizeof(uint8_t));\n"
-        "        MATRIX_VECTOR_PRODUCTS[i](xy, res);\n"
-        "        VECTOR_ADDITIONS[i](res);\n"
-        "        modular_addition(res);\n"
+        "        PROFILE(i, PROFILE_MATRIX_VECTOR_PRODUCT, MATRIX_VECTOR_PRODUCTS[i](xy, res));\n"
+        "        PROFILE(i, PROFILE_VECTOR_ADDITION, VECTOR_ADDITIONS[i](res));\n"
+        "        PROFILE(i, PROFILE_MODULAR_ADDITION, modular_addition(res));\n"
         "        memcpy(&xy, &res, BLOCK_SIZE * sizeof(uint8_t));\n"
         "    }\n"
         "\n"
         "    memset(&res, 0, BLOCK_SIZE * sizeof(uint8_t));\n"
-        "    MATRIX_VECTOR_PRODUCTS[ROUNDS](xy, res);\n"
-        "    VECTOR_ADDITIONS[ROUNDS](res);\n"
+        "    PROFILE(ROUNDS, PROFILE_MATRIX_VECTOR_PRODUCT, MATRIX_VECTOR_PRODUCTS[ROUNDS](xy, res));\n"
+        "    PROFILE(ROUNDS, PROFILE_VECTOR_ADDITION, VECTOR_ADDITIONS[ROUNDS](res));\n"
         "    from_bits(res, &c[0], &c[1]);\n"
         "}\n"
     )
 
+    def __init__(self, xor_cse=False, unrolled=False, split=False, **kwargs):
+        """
+        Initializes an instance of InlinedCodeGenerator with the provided parameters.
+        :param xor_cse: whether to eliminate common XOR subexpressions in the matrix-vector products
+        :param unrolled: whether to emit a fully unrolled encrypt function instead of dispatching through function pointer tables
+        :param split: whether to define the layer functions in separate translation units, generated using generate_split_code
+        :param kwargs: the parameters of CodeGenerator
+        """
+        super().__init__(**kwargs)
+        self.xor_cse = xor_cse
+        self.unrolled = unrolled
+        self.split = split
+        self.xor_counts = []
+
+    def _layer_operations(self, k, matrix, vector):
+        _, _, _, after = xor_network(matrix, self.xor_cse)
+        return {"xors": after + len(vector.nonzero_positions()), "ands": 0, "parities": 0}
+
+    def _layer_code_bytes(self, k, operations):
+        return self._CODE_BYTES_PER_OPERATION * (operations["xors"] + operations["ands"] + operations["parities"])
+
+    def _signal(self, matrix, s):
+        return f"xy[{s}]" if s < matrix.ncols() else f"t{s - matrix.ncols()}"
+
+    def _matrix_vector_product(self, k, matrix, vector=None):
+        temporaries, rows, before, after = xor_network(matrix, self.xor_cse)
+        self.xor_counts.append((before, after))
+        logging.debug(f"Matrix {k}: {before} XORs before and {after} XORs after common subexpression elimination")
+
+        s = ""
+        for t, (a, b) in enumerate(temporaries):
+            s += f"    uint8_t t{t} = {self._signal(matrix, a)} ^ {self._signal(matrix, b)};\n"
+        for i, row in enumerate(rows):
+            # If a vector is provided, it is folded into the initial value of the result.
+            s += f"    res[{i}] ^= 0" if vector is None else f"    res[{i}] = {vector[i]}"
+            for j in row:
+                s += f" ^ {self._signal(matrix, j)}"
+            s += ";\n"
+        return s
+
+    def _layer_function_name(self, name):
+        # The layer functions of split implementations are not static, so they are prefixed like the exported functions.
+        return f"{self.symbol_prefix}{name}" if self.split else name
+
+    def _vector_addition(self, vector):
+        s = ""
+        for i in range(len(vector)):
+            if vector[i] != 0:
+                s += f"    xy[{i}] ^= 1;\n"
+        return s
+
+    def _layer_functions(self, matrices, vectors):
+        # The layer functions are generated once per implementation, so the XOR counts are those of the last generated implementation.
+        self.xor_counts = []
+        functions = []
+        for k, (matrix, vector) in enumerate(zip(matrices, vectors)):
+            if self.unrolled:
+                functions.append([
+                    (f"void {self._layer_function_name(f'layer_{k}')}(const uint8_t xy[restrict BLOCK_SIZE], uint8_t res[restrict BLOCK_SIZE])", self._matrix_vector_product(k, matrix, vector)),
+                ])
+            else:
+                functions.append([
+                    (f"void {self._layer_function_name(f'matrix_vector_product_{k}')}(const uint8_t xy[restrict BLOCK_SIZE], uint8_t res[restrict BLOCK_SIZE])", self._matrix_vector_product(k, matrix)),
+                    (f"void {self._layer_function_name(f'vector_addition_{k}')}(uint8_t xy[BLOCK_SIZE])", self._vector_addition(vector)),
+                ])
+        return functions
+
+    def _layers(self, matrices, vectors):
+        # The layer functions of split implementations are defined in their own translation units.
+        s = ""
+        if not self.split:
+            qualifiers = "static inline __attribute__((always_inline)) " if self.unrolled else "static "
+            s += self._layer_function_definitions(self._layer_functions(matrices, vectors), qualifiers)
+        if self.unrolled:
+            return s
+
+        return s + super()._layers(matrices, vectors)
+
+    def _unrolled_encrypt(self, rounds):
+        # The state alternates between two local buffers, so no copies are required between rounds.
+        buffers = ["xy", "res"]
+        s = (
+            "static void encrypt(const WORD_TYPE p[2], WORD_TYPE c[2]) {\n"
+            "    uint8_t xy[BLOCK_SIZE];\n"
+            "    uint8_t res[BLOCK_SIZE];\n"
+            "    to_bits(p[0], p[1], xy);\n"
+        )
+        for k in range(rounds):
+            s += f"    PROFILE({k}, PROFILE_MATRIX_VECTOR_PRODUCT, {self._layer_function_name(f'layer_{k}')}({buffers[k % 2]}, {buffers[(k + 1) % 2]}));\n"
+            s += f"    PROFILE({k}, PROFILE_MODULAR_ADDITION, modular_addition({buffers[(k + 1) % 2]}));\n"
+        s += f"    PROFILE({rounds}, PROFILE_MATRIX_VECTOR_PRODUCT, {self._layer_function_name(f'layer_{rounds}')}({buffers[rounds % 2]}, {buffers[(rounds + 1) % 2]}));\n"
+        s += f"    from_bits({buffers[(rounds + 1) % 2]}, &c[0], &c[1]);\n"
+        s += "}\n"
+        return s
+
     def _matrices(self, matrices):
-        s1 = ""
-        s2 = "void (*MATRIX_VECTOR_PRODUCTS[ROUNDS + 1])(uint8_t[BLOCK_SIZE], uint8_t[BLOCK_SIZE]) = {"
-        for k, matrix in enumerate(matrices):
-            s1 += f"void matrix_vector_product_{k}(uint8_t xy[BLOCK_SIZE], uint8_t res[BLOCK_SIZE]) {{\n"
-            for i in range(matrix.nrows()):
-                s1 += f"    res[{i}] ^= 0"
-                for j in range(matrix.ncols()):
-                    if matrix[i][j] != 0:
-                        s1 += f" ^ xy[{j}]"
-                s1 += ";\n"
-            s1 += "}\n\n"
-
-            s2 += f"matrix_vector_product_{k}"
-            if k < len(matrices) - 1:
-                s2 += ", "
-
-        s2 += "};\n"
-        return s1 + s2
+        s = "static void (*const MATRIX_VECTOR_PRODUCTS[ROUNDS + 1])(const uint8_t[BLOCK_SIZE], uint8_t[BLOCK_SIZE]) = {"
+        s += ", ".join(self._layer_function_name(f"matrix_vector_product_{k}") for k in range(len(matrices)))
+        s += "};\n"
+        return s
 
     def _vectors(self, vectors):
-        s1 = ""
-        s2 = "void (*VECTOR_ADDITIONS[ROUNDS + 1])(uint8_t[BLOCK_SIZE]) = {"
-        for k, vector in enumerate(vectors):
-            s1 += f"void vector_addition_{k}(uint8_t xy[BLOCK_SIZE]) {{\n"
-            for i in range(len(vector)):
-                if vector[i] != 0:
-                    s1 += f"    xy[{i}] ^= 1;\n"
-            s1 += "}\n\n"
-
-            s2 += f"vector_addition_{k}"
-            if k < len(vectors) - 1:
-                s2 += ", "
-
-        s2 += "};\n"
-        return s1 + s2
+        s = "static void (*const VECTOR_ADDITIONS[ROUNDS + 1])(uint8_t[BLOCK_SIZE]) = {"
+        s += ", ".join(self._layer_function_name(f"vector_addition_{k}") for k in range(len(vectors)))
+        s += "};\n"
+        return s
 
     def _functions(self, block_size, word_size, rounds):
-        return self._FROM_BITS + \
+        return self._PROFILE + \
+               "\n" + \
+               self._FROM_BITS + \
                "\n" + \
                self._TO_BITS + \
                "\n" + \
-               self._MODULAR_ADDITION + \
+               self._modular_operation() + \
                "\n" + \
-               self._ENCRYPT
+               (self._unrolled_encrypt(rounds) if self.unrolled else self._ENCRYPT)
@@ -1,4 +1,8 @@
+import logging
+import re
+
 from .bit_packed import BitPackedCodeGenerator
+from .xor_network import xor_network
 
 
 class InlinedBitPackedCodeGenerator(BitPackedCodeGenerator):
@@ -7,76 +11,216 @@ class InlinedBitPackedCodeGenerator(BitPackedCodeGenerator):
     """
 
     _ENCRYPT = (
-        "void encrypt(WORD_TYPE p[2], WORD_TYPE c[2]) {\n"
+        "static void encrypt(const WORD_TYPE p[2], WORD_TYPE c[2]) {\n"
         "    WORD_TYPE res[2];\n"
         "    c[0] = p[0];\n"
         "    c[1] = p[1];\n"
         "    for (size_t i = 0; i < ROUNDS; i++) {\n"
         "        res[0] = 0;\n"
         "        res[1] = 0;\n"
-        "        MATRIX_VECTOR_PRODUCTS[i](c, res);\n"
-        "        VECTOR_ADDITIONS[i](res);\n"
-        "        modular_addition(res);\n"
+        "        PROFILE(i, PROFILE_MATRIX_VECTOR_PRODUCT, MATRIX_VECTOR_PRODUCTS[i](c, res));\n"
+        "        PROFILE(i, PROFILE_VECTOR_ADDITION, VECTOR_ADDITIONS[i](res));\n"
+        "        PROFILE(i, PROFILE_MODULAR_ADDITION, modular_addition(res));\n"
         "        c[0] = res[0];\n"
         "        c[1] = res[1];\n"
         "    }\n"
         "\n"
         "    res[0] = 0;\n"
         "    res[1] = 0;\n"
-        "    MATRIX_VECTOR_PRODUCTS[ROUNDS](c, res);\n"
-        "    VECTOR_ADDITIONS[ROUNDS](res);\n"
+        "    PROFILE(ROUNDS, PROFILE_MATRIX_VECTOR_PRODUCT, MATRIX_VECTOR_PRODUCTS[ROUNDS](c, res));\n"
+        "    PROFILE(ROUNDS, PROFILE_VECTOR_ADDITION, VECTOR_ADDITIONS[ROUNDS](res));\n"
         "    c[0] = res[0];\n"
         "    c[1] = res[1];\n"
         "}\n"
     )
 
+    def __init__(self, xor_cse=False, unrolled=False, split=False, **kwargs):
+        """
+        Initializes an instance of InlinedBitPackedCodeGenerator with the provided parameters.
+        :param xor_cse: whether to eliminate common XOR subexpressions in the matrix-vector products
+        :param unrolled: whether to emit a fully unrolled encrypt function instead of dispatching through function pointer tables
+        :param split: whether to define the layer functions in separate translation units, generated using generate_split_code
+        :param kwargs: the parameters of CodeGenerator
+        """
+        super().__init__(**kwargs)
+        self.xor_cse = xor_cse
+        self.unrolled = unrolled
+        self.split = split
+        self.xor_counts = []
+
+    def table_bytes(self, matrices, vectors):
+        return None
+
+    def tables(self, matrices, vectors):
+        return None
+
+    def _layer_operations(self, k, matrix, vector):
+        # Every input bit is extracted once, and the vector is the initial value of the result.
+        _, _, _, after = xor_network(matrix, self.xor_cse)
+        return {"xors": after, "ands": matrix.ncols(), "parities": 0}
+
+    def _layer_code_bytes(self, k, operations):
+        return self._CODE_BYTES_PER_OPERATION * (operations["xors"] + operations["ands"] + operations["parities"])
+
+    def _signal(self, matrix, s):
+        word_size = matrix.ncols() // 2
+        if s < word_size:
+            return f"((xy[0] >> {s}) & 1)"
+        if s < matrix.ncols():
+            return f"((xy[1] >> {s - word_size}) & 1)"
+        return f"t{s - matrix.ncols()}"
+
+    def _matrix_vector_product(self, k, matrix, vector=None):
+        temporaries, rows, before, after = xor_network(matrix, self.xor_cse)
+        self.xor_counts.append((before, after))
+        logging.debug(f"Matrix {k}: {before} XORs before and {after} XORs after common subexpression elimination")
+
+        s = ""
+        word_size = matrix.nrows() // 2
+        if vector is not None:
+            # The vector is folded into the initial value of the result.
+            s += f"    res[0] = WORD_CONSTANT_TYPE({self._to_int_big_endian(vector[:word_size])});\n"
+            s += f"    res[1] = WORD_CONSTANT_TYPE({self._to_int_big_endian(vector[word_size:])});\n"
+        for t, (a, b) in enumerate(temporaries):
+            s += f"    WORD_TYPE t{t} = {self._signal(matrix, a)} ^ {self._signal(matrix, b)};\n"
+        for i, row in enumerate(rows):
+            s += f"    res[{i // word_size}] {'|=' if vector is None else '^='} (0"
+            for j in row:
+                s += f" ^ {self._signal(matrix, j)}"
+            s += f") << {i % word_size};\n"
+        return s
+
+    def _layer_function_name(self, name):
+        # The layer functions of split implementations are not static, so they are prefixed like the exported functions.
+        return f"{self.symbol_prefix}{name}" if self.split else name
+
+    def _vector_addition(self, vector):
+        xpart = self._to_int_big_endian(vector[:len(vector) // 2])
+        ypart = self._to_int_big_endian(vector[len(vector) // 2:])
+        return f"    xy[0] ^= WORD_CONSTANT_TYPE({xpart});\n" + \
+               f"    xy[1] ^= WORD_CONSTANT_TYPE({ypart});\n"
+
+    def _interleaved_layer(self, body):
+        # Every statement is repeated for every block, using the local variables and temporaries of the block.
+        s = self._interleaved_state()
+        for line in body.splitlines():
+            for b in range(self.interleave):
+                s += re.sub(r"\b(xy|res)\[", rf"\g<1>{b}[", re.sub(r"\bt(\d+)\b", rf"t\g<1>_{b}", line)) + "\n"
+        return s + self._interleaved_result()
+
+    def _layer_functions(self, matrices, vectors):
+        # The layer functions are generated once per implementation, so the XOR counts are those of the last generated implementation.
+        self.xor_counts = []
+        functions = []
+        for k, (matrix, vector) in enumerate(zip(matrices, vectors)):
+            if self.unrolled:
+                body = self._matrix_vector_product(k, matrix, vector)
+                functions.append([
+                    (f"void {self._layer_function_name(f'layer_{k}')}(const WORD_TYPE xy[restrict 2], WORD_TYPE res[restrict 2])", body),
+                ])
+                name = f"layer_{k}_interleaved"
+            else:
+                body = self._matrix_vector_product(k, matrix)
+                functions.append([
+                    (f"void {self._layer_function_name(f'matrix_vector_product_{k}')}(const WORD_TYPE xy[restrict 2], WORD_TYPE res[restrict 2])", body),
+                    (f"void {self._layer_function_name(f'vector_addition_{k}')}(WORD_TYPE xy[2])", self._vector_addition(vector)),
+                ])
+                name = f"matrix_vector_product_{k}_interleaved"
+            if self.interleave > 1:
+                functions[-1].append((f"void {self._layer_function_name(name)}(const WORD_TYPE xy[restrict INTERLEAVE][2], WORD_TYPE res[restrict INTERLEAVE][2])", self._interleaved_layer(body)))
+        return functions
+
+    def _layers(self, matrices, vectors):
+        # The layer functions of split implementations are defined in their own translation units.
+        s = ""
+        if not self.split:
+            qualifiers = "static inline __attribute__((always_inline)) " if self.unrolled else "static "
+            s += self._layer_function_definitions(self._layer_functions(matrices, vectors), qualifiers)
+        if self.unrolled:
+            return s
+
+        return s + super()._layers(matrices, vectors)
+
+    def _unrolled_encrypt(self, rounds):
+        # The state alternates between two local buffers, so no copies are required between rounds.
+        buffers = ["xy", "res"]
+        s = (
+            "static void encrypt(const WORD_TYPE p[2], WORD_TYPE c[2]) {\n"
+            "    WORD_TYPE xy[2] = {p[0], p[1]};\n"
+            "    WORD_TYPE res[2];\n"
+        )
+        for k in range(rounds):
+            s += f"    PROFILE({k}, PROFILE_MATRIX_VECTOR_PRODUCT, {self._layer_function_name(f'layer_{k}')}({buffers[k % 2]}, {buffers[(k + 1) % 2]}));\n"
+            s += f"    PROFILE({k}, PROFILE_MODULAR_ADDITION, modular_addition({buffers[(k + 1) % 2]}));\n"
+        s += f"    PROFILE({rounds}, PROFILE_MATRIX_VECTOR_PRODUCT, {self._layer_function_name(f'layer_{rounds}')}({buffers[rounds % 2]}, {buffers[(rounds + 1) % 2]}));\n"
+        s += f"    c[0] = {buffers[(rounds + 1) % 2]}[0];\n"
+        s += f"    c[1] = {buffers[(rounds + 1) % 2]}[1];\n"
+        s += "}\n"
+        return s
+
     def _matrices(self, matrices):
-        s1 = ""
-        s2 = "void (*MATRIX_VECTOR_PRODUCTS[ROUNDS + 1])(WORD_TYPE[2], WORD_TYPE[2]) = {"
-        for k, matrix in enumerate(matrices):
-            s1 += f"void matrix_vector_product_{k}(WORD_TYPE xy[2], WORD_TYPE res[2]) {{\n"
-            word_size = matrix.nrows() // 2
-            for i in range(word_size):
-                s1 += "    res[0] |= (0"
-                for j in range(word_size):
-                    if matrix[i][j] != 0:
-                        s1 += f" ^ ((xy[0] >> {j}) & 1)"
-                for j in range(word_size):
-                    if matrix[i][word_size + j] != 0:
-                        s1 += f" ^ ((xy[1] >> {j}) & 1)"
-                s1 += ") << %d;\n" % i
-            for i in range(word_size):
-                s1 += "    res[1] |= (0"
-                for j in range(word_size):
-                    if matrix[word_size + i][j] != 0:
-                        s1 += f" ^ ((xy[0] >> {j}) & 1)"
-                for j in range(word_size):
-                    if matrix[word_size + i][word_size + j] != 0:
-                        s1 += f" ^ ((xy[1] >> {j}) & 1)"
-                s1 += f") << {i};\n"
-            s1 += "}\n\n"
-
-            s2 += f"matrix_vector_product_{k}"
-            if k < len(matrices) - 1:
-                s2 += ", "
-
-        s2 += "};\n"
-        return s1 + s2
+        s = "static void (*const MATRIX_VECTOR_PRODUCTS[ROUNDS + 1])(const WORD_TYPE[2], WORD_TYPE[2]) = {"
+        s += ", ".join(self._layer_function_name(f"matrix_vector_product_{k}") for k in range(len(matrices)))
+        s += "};\n"
+        if self.interleave > 1:
+            s += "static void (*const MATRIX_VECTOR_PRODUCTS_INTERLEAVED[ROUNDS + 1])(const WORD_TYPE[INTERLEAVE][2], WORD_TYPE[INTERLEAVE][2]) = {"
+            s += ", ".join(self._layer_function_name(f"matrix_vector_product_{k}_interleaved") for k in range(len(matrices)))
+            s += "};\n"
+        return s
 
     def _vectors(self, vectors):
-        s1 = ""
-        s2 = "void (*VECTOR_ADDITIONS[ROUNDS + 1])(WORD_TYPE[2]) = {"
-        for k, vector in enumerate(vectors):
-            xpart = self._to_int_big_endian(vector[:len(vector) // 2])
-            ypart = self._to_int_big_endian(vector[len(vector) // 2:])
-            s1 += f"void vector_addition_{k}(WORD_TYPE xy[2]) {{\n"
-            s1 += f"    xy[0] ^= WORD_CONSTANT_TYPE({xpart});\n"
-            s1 += f"    xy[1] ^= WORD_CONSTANT_TYPE({ypart});\n"
-            s1 += "}\n\n"
-
-            s2 += f"vector_addition_{k}"
-            if k < len(vectors) - 1:
-                s2 += ", "
-
-        s2 += "};\n"
-        return s1 + s2
+        s = "static void (*const VECTOR_ADDITIONS[ROUNDS + 1])(WORD_TYPE[2]) = {"
+        s += ", ".join(self._layer_function_name(f"vector_addition_{k}") for k in range(len(vectors)))
+        s += "};\n"
+        return s
+
+    def _unrolled_interleaved_encrypt(self, rounds):
+        # Like the unrolled encrypt function, the state alternates between two local buffers.
+        buffers = ["xy", "res"]
+        s = (
+            "static void encrypt_interleaved(const WORD_TYPE p[INTERLEAVE][2], WORD_TYPE c[INTERLEAVE][2]) {\n"
+            "    WORD_TYPE xy[INTERLEAVE][2];\n"
+            "    WORD_TYPE res[INTERLEAVE][2];\n"
+            "    for (size_t b = 0; b < INTERLEAVE; b++) {\n"
+            "        xy[b][0] = p[b][0];\n"
+            "        xy[b][1] = p[b][1];\n"
+            "    }\n"
+        )
+        for k in range(rounds):
+            s += f"    PROFILE({k}, PROFILE_MATRIX_VECTOR_PRODUCT, {self._layer_function_name(f'layer_{k}_interleaved')}({buffers[k % 2]}, {buffers[(k + 1) % 2]}));\n"
+            s += "    for (size_t b = 0; b < INTERLEAVE; b++) {\n"
+            s += f"        PROFILE({k}, PROFILE_MODULAR_ADDITION, modular_addition({buffers[(k + 1) % 2]}[b]));\n"
+            s += "    }\n"
+        s += f"    PROFILE({rounds}, PROFILE_MATRIX_VECTOR_PRODUCT, {self._layer_function_name(f'layer_{rounds}_interleaved')}({buffers[rounds % 2]}, {buffers[(rounds + 1) % 2]}));\n"
+        s += "    for (size_t b = 0; b < INTERLEAVE; b++) {\n"
+        s += f"        c[b][0] = {buffers[(rounds + 1) % 2]}[b][0];\n"
+        s += f"        c[b][1] = {buffers[(rounds + 1) % 2]}[b][1];\n"
+        s += "    }\n"
+        s += "}\n"
+        return s
+
+    def _interleaved_functions(self, word_size, rounds):
+        if self.interleave == 1:
+            return ""
+
+        if self.unrolled:
+            return "\n" + self._unrolled_interleaved_encrypt(rounds)
+
+        return "\n" + self._interleaved_encrypt(rounds, "MATRIX_VECTOR_PRODUCTS_INTERLEAVED[{r}](xy, res)", "VECTOR_ADDITIONS[{r}](res[b])", False)
+
+    def _functions(self, block_size, word_size, rounds):
+        # The matrix-vector products and vector additions are the layer functions, so the generic kernels are not emitted.
+        if not self.unrolled:
+            return self._PROFILE + \
+                   "\n" + \
+                   self._modular_operation() + \
+                   "\n" + \
+                   self._ENCRYPT + \
+                   self._interleaved_functions(word_size, rounds)
+
+        return self._PROFILE + \
+               "\n" + \
+               self._modular_operation() + \
+               "\n" + \
+               self._unrolled_encrypt(rounds) + \
+               self._interleaved_functions(word_size, rounds)
@@ -0,0 +1,257 @@
+from .bit_packed import BitPackedCodeGenerator
+
+
+class NumpyCodeGenerator(BitPackedCodeGenerator):
+    """
+    Generates an output Python module for white-box Speck implementations using the NumPy code generation strategy.
+    The rows are bit-packed like in the bit-packed strategy, and every matrix is turned into lookup tables containing its product with every byte of the state when the module is imported.
+    Every operation is applied to a chunk of blocks at once.
+    """
+
+    _INTERLEAVE_FACTORS = [1]
+
+    # The indices of a chunk contain BLOCK_SIZE / 8 words for every block, so a chunk of 4096 blocks needs at most 512 KiB per array.
+    _CHUNK_BLOCKS = 4096
+
+    # The words are folded until they fit in 16 bits, and the parity of the remaining bits is looked up in a table.
+    _PARITY_TABLE_BITS = 16
+
+    _IMPORTS = (
+        "import json\n"
+        "import sys\n"
+        "import time\n"
+        "\n"
+        "import numpy as np\n"
+    )
+
+    _PARITY_TABLE = (
+        "# PARITY_TABLE[i] is the parity of i.\n"
+        "PARITY_TABLE = np.zeros(1 << PARITY_TABLE_BITS, dtype=np.uint8)\n"
+        "for _i in range(PARITY_TABLE_BITS):\n"
+        "    PARITY_TABLE[1 << _i:2 << _i] = PARITY_TABLE[:1 << _i] ^ 1\n"
+    )
+
+    # Row i and row WORD_SIZE + i are the bits i of the x and y words of the product, so the parities are shifted into place and added.
+    _LOOKUP_TABLES = (
+        "def lookup_tables(matrix):\n"
+        "    # The products of the matrix and the vectors containing every byte value v at byte p of word w are stored at index (w * WORD_BYTES + p) * 256 + v.\n"
+        "    values = np.arange(256, dtype=np.uint64)[np.newaxis, :] << BYTE_SHIFTS\n"
+        "    t = matrix.T[:, np.newaxis, np.newaxis, :] & values[np.newaxis, :, :, np.newaxis]\n"
+        "    bits = parity(t).astype(np.uint64) << ROW_SHIFTS\n"
+        "    return np.stack([bits[..., :WORD_SIZE].sum(axis=-1).reshape(-1), bits[..., WORD_SIZE:].sum(axis=-1).reshape(-1)])\n"
+        "\n"
+        "\n"
+        "LOOKUP_TABLES = np.stack([lookup_tables(matrix) for matrix in MATRICES])\n"
+    )
+
+    # The product is the XOR of the products of the matrix and every byte of the state.
+    _MATRIX_VECTOR_PRODUCT = (
+        "def matrix_vector_product(lookup_table, x, y):\n"
+        "    indices = np.concatenate(((x >> BYTE_SHIFTS) & BYTE_MASK, (y >> BYTE_SHIFTS) & BYTE_MASK)) + TABLE_OFFSETS\n"
+        "    return np.bitwise_xor.reduce(np.take(lookup_table[0], indices), axis=0), np.bitwise_xor.reduce(np.take(lookup_table[1], indices), axis=0)\n"
+    )
+
+    _VECTOR_ADDITION = (
+        "def vector_addition(vector, x, y):\n"
+        "    x ^= vector[0]\n"
+        "    y ^= vector[1]\n"
+    )
+
+    _MODULAR_ADDITION = (
+        "def modular_addition(x, y):\n"
+        "    return (x + y) & WORD_MASK\n"
+    )
+
+    _MODULAR_SUBTRACTION = (
+        "def modular_subtraction(x, y):\n"
+        "    return (x - y) & WORD_MASK\n"
+    )
+
+    _ENCRYPT = (
+        "def encrypt(blocks):\n"
+        "    \"\"\"\n"
+        "    Vectorized encryption of an array of blocks.\n"
+        "    :param blocks: an array of unsigned integers, containing the x and y words of every block in its last dimension\n"
+        "    :return: an array of np.uint64 with the same shape, containing the x and y words of every encrypted block\n"
+        "    \"\"\"\n"
+        "    blocks = np.asarray(blocks, dtype=np.uint64)\n"
+        "    assert blocks.shape[-1] == 2, \"The last dimension must contain the x and y words\"\n"
+        "\n"
+        "    xy = blocks.reshape(-1, 2)\n"
+        "    out = np.empty_like(xy)\n"
+        "    for start in range(0, len(xy), CHUNK_BLOCKS):\n"
+        "        x = xy[start:start + CHUNK_BLOCKS, 0] & WORD_MASK\n"
+        "        y = xy[start:start + CHUNK_BLOCKS, 1] & WORD_MASK\n"
+        "        for i in range(ROUNDS):\n"
+        "            x, y = matrix_vector_product(LOOKUP_TABLES[i], x, y)\n"
+        "            vector_addition(VECTORS[i], x, y)\n"
+        "            x = modular_addition(x, y)\n"
+        "\n"
+        "        x, y = matrix_vector_product(LOOKUP_TABLES[ROUNDS], x, y)\n"
+        "        vector_addition(VECTORS[ROUNDS], x, y)\n"
+        "        out[start:start + CHUNK_BLOCKS, 0] = x\n"
+        "        out[start:start + CHUNK_BLOCKS, 1] = y\n"
+        "\n"
+        "    return out.reshape(blocks.shape)\n"
+    )
+
+    # Like the C implementations, the module encrypts a single block, or benchmarks the encryption of a number of random blocks.
+    _MAIN = (
+        "def benchmark(iterations):\n"
+        "    rng = np.random.default_rng()\n"
+        "    blocks = rng.integers(0, 1 << WORD_SIZE, size=(iterations, 2), dtype=np.uint64)\n"
+        "    encrypt(blocks[:CHUNK_BLOCKS])\n"
+        "\n"
+        "    start = time.perf_counter()\n"
+        "    encrypt(blocks)\n"
+        "    seconds = time.perf_counter() - start\n"
+        "    print(json.dumps({\"blocks\": iterations, \"block_bytes\": BLOCK_SIZE // 8, \"seconds\": seconds, \"blocks_per_second\": iterations / seconds}))\n"
+        "\n"
+        "\n"
+        "if __name__ == \"__main__\":\n"
+        "    if len(sys.argv) < 2:\n"
+        "        sys.exit(-1)\n"
+        "\n"
+        "    if len(sys.argv) < 3:\n"
+        "        benchmark(int(sys.argv[1]))\n"
+        "    else:\n"
+        "        c = encrypt([int(sys.argv[1], 16), int(sys.argv[2], 16)])\n"
+        "        print(f\"{int(c[0]):x} {int(c[1]):x}\")\n"
+    )
+
+    def __init__(self, **kwargs):
+        """
+        Initializes an instance of NumpyCodeGenerator with the provided parameters.
+        :param kwargs: the parameters of CodeGenerator, the module is always a library and always contains the tables
+        """
+        super().__init__(**kwargs)
+
+        assert not self.parallel, "A NumPy implementation is not multithreaded"
+        assert self.table_file is None and self.mapped_table_file is None, "A NumPy implementation always contains the tables"
+
+    def _word_bytes(self, word_size):
+        return (word_size + 7) // 8
+
+    def table_bytes(self, matrices, vectors):
+        # The lookup tables contain an x and a y word of type np.uint64 for every byte value of every byte of the state.
+        word_bytes = self._word_bytes(matrices[0].nrows() // 2)
+        return len(matrices) * 2 * 2 * word_bytes * 256 * 8 + len(vectors) * 2 * 8
+
+    def tables(self, matrices, vectors):
+        # The module always contains its tables, so there are no table files, split modules, or table stores of several instances.
+        return None
+
+    def _layer_operations(self, k, matrix, vector):
+        # Every byte of the state is looked up in the tables of both words, and the results are XORed.
+        lookups = 2 * self._word_bytes(matrix.nrows() // 2)
+        return {"xors": 2 * (lookups - 1) + 2, "ands": lookups, "parities": 0}
+
+    def _fold_shifts(self, word_size):
+        # Every fold halves the number of bits which contain the parity, until they fit in the index of the parity table.
+        shifts = []
+        shift = self._PARITY_TABLE_BITS
+        while shift < word_size:
+            shifts.insert(0, shift)
+            shift *= 2
+        return shifts
+
+    def _parity(self, word_size):
+        s = "def parity(t):\n"
+        shifts = self._fold_shifts(word_size)
+        for shift in shifts:
+            s += f"    t = t ^ (t >> np.uint64({shift}))\n"
+        if shifts:
+            s += "    t &= PARITY_TABLE_MASK\n"
+        s += "    return np.take(PARITY_TABLE, t)\n"
+        return s
+
+    def _constants(self, block_size, word_size, rounds):
+        parity_table_bits = min(word_size, self._PARITY_TABLE_BITS)
+        return f"BLOCK_SIZE = {block_size}\n" + \
+               f"WORD_SIZE = {word_size}\n" + \
+               f"WORD_BYTES = {self._word_bytes(word_size)}\n" + \
+               f"ROUNDS = {rounds}\n" + \
+               f"WORD_MASK = np.uint64(0x{(1 << word_size) - 1:02x})\n" + \
+               f"BYTE_MASK = np.uint64(0xff)\n" + \
+               f"CHUNK_BLOCKS = {self._CHUNK_BLOCKS}\n" + \
+               f"PARITY_TABLE_BITS = {parity_table_bits}\n" + \
+               f"PARITY_TABLE_MASK = np.uint64(0x{(1 << parity_table_bits) - 1:02x})\n" + \
+               "# ROW_SHIFTS[i] is the bit of the product which row i of a matrix is shifted to.\n" + \
+               "ROW_SHIFTS = np.tile(np.arange(WORD_SIZE, dtype=np.uint64), 2)\n" + \
+               "# BYTE_SHIFTS[p] is the shift of byte p of a word.\n" + \
+               "BYTE_SHIFTS = (np.arange(WORD_BYTES, dtype=np.uint64) * np.uint64(8))[:, np.newaxis]\n" + \
+               "# TABLE_OFFSETS[w * WORD_BYTES + p] is the index of the products of byte p of word w in a lookup table.\n" + \
+               "TABLE_OFFSETS = (np.arange(2 * WORD_BYTES, dtype=np.uint64) * np.uint64(256))[:, np.newaxis]\n"
+
+    def _matrices(self, matrices):
+        s = "MATRICES = np.array([\n"
+        for matrix in matrices:
+            s += "    [" + ", ".join("[0x{:x}, 0x{:x}]".format(*self._row_words(matrix, i)) for i in range(matrix.nrows())) + "],\n"
+        s += "], dtype=np.uint64)\n"
+        return s
+
+    def _vectors(self, vectors):
+        s = "VECTORS = np.array([\n"
+        for vector in vectors:
+            s += f"    [0x{self._to_int_big_endian(vector[:len(vector) // 2]):x}, 0x{self._to_int_big_endian(vector[len(vector) // 2:]):x}],\n"
+        s += "], dtype=np.uint64)\n"
+        return s
+
+    def _structured_rounds_function(self, matrices, vectors):
+        # Like in the C implementations, a zero vector is not added at all, and a rotation by 0 positions is not emitted at all.
+        word_size = matrices[0].nrows() // 2
+        s = "def structured_rounds(x, y):\n"
+        for matrix, vector in zip(matrices, vectors):
+            for word, rotation, part in zip(["x", "y"], self._word_rotations(matrix), [vector[:word_size], vector[word_size:]]):
+                value = self._to_int_big_endian(part)
+                if rotation != 0:
+                    s += f"    {word} = (({word} >> np.uint64({rotation})) | ({word} << np.uint64({word_size - rotation}))) & WORD_MASK\n"
+                if value != 0:
+                    s += f"    {word} = {word} ^ np.uint64(0x{value:x})\n"
+            s += "    x = modular_addition(x, y)\n"
+        s += "    return x, y\n"
+        return s
+
+    def _docstring(self, block_size):
+        return (
+            "\"\"\"\n"
+            f"White-box Speck{block_size} {'decryption' if self.decrypt else 'encryption'} implementation generated using the NumPy code generation strategy.\n"
+            "This module only depends on NumPy, and encrypts arrays of blocks using vectorized operations.\n"
+            "\"\"\"\n"
+        )
+
+    def generate_code(self, matrices, vectors):
+        assert len(matrices) > 0
+        assert len(vectors) > 0
+        assert len(matrices) == len(vectors)
+
+        block_size = matrices[0].nrows()
+        word_size = block_size // 2
+        structured = self.structured_rounds(matrices, vectors)
+        structured_rounds = self._structured_rounds_function(matrices[:structured], vectors[:structured]) if structured else None
+        matrices, vectors = matrices[structured:], vectors[structured:]
+        rounds = len(matrices) - 1
+
+        encrypt = self._ENCRYPT
+        if structured:
+            # The structured rounds are computed on the words of the chunk before the rounds which use the lookup tables.
+            line = "        y = xy[start:start + CHUNK_BLOCKS, 1] & WORD_MASK\n"
+            assert line in encrypt
+            encrypt = encrypt.replace(line, line + "        x, y = structured_rounds(x, y)\n")
+
+        parts = [
+            self._docstring(block_size) + self._IMPORTS,
+            self._constants(block_size, word_size, rounds),
+            self._matrices(matrices) + "\n" + self._vectors(vectors),
+            self._PARITY_TABLE,
+            self._parity(word_size),
+            self._LOOKUP_TABLES,
+            self._MATRIX_VECTOR_PRODUCT,
+            self._VECTOR_ADDITION,
+            self._modular_operation(),
+            structured_rounds,
+            encrypt,
+            self._MAIN,
+        ]
+        code = "\n\n".join(part for part in parts if part)
+        return self._rename_for_decryption(code) if self.decrypt else code
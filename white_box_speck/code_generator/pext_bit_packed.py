@@ -0,0 +1,72 @@
+from .bit_packed import BitPackedCodeGenerator
+
+
+class PextBitPackedCodeGenerator(BitPackedCodeGenerator):
+    """
+    Generates output C code for white-box Speck implementations using the BMI2 pext bit-packed code generation strategy.
+    """
+
+    _INTERLEAVE_FACTORS = [1]
+
+    _WORD_PEXT_FUNCTIONS = {
+        16: "_pext_u32",
+        24: "_pext_u32",
+        32: "_pext_u32",
+        48: "_pext_u64",
+        64: "_pext_u64",
+    }
+
+    _WORD_POPCOUNT_FUNCTIONS = {
+        16: "__builtin_popcount",
+        24: "__builtin_popcountl",
+        32: "__builtin_popcountl",
+        48: "__builtin_popcountll",
+        64: "__builtin_popcountll",
+    }
+
+    _INCLUDE_IMMINTRIN = "#include <immintrin.h>\n"
+
+    _MATRIX_VECTOR_PRODUCT = (
+        "static void matrix_vector_product(const WORD_TYPE matrix[BLOCK_SIZE][2], const WORD_TYPE xy[2], WORD_TYPE res[2]) {\n"
+        # Output bits are deposited at their final position, so they do not depend on each other.
+        "    for (size_t i = 0; i < WORD_SIZE; i++) {\n"
+        "        res[0] |= ((WORD_TYPE) ((WORD_POPCOUNT_FUNCTION(WORD_PEXT_FUNCTION(xy[0], matrix[i][0])) + WORD_POPCOUNT_FUNCTION(WORD_PEXT_FUNCTION(xy[1], matrix[i][1]))) & 1)) << i;\n"
+        "        res[1] |= ((WORD_TYPE) ((WORD_POPCOUNT_FUNCTION(WORD_PEXT_FUNCTION(xy[0], matrix[WORD_SIZE + i][0])) + WORD_POPCOUNT_FUNCTION(WORD_PEXT_FUNCTION(xy[1], matrix[WORD_SIZE + i][1]))) & 1)) << i;\n"
+        "    }\n"
+        "}\n"
+    )
+
+    _CACHE_LAYOUT_MATRIX_VECTOR_PRODUCT = (
+        "static void matrix_vector_product(const WORD_TYPE matrix[WORD_SIZE][2][2], const WORD_TYPE xy[2], WORD_TYPE res[2]) {\n"
+        "    for (size_t i = 0; i < WORD_SIZE; i++) {\n"
+        "        res[0] |= ((WORD_TYPE) ((WORD_POPCOUNT_FUNCTION(WORD_PEXT_FUNCTION(xy[0], matrix[i][0][0])) + WORD_POPCOUNT_FUNCTION(WORD_PEXT_FUNCTION(xy[1], matrix[i][0][1]))) & 1)) << i;\n"
+        "        res[1] |= ((WORD_TYPE) ((WORD_POPCOUNT_FUNCTION(WORD_PEXT_FUNCTION(xy[0], matrix[i][1][0])) + WORD_POPCOUNT_FUNCTION(WORD_PEXT_FUNCTION(xy[1], matrix[i][1][1]))) & 1)) << i;\n"
+        "    }\n"
+        "}\n"
+    )
+
+    def _read_order(self, word_size):
+        return list(range(word_size))
+
+    def _layer_operations(self, k, matrix, vector):
+        # Every pext selects the bits of a row from a word of the state, like an AND, and the parity is the sum of two popcounts.
+        return {"xors": 2, "ands": 2 * matrix.nrows(), "parities": 2 * matrix.nrows()}
+
+    def _includes(self):
+        return super()._includes() + \
+               self._INCLUDE_IMMINTRIN
+
+    def _define_word_pext_function(self, word_size):
+        assert word_size in self._WORD_PEXT_FUNCTIONS, f"Invalid or unsupported word size {word_size}"
+
+        return f"#define WORD_PEXT_FUNCTION {self._WORD_PEXT_FUNCTIONS[word_size]}\n"
+
+    def _define_word_popcount_function(self, word_size):
+        assert word_size in self._WORD_POPCOUNT_FUNCTIONS, f"Invalid or unsupported word size {word_size}"
+
+        return f"#define WORD_POPCOUNT_FUNCTION {self._WORD_POPCOUNT_FUNCTIONS[word_size]}\n"
+
+    def _defines(self, block_size, word_size, rounds):
+        return super()._defines(block_size, word_size, rounds) + \
+               self._define_word_pext_function(word_size) + \
+               self._define_word_popcount_function(word_size)
@@ -24,6 +24,11 @@ class SIMDCodeGenerator(BitPackedCodeGenerator):
                self._INCLUDE_STDLIB + \
                self._INCLUDE_IMMINTRIN
 
+    def _layer_operations(self, k, matrix, vector):
+        # Every SIMD AND and XOR processes SIMD_PACKED_COUNT rows at once, but the parities are computed per row.
+        groups = matrix.nrows() // (self._SIMD_SIZE // (matrix.nrows() // 2))
+        return {"xors": groups + 2, "ands": 2 * groups, "parities": matrix.nrows()}
+
     def _define_simd_packed_count(self, simd_packed_count):
         return f"#define SIMD_PACKED_COUNT {simd_packed_count}\n"
 
@@ -56,10 +61,11 @@ class SIMDCodeGenerator(BitPackedCodeGenerator):
                self._define_simd_type() + \
                self._define_simd_set1(word_size) + \
                self._define_simd_and() + \
-               self._define_simd_xor()
+               self._define_simd_xor() + \
+               self._define_interleave()
 
-    def _matrices(self, matrices):
-        s = (
+    def _table_types(self):
+        return (
             "typedef union simd_union {\n"
             "    WORD_TYPE words[SIMD_PACKED_COUNT];\n"
             "    SIMD_TYPE simd;\n"
@@ -67,21 +73,39 @@ class SIMDCodeGenerator(BitPackedCodeGenerator):
             "\n"
         )
 
-        s += "simd_union MATRICES[ROUNDS + 1][BLOCK_SIZE / SIMD_PACKED_COUNT][2] = {\n"
+    def _matrix_words(self, matrix):
+        simd_packed_count = self._SIMD_SIZE // (matrix.nrows() // 2)
+        if self.cache_layout:
+            groups = (matrix.nrows() // 2) // simd_packed_count
+            return [word for i in reversed(range(groups)) for group in [i, groups + i] for words in self._group_words(matrix, group * simd_packed_count, simd_packed_count) for word in words]
+
+        return [word for i in range(0, matrix.nrows(), simd_packed_count) for words in self._group_words(matrix, i, simd_packed_count) for word in words]
+
+    def tables(self, matrices, vectors):
+        tables = super().tables(matrices, vectors)
+        name, element_type, dimensions, element_bytes, values = tables[0]
+        if self.cache_layout:
+            dimensions = "[ROUNDS + 1][WORD_SIZE / SIMD_PACKED_COUNT][2][2]"
+        else:
+            dimensions = "[ROUNDS + 1][BLOCK_SIZE / SIMD_PACKED_COUNT][2]"
+        return [(name, "simd_union", dimensions, element_bytes, values), tables[1]]
+
+    def _matrices(self, matrices):
+        s = self._table_types()
+
+        if self.cache_layout:
+            s += f"static const simd_union MATRICES[ROUNDS + 1][WORD_SIZE / SIMD_PACKED_COUNT][2][2]{self._table_alignment()} = {{\n"
+        else:
+            s += "static const simd_union MATRICES[ROUNDS + 1][BLOCK_SIZE / SIMD_PACKED_COUNT][2] = {\n"
         for k, matrix in enumerate(matrices):
             s += "    {"
             simd_packed_count = self._SIMD_SIZE // (matrix.nrows() // 2)
-            for i in range(0, matrix.nrows(), simd_packed_count):
-                xparts = []
-                yparts = []
-                for j in range(simd_packed_count):
-                    xparts.append(self._to_int_big_endian(matrix[i + j][:matrix.nrows() // 2]))
-                    yparts.append(self._to_int_big_endian(matrix[i + j][matrix.nrows() // 2:]))
-                xparts = ", ".join(map(lambda xpart: f"WORD_CONSTANT_TYPE({xpart})", xparts))
-                yparts = ", ".join(map(lambda ypart: f"WORD_CONSTANT_TYPE({ypart})", yparts))
-                s += f"{{{{{{{xparts}}}}}, {{{{{yparts}}}}}}}"
-                if i + simd_packed_count < matrix.nrows():
-                    s += ", "
+            if self.cache_layout:
+                # Group i and group WORD_SIZE / SIMD_PACKED_COUNT + i are stored next to each other, in the order they are read.
+                groups = (matrix.nrows() // 2) // simd_packed_count
+                s += ", ".join(f"{{{self._group(matrix, i * simd_packed_count, simd_packed_count)}, {self._group(matrix, (groups + i) * simd_packed_count, simd_packed_count)}}}" for i in reversed(range(groups)))
+            else:
+                s += ", ".join(self._group(matrix, i, simd_packed_count) for i in range(0, matrix.nrows(), simd_packed_count))
             s += "}"
             if k + 1 < len(matrices):
                 s += ","
@@ -89,9 +113,44 @@ class SIMDCodeGenerator(BitPackedCodeGenerator):
         s += "};\n"
         return s
 
+    def _group_words(self, matrix, i, simd_packed_count):
+        xparts = []
+        yparts = []
+        for j in range(simd_packed_count):
+            xparts.append(self._to_int_big_endian(matrix[i + j][:matrix.nrows() // 2]))
+            yparts.append(self._to_int_big_endian(matrix[i + j][matrix.nrows() // 2:]))
+        return xparts, yparts
+
+    def _group(self, matrix, i, simd_packed_count):
+        xparts, yparts = self._group_words(matrix, i, simd_packed_count)
+        xparts = ", ".join(map(lambda xpart: f"WORD_CONSTANT_TYPE({xpart})", xparts))
+        yparts = ", ".join(map(lambda ypart: f"WORD_CONSTANT_TYPE({ypart})", yparts))
+        return f"{{{{{{{xparts}}}}}, {{{{{yparts}}}}}}}"
+
+    def _cache_layout_matrix_vector_product(self, simd_packed_count):
+        s = (
+            "static void matrix_vector_product(const simd_union matrix[WORD_SIZE / SIMD_PACKED_COUNT][2][2], const WORD_TYPE xy[2], WORD_TYPE res[2]) {\n"
+            "    SIMD_TYPE xy0 = SIMD_SET1(xy[0]);\n"
+            "    SIMD_TYPE xy1 = SIMD_SET1(xy[1]);\n"
+            "    for (size_t i = 0; i < WORD_SIZE / SIMD_PACKED_COUNT; i++) {\n"
+        )
+
+        s += "        simd_union inter0 = {.simd = SIMD_XOR(SIMD_AND(matrix[i][0][0].simd, xy0), SIMD_AND(matrix[i][0][1].simd, xy1))};\n"
+        for i in reversed(range(simd_packed_count)):
+            s += f"        res[0] = (res[0] << 1) | ((WORD_TYPE) WORD_PARITY_FUNCTION(inter0.words[{i}]));\n"
+
+        s += "        simd_union inter1 = {.simd = SIMD_XOR(SIMD_AND(matrix[i][1][0].simd, xy0), SIMD_AND(matrix[i][1][1].simd, xy1))};\n"
+        for i in reversed(range(simd_packed_count)):
+            s += f"        res[1] = (res[1] << 1) | ((WORD_TYPE) WORD_PARITY_FUNCTION(inter1.words[{i}]));\n"
+
+        s += "    }\n"
+        s += "}\n"
+        s += "\n"
+        return s
+
     def _matrix_vector_product(self, simd_packed_count):
         s = (
-            "void matrix_vector_product(simd_union matrix[BLOCK_SIZE / SIMD_PACKED_COUNT][2], WORD_TYPE xy[2], WORD_TYPE res[2]) {\n"
+            "static void matrix_vector_product(const simd_union matrix[BLOCK_SIZE / SIMD_PACKED_COUNT][2], const WORD_TYPE xy[2], WORD_TYPE res[2]) {\n"
             "    SIMD_TYPE xy0 = SIMD_SET1(xy[0]);\n"
             "    SIMD_TYPE xy1 = SIMD_SET1(xy[1]);\n"
             # We do a reverse loop here for performance reasons.
@@ -111,12 +170,43 @@ class SIMDCodeGenerator(BitPackedCodeGenerator):
         s += "\n"
         return s
 
+    def _interleaved_matrix_vector_product(self, word_size):
+        # Every group of rows is read once for all blocks.
+        simd_packed_count = self._SIMD_SIZE // word_size
+        if self.cache_layout:
+            s = "static void matrix_vector_product_interleaved(const simd_union matrix[WORD_SIZE / SIMD_PACKED_COUNT][2][2], const WORD_TYPE xy[INTERLEAVE][2], WORD_TYPE res[INTERLEAVE][2]) {\n"
+            loop = "for (size_t i = 0; i < WORD_SIZE / SIMD_PACKED_COUNT; i++)"
+            groups = ["matrix[i][0]", "matrix[i][1]"]
+        else:
+            s = "static void matrix_vector_product_interleaved(const simd_union matrix[BLOCK_SIZE / SIMD_PACKED_COUNT][2], const WORD_TYPE xy[INTERLEAVE][2], WORD_TYPE res[INTERLEAVE][2]) {\n"
+            # We do a reverse loop here for performance reasons.
+            loop = "for (size_t i = WORD_SIZE / SIMD_PACKED_COUNT; i-- > 0;)"
+            groups = ["matrix[i]", "matrix[(WORD_SIZE / SIMD_PACKED_COUNT) + i]"]
+        s += "".join(f"    SIMD_TYPE xy{b}[2] = {{SIMD_SET1(xy[{b}][0]), SIMD_SET1(xy[{b}][1])}};\n" for b in range(self.interleave))
+        s += "".join(f"    WORD_TYPE res{b}[2] = {{0, 0}};\n" for b in range(self.interleave))
+        s += f"    {loop} {{\n"
+        for h, group in enumerate(groups):
+            for b in range(self.interleave):
+                s += f"        simd_union inter{b}_{h} = {{.simd = SIMD_XOR(SIMD_AND({group}[0].simd, xy{b}[0]), SIMD_AND({group}[1].simd, xy{b}[1]))}};\n"
+            for i in reversed(range(simd_packed_count)):
+                for b in range(self.interleave):
+                    s += f"        res{b}[{h}] = (res{b}[{h}] << 1) | ((WORD_TYPE) WORD_PARITY_FUNCTION(inter{b}_{h}.words[{i}]));\n"
+        s += "    }\n"
+        s += self._interleaved_result()
+        s += "}\n"
+        return s
+
     def _functions(self, block_size, word_size, rounds):
         simd_packed_count = self._SIMD_SIZE // word_size
-        return self._matrix_vector_product(simd_packed_count) + \
+        return self._PROFILE + \
+               "\n" + \
+               self._PREFETCH_ROUND + \
+               "\n" + \
+               (self._cache_layout_matrix_vector_product(simd_packed_count) if self.cache_layout else self._matrix_vector_product(simd_packed_count)) + \
                "\n" + \
                self._VECTOR_ADDITION + \
                "\n" + \
-               self._MODULAR_ADDITION + \
+               self._modular_operation() + \
                "\n" + \
-               self._ENCRYPT
+               self._ENCRYPT + \
+               self._interleaved_functions(word_size, rounds)
@@ -7,7 +7,7 @@ class SparseMatrixCodeGenerator(CodeGenerator):
     """
 
     _MATRIX_VECTOR_PRODUCT = (
-        "void matrix_vector_product(uint8_t sparse_matrix[][2], uint16_t sparse_matrix_entries, uint8_t xy[BLOCK_SIZE], uint8_t res[BLOCK_SIZE]) {\n"
+        "static void matrix_vector_product(const uint8_t sparse_matrix[][2], uint16_t sparse_matrix_entries, const uint8_t xy[BLOCK_SIZE], uint8_t res[BLOCK_SIZE]) {\n"
         "    for (uint16_t i = 0; i < sparse_matrix_entries; i++) {\n"
         "        res[sparse_matrix[i][0]] ^= xy[sparse_matrix[i][1]];\n"
         "    }\n"
@@ -15,40 +15,64 @@ class SparseMatrixCodeGenerator(CodeGenerator):
     )
 
     _VECTOR_ADDITION = (
-        "void vector_addition(uint8_t sparse_vector[], uint8_t sparse_vector_entries, uint8_t xy[BLOCK_SIZE]) {\n"
+        "static void vector_addition(const uint8_t sparse_vector[], uint8_t sparse_vector_entries, uint8_t xy[BLOCK_SIZE]) {\n"
         "    for (uint8_t i = 0; i < sparse_vector_entries; i++) {\n"
         "        xy[sparse_vector[i]] ^= 1;\n"
         "    }\n"
         "}\n"
     )
 
+    _PREFETCH_ROUND = (
+        "#ifdef WBS_PREFETCH\n"
+        "static inline void prefetch_table(const void *table, size_t size) {\n"
+        "    for (size_t i = 0; i < size; i += 64) {\n"
+        "        __builtin_prefetch((const char *) table + i, 0, 3);\n"
+        "    }\n"
+        "}\n"
+        "\n"
+        "#define PREFETCH_ROUND(r) (prefetch_table(SPARSE_MATRICES[r], 2 * SPARSE_MATRIX_ENTRIES[r]), prefetch_table(SPARSE_VECTORS[r], SPARSE_VECTOR_ENTRIES[r]))\n"
+        "#else\n"
+        "#define PREFETCH_ROUND(r)\n"
+        "#endif\n"
+    )
+
     _ENCRYPT = (
-        "void encrypt(WORD_TYPE p[2], WORD_TYPE c[2]) {\n"
+        "static void encrypt(const WORD_TYPE p[2], WORD_TYPE c[2]) {\n"
         "    uint8_t xy[BLOCK_SIZE];\n"
         "    uint8_t res[BLOCK_SIZE];\n"
         "    to_bits(p[0], p[1], xy);\n"
         "    for (size_t i = 0; i < ROUNDS; i++) {\n"
+        "        PREFETCH_ROUND(i + 1);\n"
         "        memset(&res, 0, BLOCK_SIZE);\n"
-        "        matrix_vector_product(SPARSE_MATRICES[i], SPARSE_MATRIX_ENTRIES[i], xy, res);\n"
-        "        vector_addition(SPARSE_VECTORS[i], SPARSE_VECTOR_ENTRIES[i], res);\n"
-        "        modular_addition(res);\n"
+        "        PROFILE(i, PROFILE_MATRIX_VECTOR_PRODUCT, matrix_vector_product(SPARSE_MATRICES[i], SPARSE_MATRIX_ENTRIES[i], xy, res));\n"
+        "        PROFILE(i, PROFILE_VECTOR_ADDITION, vector_addition(SPARSE_VECTORS[i], SPARSE_VECTOR_ENTRIES[i], res));\n"
+        "        PROFILE(i, PROFILE_MODULAR_ADDITION, modular_addition(res));\n"
         "        memcpy(&xy, &res, sizeof(res));\n"
         "    }\n"
         "\n"
         "    memset(&res, 0, BLOCK_SIZE);\n"
-        "    matrix_vector_product(SPARSE_MATRICES[ROUNDS], SPARSE_MATRIX_ENTRIES[ROUNDS], xy, res);\n"
-        "    vector_addition(SPARSE_VECTORS[ROUNDS], SPARSE_VECTOR_ENTRIES[ROUNDS], res);\n"
+        "    PROFILE(ROUNDS, PROFILE_MATRIX_VECTOR_PRODUCT, matrix_vector_product(SPARSE_MATRICES[ROUNDS], SPARSE_MATRIX_ENTRIES[ROUNDS], xy, res));\n"
+        "    PROFILE(ROUNDS, PROFILE_VECTOR_ADDITION, vector_addition(SPARSE_VECTORS[ROUNDS], SPARSE_VECTOR_ENTRIES[ROUNDS], res));\n"
         "    from_bits(res, &c[0], &c[1]);\n"
         "}\n"
     )
 
+    def table_bytes(self, matrices, vectors):
+        # The entry counts (2 and 1 bytes) and the pointers to the tables of every round.
+        return sum(2 * len(matrix.nonzero_positions()) for matrix in matrices) + \
+               sum(len(vector.nonzero_positions()) for vector in vectors) + \
+               len(matrices) * (2 + 1 + 2 * 8)
+
+    def _layer_operations(self, k, matrix, vector):
+        return {"xors": len(matrix.nonzero_positions()) + len(vector.nonzero_positions()), "ands": 0, "parities": 0}
+
     def _matrices(self, matrices):
         s = ""
-        s1 = "uint16_t SPARSE_MATRIX_ENTRIES[ROUNDS + 1] = {"
-        s2 = "uint8_t (*SPARSE_MATRICES[ROUNDS + 1])[2] = {"
+        s1 = "static const uint16_t SPARSE_MATRIX_ENTRIES[ROUNDS + 1] = {"
+        s2 = "static const uint8_t (*const SPARSE_MATRICES[ROUNDS + 1])[2] = {"
         for k, matrix in enumerate(matrices):
             sparse_matrix = matrix.nonzero_positions()
-            s += f"uint8_t SPARSE_MATRIX_{k}[{len(sparse_matrix)}][2] = {{"
+            s += f"static const uint8_t SPARSE_MATRIX_{k}[{len(sparse_matrix)}][2] = {{"
             for l, (i, j) in enumerate(sparse_matrix):
                 s += f"{{{i}, {j}}}"
                 if l + 1 < len(sparse_matrix):
@@ -66,11 +90,11 @@ class SparseMatrixCodeGenerator(CodeGenerator):
 
     def _vectors(self, vectors):
         s = ""
-        s1 = "uint8_t SPARSE_VECTOR_ENTRIES[ROUNDS + 1] = {"
-        s2 = "uint8_t *SPARSE_VECTORS[ROUNDS + 1] = {"
+        s1 = "static const uint8_t SPARSE_VECTOR_ENTRIES[ROUNDS + 1] = {"
+        s2 = "static const uint8_t *const SPARSE_VECTORS[ROUNDS + 1] = {"
         for k, vector in enumerate(vectors):
             sparse_vector = vector.nonzero_positions()
-            s += f"uint8_t SPARSE_VECTOR_{k}[{len(sparse_vector)}] = {{"
+            s += f"static const uint8_t SPARSE_VECTOR_{k}[{len(sparse_vector)}] = {{"
             for l, i in enumerate(sparse_vector):
                 s += f"{i}"
                 if l + 1 < len(sparse_vector):
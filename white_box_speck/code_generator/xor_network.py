@@ -0,0 +1,94 @@
+import heapq
+
+
+def naive_xor_network(matrix):
+    """
+    Computes the XOR network which computes every output bit of a matrix-vector product separately.
+    :param matrix: the matrix
+    :return: a tuple containing the temporaries (always empty) and, for every row, the list of signals XORed into the output bit
+    """
+    return [], [[j for j in range(matrix.ncols()) if matrix[i][j] != 0] for i in range(matrix.nrows())]
+
+
+def paar_xor_network(matrix):
+    """
+    Computes an XOR network for a matrix-vector product using Paar's greedy heuristic.
+    Signal j < ncols is input bit j, signal ncols + t is temporary t.
+    The heuristic repeatedly replaces the pair of signals which occurs in the most rows by a new temporary, until no pair occurs in more than one row.
+    :param matrix: the matrix
+    :return: a tuple containing the temporaries, each a pair of signals, and, for every row, the list of signals XORed into the output bit
+    """
+    temporaries, rows = naive_xor_network(matrix)
+    rows = [set(row) for row in rows]
+    signal_rows = [set() for _ in range(matrix.ncols())]
+    for i, row in enumerate(rows):
+        for j in row:
+            signal_rows[j].add(i)
+
+    counts = {}
+    for row in rows:
+        row = sorted(row)
+        for k, a in enumerate(row):
+            for b in row[k + 1:]:
+                counts[a, b] = counts.get((a, b), 0) + 1
+
+    # Max-heap of (count, a, b) with lazy updates: stale entries are corrected when they are popped.
+    heap = [(-count, a, b) for (a, b), count in counts.items() if count > 1]
+    heapq.heapify(heap)
+    while heap:
+        count, a, b = heapq.heappop(heap)
+        current = counts.get((a, b), 0)
+        if current != -count:
+            if current > 1:
+                heapq.heappush(heap, (-current, a, b))
+            continue
+
+        t = matrix.ncols() + len(temporaries)
+        temporaries.append((a, b))
+        signal_rows.append(set())
+        new_counts = {}
+        for i in signal_rows[a] & signal_rows[b]:
+            row = rows[i]
+            row.remove(a)
+            row.remove(b)
+            signal_rows[a].remove(i)
+            signal_rows[b].remove(i)
+            for s in row:
+                counts[min(s, a), max(s, a)] -= 1
+                counts[min(s, b), max(s, b)] -= 1
+                new_counts[s] = new_counts.get(s, 0) + 1
+            row.add(t)
+            signal_rows[t].add(i)
+
+        del counts[a, b]
+        for s, count in new_counts.items():
+            counts[s, t] = count
+            if count > 1:
+                heapq.heappush(heap, (-count, s, t))
+
+    return temporaries, [sorted(row) for row in rows]
+
+
+def xor_count(temporaries, rows):
+    """
+    Counts the number of XOR operations in an XOR network.
+    :param temporaries: the temporaries of the XOR network
+    :param rows: the signals XORed into every output bit
+    :return: the number of XOR operations
+    """
+    return len(temporaries) + sum(max(len(row) - 1, 0) for row in rows)
+
+
+def xor_network(matrix, cse):
+    """
+    Computes the XOR network for a matrix-vector product.
+    :param matrix: the matrix
+    :param cse: whether to eliminate common subexpressions using Paar's heuristic
+    :return: a tuple containing the temporaries, the signals XORed into every output bit, and the number of XOR operations before and after eliminating common subexpressions
+    """
+    temporaries, rows = naive_xor_network(matrix)
+    before = xor_count(temporaries, rows)
+    if cse:
+        temporaries, rows = paar_xor_network(matrix)
+
+    return temporaries, rows, before, xor_count(temporaries, rows)
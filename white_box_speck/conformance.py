@@ -0,0 +1,157 @@
+from .code_generator import CodeGenerator
+
+
+class ConformanceCodeGenerator(CodeGenerator):
+    """
+    Generates output C code for a verifier which checks every white-box Speck library against the reference implementation, in a single process.
+    """
+
+    # The default number of random blocks which are checked at once.
+    _CONFORMANCE_CHUNK_BLOCKS = 65536
+
+    # The name of the reference implementation, which is included in the verifier.
+    REFERENCE_SOURCE = "reference_speck.c"
+
+    # The random blocks are generated using xorshift64*, so a run can be reproduced using its seed.
+    _RANDOM_BLOCKS = (
+        "static void random_blocks(uint64_t *state, WORD_TYPE *blocks, size_t n) {\n"
+        "    for (size_t i = 0; i < 2 * n; i++) {\n"
+        "        *state ^= *state >> 12;\n"
+        "        *state ^= *state << 25;\n"
+        "        *state ^= *state >> 27;\n"
+        "        blocks[i] = (WORD_TYPE) ((*state * UINT64_C(2685821657736338717)) >> (64 - WORD_SIZE));\n"
+        "    }\n"
+        "}\n"
+    )
+
+    def __init__(self, key, strategies, **kwargs):
+        """
+        Initializes an instance of ConformanceCodeGenerator with the provided parameters.
+        :param key: the key of the white-box implementations, used by the reference implementation
+        :param strategies: the names of the strategies to check, every strategy exports its functions with the prefix wbs_{strategy}_
+        """
+        super().__init__(**kwargs)
+        self.key = key
+        self.strategies = strategies
+
+    def _defines(self, block_size, word_size, rounds):
+        # The reference implementation defines WORD_SIZE itself.
+        key_size = len(self.key) * word_size
+        key = ", ".join(f"0x{k:x}" for k in self.key)
+        return self._define_block_size(block_size) + \
+               f"#define KEY_SIZE {key_size}\n" + \
+               self._define_word_type(word_size) + \
+               self._define_word_in_type(word_size) + \
+               self._define_word_out_type(word_size) + \
+               f"#define ALPHA {7 if word_size == 16 else 8}\n" + \
+               f"#define BETA {2 if word_size == 16 else 3}\n" + \
+               self._define_rounds(rounds) + \
+               f"#define KEY {{{key}}}\n" + \
+               f"#define CONFORMANCE_CHUNK_BLOCKS {self._CONFORMANCE_CHUNK_BLOCKS}\n" + \
+               f"#define SPECK_NO_MAIN\n" + \
+               f"#include \"{self.REFERENCE_SOURCE}\"\n"
+
+    def _matrices(self, matrices):
+        return ""
+
+    def _vectors(self, vectors):
+        return ""
+
+    def _declarations(self):
+        # These functions are exported by the libraries which are linked with the verifier.
+        function = "decrypt_blocks" if self.decrypt else "encrypt_blocks"
+        s = (
+            f"void wbs_inverse_input_external_encoding_blocks(const WORD_TYPE *in, WORD_TYPE *out, size_t n);\n"
+            f"void wbs_inverse_output_external_encoding_blocks(const WORD_TYPE *in, WORD_TYPE *out, size_t n);\n"
+        )
+        for strategy in self.strategies:
+            s += f"void wbs_{strategy}_{function}(const WORD_TYPE *in, WORD_TYPE *out, size_t n);\n"
+        s += (
+            "\n"
+            "static const struct strategy {\n"
+            "    const char *name;\n"
+            "    void (*blocks)(const WORD_TYPE *, WORD_TYPE *, size_t);\n"
+            "} STRATEGIES[] = {\n"
+        )
+        for strategy in self.strategies:
+            s += f"    {{\"{strategy}\", wbs_{strategy}_{function}}},\n"
+        s += "};\n"
+        return s
+
+    def _check(self):
+        # A decryption implementation must return the plaintexts of the ciphertexts computed by the reference implementation.
+        if self.decrypt:
+            inputs, expected = "ciphertexts", "plaintexts"
+        else:
+            inputs, expected = "plaintexts", "ciphertexts"
+        return (
+            f"static int check(uint64_t seed, size_t blocks, WORD_TYPE *plaintexts, WORD_TYPE *ciphertexts, WORD_TYPE *encoded, WORD_TYPE *out, WORD_TYPE *actual) {{\n"
+            f"    WORD_TYPE key[KEY_WORDS] = KEY;\n"
+            f"    WORD_TYPE k[ROUNDS];\n"
+            f"    key_expansion(key, k);\n"
+            f"    uint64_t state = seed;\n"
+            f"    for (size_t first = 0; first < blocks; first += CONFORMANCE_CHUNK_BLOCKS) {{\n"
+            f"        size_t n = blocks - first < CONFORMANCE_CHUNK_BLOCKS ? blocks - first : CONFORMANCE_CHUNK_BLOCKS;\n"
+            f"        random_blocks(&state, plaintexts, n);\n"
+            f"        encrypt_blocks(k, plaintexts, ciphertexts, n);\n"
+            f"        wbs_inverse_input_external_encoding_blocks({inputs}, encoded, n);\n"
+            f"        for (size_t s = 0; s < sizeof(STRATEGIES) / sizeof(STRATEGIES[0]); s++) {{\n"
+            f"            STRATEGIES[s].blocks(encoded, out, n);\n"
+            f"            wbs_inverse_output_external_encoding_blocks(out, actual, n);\n"
+            f"            for (size_t i = 0; i < n; i++) {{\n"
+            f"                if (actual[2 * i] != {expected}[2 * i] || actual[2 * i + 1] != {expected}[2 * i + 1]) {{\n"
+            f"                    printf(\"Mismatch in %s at block %zu: input %\" WORD_OUT_TYPE \" %\" WORD_OUT_TYPE \", expected %\" WORD_OUT_TYPE \" %\" WORD_OUT_TYPE \", got %\" WORD_OUT_TYPE \" %\" WORD_OUT_TYPE \"\\n\",\n"
+            f"                           STRATEGIES[s].name, first + i, {inputs}[2 * i], {inputs}[2 * i + 1], {expected}[2 * i], {expected}[2 * i + 1], actual[2 * i], actual[2 * i + 1]);\n"
+            f"                    return 1;\n"
+            f"                }}\n"
+            f"            }}\n"
+            f"        }}\n"
+            f"    }}\n"
+            f"    printf(\"%zu strategies agree with the reference implementation on %zu blocks (seed %\" PRIu64 \")\\n\", sizeof(STRATEGIES) / sizeof(STRATEGIES[0]), blocks, seed);\n"
+            f"    return 0;\n"
+            f"}}\n"
+        )
+
+    def _functions(self, block_size, word_size, rounds):
+        return self._declarations() + \
+               "\n" + \
+               self._RANDOM_BLOCKS + \
+               "\n" + \
+               self._check()
+
+    def _main(self):
+        # Usage: ./conformance BLOCKS [SEED]
+        return (
+            f"int main(int argc, char *argv[]) {{\n"
+            f"    size_t blocks;\n"
+            f"    uint64_t seed = 1;\n"
+            f"    if (argc < 2 || sscanf(argv[1], \"%zu\", &blocks) != 1 || blocks == 0 || (argc > 2 && (sscanf(argv[2], \"%\" SCNu64, &seed) != 1 || seed == 0))) {{\n"
+            f"        fprintf(stderr, \"Usage: %s BLOCKS [SEED]\\n\", argv[0]);\n"
+            f"        return -1;\n"
+            f"    }}\n"
+            f"    size_t n = blocks < CONFORMANCE_CHUNK_BLOCKS ? blocks : CONFORMANCE_CHUNK_BLOCKS;\n"
+            f"    WORD_TYPE *buffers = malloc(5 * 2 * n * sizeof(WORD_TYPE));\n"
+            f"    if (buffers == NULL) {{\n"
+            f"        return -1;\n"
+            f"    }}\n"
+            f"    int status = check(seed, blocks, buffers, &buffers[2 * n], &buffers[4 * n], &buffers[6 * n], &buffers[8 * n]);\n"
+            f"    free(buffers);\n"
+            f"    return status;\n"
+            f"}}\n"
+        )
+
+    def generate_code_conformance(self, block_size, rounds):
+        """
+        Generates the C code of the conformance verifier.
+        :param block_size: the block size of the white-box implementations
+        :param rounds: the number of rounds of the white-box implementations
+        :return: the C code
+        """
+        word_size = block_size // 2
+        parts = [
+            self._includes(),
+            self._defines(block_size, word_size, rounds),
+            self._functions(block_size, word_size, rounds),
+            self._main(),
+        ]
+        return "\n".join(parts)
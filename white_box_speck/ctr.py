@@ -0,0 +1,250 @@
+from .code_generator import CodeGenerator
+
+
+class CTRCodeGenerator(CodeGenerator):
+    """
+    Generates output C code for a tool which encrypts files in CTR mode, using a white-box Speck library and the inverse external encodings libraries.
+    """
+
+    # The default number of blocks which are encrypted at once.
+    _CTR_CHUNK_BLOCKS = 65536
+
+    _INCLUDE_FCNTL = "#include <fcntl.h>\n"
+    _INCLUDE_SYS_MMAN = "#include <sys/mman.h>\n"
+    _INCLUDE_SYS_STAT = "#include <sys/stat.h>\n"
+    _INCLUDE_UNISTD = "#include <unistd.h>\n"
+
+    # The counter block of block i is the nonce plus i, where x is the most significant word.
+    _COUNTER_BLOCK = (
+        "static void counter_block(const WORD_TYPE nonce[2], uint64_t i, WORD_TYPE counter[2]) {\n"
+        "    WORD_TYPE low = (WORD_TYPE) (i & WORD_MASK);\n"
+        "    WORD_TYPE high = (WORD_TYPE) ((i >> (WORD_SIZE - 1)) >> 1);\n"
+        "    counter[1] = (nonce[1] + low) & WORD_MASK;\n"
+        "    counter[0] = (nonce[0] + high + (counter[1] < low)) & WORD_MASK;\n"
+        "}\n"
+    )
+
+    # Every keystream block is serialized as the x word followed by the y word, both in little-endian byte order.
+    _XOR_KEYSTREAM = (
+        "static void xor_keystream(const WORD_TYPE *keystream, const uint8_t *in, uint8_t *out, size_t size) {\n"
+        "    for (size_t i = 0; i * BLOCK_BYTES < size; i++) {\n"
+        "        for (size_t j = 0; j < BLOCK_BYTES && i * BLOCK_BYTES + j < size; j++) {\n"
+        "            out[i * BLOCK_BYTES + j] = in[i * BLOCK_BYTES + j] ^ (uint8_t) (keystream[2 * i + j / WORD_BYTES] >> (8 * (j % WORD_BYTES)));\n"
+        "        }\n"
+        "    }\n"
+        "}\n"
+    )
+
+    # Larger nonce words would carry into the wrong bits of the counter blocks, so they are rejected.
+    _PARSE_NONCE_WORD = (
+        "static int parse_nonce_word(const char *arg, WORD_TYPE *word) {\n"
+        "    uint64_t value;\n"
+        "    if (sscanf(arg, \"%\" SCNx64, &value) != 1 || value > WORD_MASK) {\n"
+        "        fprintf(stderr, \"Invalid nonce word: %s\\n\", arg);\n"
+        "        return -1;\n"
+        "    }\n"
+        "    *word = (WORD_TYPE) value;\n"
+        "    return 0;\n"
+        "}\n"
+    )
+
+    def _includes(self):
+        return self._INCLUDE_INTTYPES + \
+               self._INCLUDE_STDDEF + \
+               self._INCLUDE_STDIO + \
+               self._INCLUDE_STDLIB + \
+               self._INCLUDE_STRING + \
+               self._INCLUDE_FCNTL + \
+               self._INCLUDE_SYS_MMAN + \
+               self._INCLUDE_SYS_STAT + \
+               self._INCLUDE_UNISTD
+
+    def _define_block_bytes(self, block_size):
+        return f"#define BLOCK_BYTES {block_size // 8}\n"
+
+    def _define_word_bytes(self, word_size):
+        return f"#define WORD_BYTES {word_size // 8}\n"
+
+    def _define_word_mask(self, word_size):
+        return f"#define WORD_MASK 0x{(1 << word_size) - 1:02x}\n"
+
+    def _define_ctr_chunk_blocks(self):
+        return f"#define CTR_CHUNK_BLOCKS {self._CTR_CHUNK_BLOCKS}\n"
+
+    def _defines(self, block_size, word_size, rounds):
+        return self._define_block_size(block_size) + \
+               self._define_word_size(word_size) + \
+               self._define_word_type(word_size) + \
+               self._define_block_bytes(block_size) + \
+               self._define_word_bytes(word_size) + \
+               self._define_word_mask(word_size) + \
+               self._define_ctr_chunk_blocks()
+
+    def _matrices(self, matrices):
+        return ""
+
+    def _vectors(self, vectors):
+        return ""
+
+    def _declarations(self):
+        # These functions are exported by the libraries which are linked with the tool.
+        prefix = self.symbol_prefix
+        s = (
+            f"size_t {prefix}block_size(void);\n"
+            f"void {prefix}encrypt_blocks(const WORD_TYPE *in, WORD_TYPE *out, size_t n);\n"
+            f"void {prefix}inverse_input_external_encoding_blocks(const WORD_TYPE *in, WORD_TYPE *out, size_t n);\n"
+            f"void {prefix}inverse_output_external_encoding_blocks(const WORD_TYPE *in, WORD_TYPE *out, size_t n);\n"
+        )
+        if self.parallel:
+            s += f"void {prefix}encrypt_blocks_parallel(const WORD_TYPE *in, WORD_TYPE *out, size_t n, size_t threads);\n"
+        return s
+
+    def _ctr(self):
+        prefix = self.symbol_prefix
+        if self.parallel:
+            encrypt_blocks = f"{prefix}encrypt_blocks_parallel(keystream, counters, n, threads)"
+        else:
+            encrypt_blocks = f"{prefix}encrypt_blocks(keystream, counters, n)"
+        return (
+            f"static void ctr(const WORD_TYPE nonce[2], const uint8_t *in, uint8_t *out, size_t size, size_t chunk_blocks, size_t threads, WORD_TYPE *counters, WORD_TYPE *keystream) {{\n"
+            f"    size_t blocks = (size + BLOCK_BYTES - 1) / BLOCK_BYTES;\n"
+            f"    for (size_t first = 0; first < blocks; first += chunk_blocks) {{\n"
+            f"        size_t n = blocks - first < chunk_blocks ? blocks - first : chunk_blocks;\n"
+            f"        for (size_t i = 0; i < n; i++) {{\n"
+            f"            counter_block(nonce, first + i, &counters[2 * i]);\n"
+            f"        }}\n"
+            f"        // The counter blocks are plaintexts, so they are encoded before and decoded after the white-box implementation.\n"
+            f"        {prefix}inverse_input_external_encoding_blocks(counters, keystream, n);\n"
+            f"        {encrypt_blocks};\n"
+            f"        {prefix}inverse_output_external_encoding_blocks(counters, keystream, n);\n"
+            f"        size_t offset = first * BLOCK_BYTES;\n"
+            f"        xor_keystream(keystream, &in[offset], &out[offset], size - offset < n * BLOCK_BYTES ? size - offset : n * BLOCK_BYTES);\n"
+            f"    }}\n"
+            f"}}\n"
+        )
+
+    def _functions(self, block_size, word_size, rounds):
+        return self._declarations() + \
+               "\n" + \
+               self._COUNTER_BLOCK + \
+               "\n" + \
+               self._XOR_KEYSTREAM + \
+               "\n" + \
+               self._PARSE_NONCE_WORD + \
+               "\n" + \
+               self._ctr()
+
+    def _main(self):
+        # Usage: ./speck_ctr [--chunk-blocks CHUNK_BLOCKS] [--threads THREADS] NONCE_X NONCE_Y INPUT OUTPUT
+        # --threads is only accepted if the tool uses the multithreaded bulk encryption function.
+        if self.parallel:
+            threads = (
+                f"        }} else if (strcmp(argv[arg], \"--threads\") == 0) {{\n"
+                f"            sscanf(argv[arg + 1], \"%zu\", &threads);\n"
+            )
+        else:
+            threads = (
+                f"        }} else if (strcmp(argv[arg], \"--threads\") == 0) {{\n"
+                f"            fprintf(stderr, \"--threads requires a white-box implementation generated with --parallel\\n\");\n"
+                f"            return -1;\n"
+            )
+        return (
+            f"int main(int argc, char *argv[]) {{\n"
+            f"    size_t chunk_blocks = CTR_CHUNK_BLOCKS;\n"
+            f"    size_t threads = 1;\n"
+            f"    int arg = 1;\n"
+            f"    while (arg + 1 < argc && argv[arg][0] == '-' && argv[arg][1] == '-') {{\n"
+            f"        if (strcmp(argv[arg], \"--chunk-blocks\") == 0) {{\n"
+            f"            sscanf(argv[arg + 1], \"%zu\", &chunk_blocks);\n"
+            f"{threads}"
+            f"        }} else {{\n"
+            f"            break;\n"
+            f"        }}\n"
+            f"        arg += 2;\n"
+            f"    }}\n"
+            f"    if (argc - arg != 4 || chunk_blocks == 0 || threads == 0) {{\n"
+            f"        fprintf(stderr, \"Usage: %s [--chunk-blocks CHUNK_BLOCKS]{' [--threads THREADS]' if self.parallel else ''} NONCE_X NONCE_Y INPUT OUTPUT\\n\", argv[0]);\n"
+            f"        return -1;\n"
+            f"    }}\n"
+            f"    if ({self.symbol_prefix}block_size() != BLOCK_SIZE) {{\n"
+            f"        fprintf(stderr, \"Expected a white-box implementation with block size %d\\n\", BLOCK_SIZE);\n"
+            f"        return -1;\n"
+            f"    }}\n"
+            f"\n"
+            f"    WORD_TYPE nonce[2];\n"
+            f"    if (parse_nonce_word(argv[arg], &nonce[0]) != 0 || parse_nonce_word(argv[arg + 1], &nonce[1]) != 0) {{\n"
+            f"        return -1;\n"
+            f"    }}\n"
+            f"\n"
+            f"    // Every error releases everything which was acquired before it.\n"
+            f"    int status = -1;\n"
+            f"    int out_fd = -1;\n"
+            f"    size_t size = 0;\n"
+            f"    const uint8_t *in = MAP_FAILED;\n"
+            f"    uint8_t *out = MAP_FAILED;\n"
+            f"    WORD_TYPE *counters = NULL;\n"
+            f"    WORD_TYPE *keystream = NULL;\n"
+            f"    struct stat in_stat;\n"
+            f"    int in_fd = open(argv[arg + 2], O_RDONLY);\n"
+            f"    if (in_fd < 0 || fstat(in_fd, &in_stat) != 0) {{\n"
+            f"        perror(argv[arg + 2]);\n"
+            f"        goto cleanup;\n"
+            f"    }}\n"
+            f"    size = (size_t) in_stat.st_size;\n"
+            f"    out_fd = open(argv[arg + 3], O_RDWR | O_CREAT | O_TRUNC, 0644);\n"
+            f"    if (out_fd < 0 || ftruncate(out_fd, in_stat.st_size) != 0) {{\n"
+            f"        perror(argv[arg + 3]);\n"
+            f"        goto cleanup;\n"
+            f"    }}\n"
+            f"\n"
+            f"    // An empty file cannot be mapped, and its output is empty.\n"
+            f"    if (size > 0) {{\n"
+            f"        in = mmap(NULL, size, PROT_READ, MAP_PRIVATE, in_fd, 0);\n"
+            f"        out = mmap(NULL, size, PROT_READ | PROT_WRITE, MAP_SHARED, out_fd, 0);\n"
+            f"        counters = malloc(2 * chunk_blocks * sizeof(WORD_TYPE));\n"
+            f"        keystream = malloc(2 * chunk_blocks * sizeof(WORD_TYPE));\n"
+            f"        if (in == MAP_FAILED || out == MAP_FAILED || counters == NULL || keystream == NULL) {{\n"
+            f"            perror(\"Unable to map the files\");\n"
+            f"            goto cleanup;\n"
+            f"        }}\n"
+            f"        madvise((void *) in, size, MADV_SEQUENTIAL);\n"
+            f"        madvise(out, size, MADV_SEQUENTIAL);\n"
+            f"        ctr(nonce, in, out, size, chunk_blocks, threads, counters, keystream);\n"
+            f"    }}\n"
+            f"    status = 0;\n"
+            f"\n"
+            f"cleanup:\n"
+            f"    free(counters);\n"
+            f"    free(keystream);\n"
+            f"    if (in != MAP_FAILED) {{\n"
+            f"        munmap((void *) in, size);\n"
+            f"    }}\n"
+            f"    if (out != MAP_FAILED && munmap(out, size) != 0) {{\n"
+            f"        perror(argv[arg + 3]);\n"
+            f"        status = -1;\n"
+            f"    }}\n"
+            f"    if (in_fd >= 0) {{\n"
+            f"        close(in_fd);\n"
+            f"    }}\n"
+            f"    if (out_fd >= 0 && close(out_fd) != 0) {{\n"
+            f"        perror(argv[arg + 3]);\n"
+            f"        status = -1;\n"
+            f"    }}\n"
+            f"    return status;\n"
+            f"}}\n"
+        )
+
+    def generate_code_ctr(self, block_size):
+        """
+        Generates the C code of the CTR mode tool.
+        :param block_size: the block size of the white-box implementation
+        :return: the C code
+        """
+        word_size = block_size // 2
+        parts = [
+            self._includes(),
+            self._defines(block_size, word_size, None),
+            self._functions(block_size, word_size, None),
+            self._main(),
+        ]
+        return "\n".join(parts)
@@ -33,10 +33,74 @@ def random_linear_external_encoding(word_size):
             return M, v
 
 
+def _external_encoding_blocks(name):
+    return (
+        f"static void {name}_blocks(const WORD_TYPE *in, WORD_TYPE *out, size_t n) {{\n"
+        f"    for (size_t i = 0; i < n; i++) {{\n"
+        f"        {name}(&in[2 * i], &out[2 * i]);\n"
+        f"    }}\n"
+        f"}}\n"
+    )
+
+
+def _external_encoding_library_functions(prefix, name):
+    # Only these functions are exported, so the external encodings can be linked together with a white-box implementation.
+    return (
+        f"void {prefix}{name}(const WORD_TYPE p[2], WORD_TYPE c[2]) {{\n"
+        f"    {name}(p, c);\n"
+        f"}}\n"
+        f"\n"
+        f"void {prefix}{name}_blocks(const WORD_TYPE *in, WORD_TYPE *out, size_t n) {{\n"
+        f"    {name}_blocks(in, out, n);\n"
+        f"}}\n"
+    )
+
+
+def _external_encoding_main(code_generator, name):
+    # Usage: ./inverse_*_external_encoding X Y, or --stream or --stream-binary to transform the blocks from stdin.
+    return code_generator._stream_functions() + \
+           "\n" + \
+           (
+               f"int main(int argc, char *argv[]) {{\n"
+               f"    WORD_TYPE xy[2];\n"
+               f"    WORD_TYPE res[2];\n"
+               f"{code_generator._main_stream(name + '_blocks')}"
+               f"    if (argc < 3) {{\n"
+               f"        return -1;\n"
+               f"    }} else {{\n"
+               f"        sscanf(argv[1], \"%\" WORD_IN_TYPE, &xy[0]);\n"
+               f"        sscanf(argv[2], \"%\" WORD_IN_TYPE, &xy[1]);\n"
+               f"        {name}(xy, res);\n"
+               f"        printf(\"%\" WORD_OUT_TYPE \" %\" WORD_OUT_TYPE \"\\n\", res[0], res[1]);\n"
+               f"    }}\n"
+               f"}}\n"
+           )
+
+
 class InputExternalEncodingCodeGenerator(BitPackedCodeGenerator):
-    _MODULAR_SUBTRACTION = (
-        "void modular_subtraction(WORD_TYPE xy[2]) {\n"
-        "    xy[0] -= xy[1];\n"
+    # The first matrix is the rotation of the first round, but the function reads all three layers from the tables.
+    _STRUCTURED_ROUNDS = False
+
+    _INVERSE_INPUT_EXTERNAL_ENCODING = (
+        "static void inverse_input_external_encoding(const WORD_TYPE p[2], WORD_TYPE c[2]) {\n"
+        "    WORD_TYPE xy[2];\n"
+        "    WORD_TYPE res[2];\n"
+        "    xy[0] = p[0];\n"
+        "    xy[1] = p[1];\n"
+        "    res[0] = 0;\n"
+        "    res[1] = 0;\n"
+        "    matrix_vector_product(MATRICES[0], xy, res);\n"
+        "    vector_addition(VECTORS[0], res);\n"
+        "    modular_addition(res);\n"
+        "    vector_addition(VECTORS[1], res);\n"
+        "    xy[0] = 0;\n"
+        "    xy[1] = 0;\n"
+        "    matrix_vector_product(MATRICES[1], res, xy);\n"
+        "    modular_subtraction(xy);\n"
+        "    vector_addition(VECTORS[2], xy);\n"
+        "    c[0] = 0;\n"
+        "    c[1] = 0;\n"
+        "    matrix_vector_product(MATRICES[2], xy, c);\n"
         "}\n"
     )
 
@@ -47,36 +111,18 @@ class InputExternalEncodingCodeGenerator(BitPackedCodeGenerator):
                "\n" + \
                self._MODULAR_ADDITION + \
                "\n" + \
-               self._MODULAR_SUBTRACTION
+               self._MODULAR_SUBTRACTION + \
+               "\n" + \
+               self._INVERSE_INPUT_EXTERNAL_ENCODING
+
+    def _bulk_functions(self):
+        return _external_encoding_blocks("inverse_input_external_encoding")
+
+    def _library_functions(self):
+        return _external_encoding_library_functions(self.symbol_prefix, "inverse_input_external_encoding")
 
     def _main(self):
-        return (
-            f"int main(int argc, char *argv[]) {{\n"
-            f"    WORD_TYPE xy[2];\n"
-            f"    WORD_TYPE res[2];\n"
-            f"    if (argc < 3) {{\n"
-            f"        return -1;\n"
-            f"    }} else {{\n"
-            f"        sscanf(argv[1], \"%\" WORD_IN_TYPE, &xy[0]);\n"
-            f"        sscanf(argv[2], \"%\" WORD_IN_TYPE, &xy[1]);\n"
-            f"        res[0] = 0;\n"
-            f"        res[1] = 0;\n"
-            f"        matrix_vector_product(MATRICES[0], xy, res);\n"
-            f"        vector_addition(VECTORS[0], res);\n"
-            f"        modular_addition(res);\n"
-            f"        vector_addition(VECTORS[1], res);\n"
-            f"        xy[0] = 0;\n"
-            f"        xy[1] = 0;\n"
-            f"        matrix_vector_product(MATRICES[1], res, xy);\n"
-            f"        modular_subtraction(xy);\n"
-            f"        vector_addition(VECTORS[2], xy);\n"
-            f"        res[0] = 0;\n"
-            f"        res[1] = 0;\n"
-            f"        matrix_vector_product(MATRICES[2], xy, res);\n"
-            f"        printf(\"%\" WORD_OUT_TYPE \" %\" WORD_OUT_TYPE \"\\n\", res[0], res[1]);\n"
-            f"    }}\n"
-            f"}}\n"
-        )
+        return _external_encoding_main(self, "inverse_input_external_encoding")
 
     def generate_code_inverse_input_external_encoding(self, matrix0, vector0, external_encoding):
         matrix, vector = external_encoding
@@ -84,32 +130,47 @@ class InputExternalEncodingCodeGenerator(BitPackedCodeGenerator):
 
 
 class OutputExternalEncodingCodeGenerator(BitPackedCodeGenerator):
+    # The name of the generated function, which computes M^-1 (x + v) for an external encoding M and v.
+    _NAME = "inverse_output_external_encoding"
+
+    def _inverse_external_encoding(self):
+        return (
+            f"static void {self._NAME}(const WORD_TYPE p[2], WORD_TYPE c[2]) {{\n"
+            f"    WORD_TYPE xy[2];\n"
+            f"    xy[0] = p[0];\n"
+            f"    xy[1] = p[1];\n"
+            f"    vector_addition(VECTORS[0], xy);\n"
+            f"    c[0] = 0;\n"
+            f"    c[1] = 0;\n"
+            f"    matrix_vector_product(MATRICES[0], xy, c);\n"
+            f"}}\n"
+        )
+
     def _functions(self, block_size, word_size, rounds):
         return self._MATRIX_VECTOR_PRODUCT + \
                "\n" + \
                self._VECTOR_ADDITION + \
                "\n" + \
-               self._MODULAR_ADDITION
+               self._inverse_external_encoding()
+
+    def _bulk_functions(self):
+        return _external_encoding_blocks(self._NAME)
+
+    def _library_functions(self):
+        return _external_encoding_library_functions(self.symbol_prefix, self._NAME)
 
     def _main(self):
-        return (
-            f"int main(int argc, char *argv[]) {{\n"
-            f"    WORD_TYPE xy[2];\n"
-            f"    WORD_TYPE res[2];\n"
-            f"    if (argc < 3) {{\n"
-            f"        return -1;\n"
-            f"    }} else {{\n"
-            f"        sscanf(argv[1], \"%\" WORD_IN_TYPE, &xy[0]);\n"
-            f"        sscanf(argv[2], \"%\" WORD_IN_TYPE, &xy[1]);\n"
-            f"        vector_addition(VECTORS[0], xy);\n"
-            f"        res[0] = 0;\n"
-            f"        res[1] = 0;\n"
-            f"        matrix_vector_product(MATRICES[0], xy, res);\n"
-            f"        printf(\"%\" WORD_OUT_TYPE \" %\" WORD_OUT_TYPE \"\\n\", res[0], res[1]);\n"
-            f"    }}\n"
-            f"}}\n"
-        )
+        return _external_encoding_main(self, self._NAME)
 
     def generate_code_inverse_output_external_encoding(self, external_encoding):
         matrix, vector = external_encoding
         return self.generate_code([matrix.inverse()], [vector])
+
+
+class DecryptionInputExternalEncodingCodeGenerator(OutputExternalEncodingCodeGenerator):
+    # The input external encoding of a decryption implementation is applied directly before the first affine layer.
+    _NAME = "inverse_input_external_encoding"
+
+    def generate_code_inverse_input_external_encoding(self, external_encoding):
+        matrix, vector = external_encoding
+        return self.generate_code([matrix.inverse()], [vector])
@@ -0,0 +1,158 @@
+"""
+Binds a white-box Speck implementation compiled as a shared library using ctypes.
+This module does not depend on SageMath or on the rest of this package, so it can be deployed on its own next to the library.
+"""
+import ctypes
+import os
+
+
+class _Py_buffer(ctypes.Structure):
+    _fields_ = [
+        ("buf", ctypes.c_void_p),
+        ("obj", ctypes.c_void_p),
+        ("len", ctypes.c_ssize_t),
+        ("itemsize", ctypes.c_ssize_t),
+        ("readonly", ctypes.c_int),
+        ("ndim", ctypes.c_int),
+        ("format", ctypes.c_char_p),
+        ("shape", ctypes.POINTER(ctypes.c_ssize_t)),
+        ("strides", ctypes.POINTER(ctypes.c_ssize_t)),
+        ("suboffsets", ctypes.POINTER(ctypes.c_ssize_t)),
+        ("internal", ctypes.c_void_p),
+    ]
+
+
+_PyBUF_SIMPLE = 0
+_PyBUF_WRITABLE = 1
+
+_PyObject_GetBuffer = ctypes.pythonapi.PyObject_GetBuffer
+_PyObject_GetBuffer.argtypes = [ctypes.py_object, ctypes.POINTER(_Py_buffer), ctypes.c_int]
+_PyObject_GetBuffer.restype = ctypes.c_int
+
+_PyBuffer_Release = ctypes.pythonapi.PyBuffer_Release
+_PyBuffer_Release.argtypes = [ctypes.POINTER(_Py_buffer)]
+_PyBuffer_Release.restype = None
+
+
+class WhiteBoxSpeckLibrary:
+    """
+    Class to encrypt or decrypt buffers using a white-box Speck shared library.
+    """
+
+    def __init__(self, path, symbol_prefix="wbs_"):
+        """
+        Initializes an instance of WhiteBoxSpeckLibrary with the provided parameters.
+        :param path: the path of the shared library
+        :param symbol_prefix: the prefix of the functions exported by the shared library
+        """
+        # Functions of a CDLL release the GIL while they are called.
+        self._library = ctypes.CDLL(path)
+
+        block_size = getattr(self._library, symbol_prefix + "block_size")
+        block_size.argtypes = []
+        block_size.restype = ctypes.c_size_t
+        word_bytes = getattr(self._library, symbol_prefix + "word_bytes")
+        word_bytes.argtypes = []
+        word_bytes.restype = ctypes.c_size_t
+
+        self.block_size = block_size()
+        self.block_bytes = 2 * word_bytes()
+
+        # A library exports encrypt_blocks or decrypt_blocks, depending on whether it was generated with --decrypt.
+        self._encrypt_blocks = self._blocks_function(symbol_prefix + "encrypt_blocks")
+        self._decrypt_blocks = self._blocks_function(symbol_prefix + "decrypt_blocks")
+
+        # Only libraries generated with --mapped-table-files export load_tables.
+        self._load_tables = getattr(self._library, symbol_prefix + "load_tables", None)
+        if self._load_tables is not None:
+            self._load_tables.argtypes = [ctypes.c_char_p]
+            self._load_tables.restype = ctypes.c_int
+        self._tables_loaded = getattr(self._library, symbol_prefix + "tables_loaded", None)
+        if self._tables_loaded is not None:
+            self._tables_loaded.argtypes = []
+            self._tables_loaded.restype = ctypes.c_int
+
+    def _blocks_function(self, name):
+        try:
+            function = getattr(self._library, name)
+        except AttributeError:
+            return None
+        function.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t]
+        function.restype = None
+        return function
+
+    def _check_itemsize(self, buffer, name):
+        # A buffer of larger or smaller items than the words of the library (e.g. a np.uint64 array for 32-bit words) would be split into the wrong words.
+        itemsize = memoryview(buffer).itemsize
+        if itemsize not in (1, self.block_bytes // 2):
+            raise ValueError(f"Expected {name} items of 1 or {self.block_bytes // 2} bytes but got items of {itemsize} bytes")
+
+    def _check_tables_loaded(self):
+        # A library with mapped table files has no tables if its own mapped table file could not be loaded, and would dereference a null pointer.
+        if self._tables_loaded is not None and self._tables_loaded() == 0:
+            raise RuntimeError("The library has not loaded its tables from a mapped table file, use load_tables first")
+
+    def _transform(self, blocks_function, buffer, out):
+        self._check_itemsize(buffer, "input")
+        if out is None:
+            out = bytearray(memoryview(buffer).nbytes)
+        else:
+            self._check_itemsize(out, "output")
+
+        in_view = _Py_buffer()
+        out_view = _Py_buffer()
+        if _PyObject_GetBuffer(buffer, ctypes.byref(in_view), _PyBUF_SIMPLE) != 0:
+            raise BufferError("Unable to get a contiguous buffer from the input")
+        try:
+            if _PyObject_GetBuffer(out, ctypes.byref(out_view), _PyBUF_WRITABLE) != 0:
+                raise BufferError("Unable to get a writable contiguous buffer from the output")
+            try:
+                if in_view.len % self.block_bytes != 0:
+                    raise ValueError(f"Expected a multiple of {self.block_bytes} bytes but got {in_view.len} bytes")
+                if out_view.len != in_view.len:
+                    raise ValueError(f"Expected an output of {in_view.len} bytes but got {out_view.len} bytes")
+
+                blocks_function(in_view.buf, out_view.buf, in_view.len // self.block_bytes)
+            finally:
+                _PyBuffer_Release(ctypes.byref(out_view))
+        finally:
+            _PyBuffer_Release(ctypes.byref(in_view))
+
+        return out
+
+    def load_tables(self, path):
+        """
+        Replaces the tables of the library with the tables in a mapped table file, e.g. to rotate the key without recompiling, or raises a RuntimeError if the library was not generated with --mapped-table-files.
+        The tables must not be replaced while another thread encrypts or decrypts using the library.
+        :param path: the path of the mapped table file
+        """
+        if self._load_tables is None:
+            raise RuntimeError("The library does not load its tables from a mapped table file")
+        if self._load_tables(os.fsencode(path)) != 0:
+            raise OSError(f"Unable to load the tables from {path}")
+
+    def encrypt(self, buffer, out=None):
+        """
+        Encrypts the blocks in a buffer without copying it, or raises a RuntimeError if the library was generated with --decrypt or has not loaded its tables.
+        Every block consists of the x word followed by the y word, in the word type and byte order of the library.
+        :param buffer: the plaintext blocks, any contiguous object supporting the buffer protocol (e.g. bytes, bytearray, memoryview, or a NumPy array) with items of 1 byte or of the word size
+        :param out: the writable buffer to store the ciphertext blocks in, of the same size as buffer (default: a new bytearray)
+        :return: the buffer containing the ciphertext blocks
+        """
+        if self._encrypt_blocks is None:
+            raise RuntimeError("The library does not contain an encryption implementation")
+        self._check_tables_loaded()
+        return self._transform(self._encrypt_blocks, buffer, out)
+
+    def decrypt(self, buffer, out=None):
+        """
+        Decrypts the blocks in a buffer without copying it, or raises a RuntimeError if the library was not generated with --decrypt or has not loaded its tables.
+        Every block consists of the x word followed by the y word, in the word type and byte order of the library.
+        :param buffer: the ciphertext blocks, any contiguous object supporting the buffer protocol (e.g. bytes, bytearray, memoryview, or a NumPy array) with items of 1 byte or of the word size
+        :param out: the writable buffer to store the plaintext blocks in, of the same size as buffer (default: a new bytearray)
+        :return: the buffer containing the plaintext blocks
+        """
+        if self._decrypt_blocks is None:
+            raise RuntimeError("The library does not contain a decryption implementation")
+        self._check_tables_loaded()
+        return self._transform(self._decrypt_blocks, buffer, out)